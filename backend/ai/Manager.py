@@ -1,12 +1,13 @@
 from attr import dataclass
-from ai.assistant_functions.python_interpreter import python_interpreter
+from ai.assistant_functions.python_interpreter import list_interpreter_variables, python_interpreter
 from ai.assistant_functions.memory_functions import add_memory, get_memory
-from custom import Agent
+from custom import Agent, RunContext
 
 # from custom.models.gemini import GeminiModel
 # from custom.providers.google_gla import GoogleGLAProvider
 import os
 import logging
+from typing import Optional
 
 # from pydantic_ai import agent_tool # Assuming you'll use agent_tool later, but not crucial for this core logic.
 from dotenv import load_dotenv
@@ -24,6 +25,7 @@ from ai.assistant_functions.user_functions import (
     get_user_teams,
     get_user_channels,
     get_user_licenses,
+    get_licenses_for_users,
     list_available_licenses,
     add_license_to_user,
     set_user_usage_location,
@@ -55,10 +57,15 @@ from ai.assistant_functions.sharepoint_functions import (
     traverse_sharepoint_directory_by_item_id,
     search_sharepoint_graph,
 )
+from ai.assistant_functions.tool_result_functions import (
+    page_large_results,
+    read_tool_result,
+)
 
 from custom.models.gemini import GeminiModel
 from custom.providers.google_gla import GoogleGLAProvider
 from custom.common_tools.tavily import tavily_search_tool
+from helpers.EventStream import ToolProgress
 from helpers.Firebase_helpers import FirebaseUser
 from datetime import datetime
 # Remove unused import
@@ -104,6 +111,7 @@ You have access to the following tools provided by the `GraphManager` class:
 *   `get_user`: Gets details for a specific user.
 *   `update_user`: Updates a user's properties.
 *   `get_user_licenses`: Gets licenses for a specific user.
+*   `get_licenses_for_users`: Gets licenses for several users in one batched call.
 *   `delete_user`: Deletes a user.
 *   `delete_team`: Deletes a team.
 *   `search_teams`: Searches for teams.
@@ -111,6 +119,8 @@ You have access to the following tools provided by the `GraphManager` class:
 *   `list_channels`: Lists channels within a team.
 *   `delete_channel`: Deletes a channel.
 *   `python_interpreter`: Executes Python code.
+*   `list_interpreter_variables`: Lists the variables kept in this conversation's Python session.
+*   `read_tool_result`: Pages, filters or aggregates a large tool result stored behind a `result_handle`.
 """
 
 
@@ -356,6 +366,7 @@ def get_system_prompt(user_object: FirebaseUser, memory: str) -> str:
         1. Use the `python_interpreter` tool to import and call the *single* appropriate `_no_ctx` function (e.g., `list_users_no_ctx`).
         2. *Then*, process the results returned by that function within the same Python code block (e.g., `count = len(users_from_no_ctx_call)`).
     *   **Choose the method that fits the overall task best.** Method 1 is good if you just need the data displayed or passed to another tool. Method 2 is better if you need to immediately perform Python operations (like counting, filtering) on the data.
+*   **Large Results:** When a tool returns a `result_handle` with `row_count`, `columns` and `first_rows` instead of the full data, the rows are stored on the server. Use `read_tool_result` with that handle to page (`offset`/`limit`), filter (`filter_field`/`filter_value`), select `fields` or compute counts and sums (`aggregate`, `group_by`). **Do not call the original tool again** just to see more rows. Inside `python_interpreter`, read the same handle with `from ai.assistant_functions.tool_result_functions import read_tool_result_no_ctx` (same arguments, e.g. `page, error = read_tool_result_no_ctx(handle, limit=200)`).
 *   **Tool Call Size Limits:** Tool calls (the JSON you generate to invoke a tool) are sent as a single unit. Very large JSON payloads *might* time out. Keep individual tool call requests reasonably sized.
 *   **Chunking Large Data:** If processing a large dataset requires multiple tool interactions (e.g., fetching members from many large teams), **chunk the work** into smaller, sequential tool calls rather than one massive, potentially failing call.
 *   **Concurrency:** You **CAN** call multiple tool functions simultaneously within a single turn if the user's request requires it (e.g., listing channels for several specified teams). Group related actions together for efficiency.
@@ -369,6 +380,8 @@ def get_system_prompt(user_object: FirebaseUser, memory: str) -> str:
 
 ### **Python Interpreter (`python_interpreter`)**
 
+*   **Persistent Session:** Variables, imports and functions from earlier `python_interpreter` calls in this conversation are kept. Fetch directory data once (e.g. `users, error = list_users_no_ctx()`) and reuse the variable in later steps instead of fetching it again. Use `list_interpreter_variables` to see what is held. The session is cleared after a timeout, a crash or a long idle period, so re-create variables if they are gone.
+*   **Directory Snapshot:** A `directory` object is predefined in every `python_interpreter` call. `directory.users`, `directory.licenses` (one row per assigned license with the user's department), `directory.teams`, `directory.channels` and `directory.skus` are pandas DataFrames of the tenant as of the last directory sync. Use them for counting, grouping and filtering across the tenant instead of paging through `list_users_no_ctx` results, e.g. `directory.licenses[directory.licenses.sku == "ENTERPRISEPACK"].groupby("department").user_id.nunique()`. Use the live functions when the answer must reflect changes made in the last few minutes.
 *   **Available Modules:** Currently, only functions within `ai.assistant_functions.user_functions` , `ai.assistant_functions.channel_functions` , `ai.assistant_functions.team_functions` can be imported and used with the `_no_ctx` suffix in the Python interpreter. **Do not attempt to import or call functions from other modules or invent function names.**
 *   **Mandatory Use Cases:**
     *   **Math & Counting:** **YOU MUST** use the Python tool for any calculations, counting items in lists/data, or performing mathematical operations on data *returned by API tools OR _no_ctx functions*. Your internal math skills are unreliable for these tasks. When user uses wording such as "how many" or "count", "most common", etc you must use the python tool.
@@ -485,59 +498,74 @@ def get_system_prompt(user_object: FirebaseUser, memory: str) -> str:
 @dataclass
 class MyDeps:
     user_object: FirebaseUser
+    memory: str = ""
+    # Keys the run's interpreter session
+    conversation_id: Optional[str] = None
+    # Streams tool output to the client while the tool runs
+    progress: Optional[ToolProgress] = None
+
+
+# The agent is built once per process: wrapping every tool in `Tool` runs schema
+# generation and docstring parsing, which is too slow to repeat on every chat turn.
+# Everything user specific is supplied per run through `MyDeps`.
+agent = Agent(
+    model=model,
+    deps_type=MyDeps,
+    tools=[
+        tavily_search_tool(tavily_api_key),
+        # User Functions
+        create_user,
+        page_large_results(list_users),
+        add_user_to_team,
+        page_large_results(search_users),
+        page_large_results(search_users_by_field),
+        get_user,
+        update_user_display_name,
+        update_user_job_title,
+        update_user_email,
+        delete_user,
+        get_user_teams,
+        get_user_channels,
+        get_user_licenses,
+        page_large_results(get_licenses_for_users),
+        list_available_licenses,
+        add_license_to_user,
+        set_user_usage_location,
+        remove_license_from_user,
+        enforce_mfa_for_user,
+        reset_user_password,
+        get_user_password_methods,
+        block_sign_in,
+        unblock_sign_in,
+        # Channel Functions
+        create_standard_channel,
+        create_private_channel,
+        page_large_results(list_channels),
+        delete_channel,
+        page_large_results(list_channels_from_multiple_teams),
+        list_deal_channels,
+        # Team Functions
+        create_team,
+        page_large_results(list_teams),
+        page_large_results(list_team_members),
+        delete_team,
+        page_large_results(search_teams_by_field),
+        # Sharepoint Functions
+        search_sharepoint_sites,
+        page_large_results(traverse_sharepoint_directory_by_item_id),
+        page_large_results(search_sharepoint_graph),
+        # Large results stored behind a handle
+        read_tool_result,
+        # Python Interpreter
+        python_interpreter,
+        list_interpreter_variables,
+        # Memory Functions
+        add_memory,
+        get_memory,
+    ],
+)
 
 
-def create_agent(user_object: FirebaseUser, memory: str) -> Agent:
-    return Agent(
-        model=model,
-        system_prompt=get_system_prompt(user_object, memory),
-        deps_type=MyDeps,
-        tools=[
-            tavily_search_tool(tavily_api_key),
-            # User Functions
-            create_user,
-            list_users,
-            add_user_to_team,
-            search_users,
-            search_users_by_field,
-            get_user,
-            update_user_display_name,
-            update_user_job_title,
-            update_user_email,
-            delete_user,
-            get_user_teams,
-            get_user_channels,
-            get_user_licenses,
-            list_available_licenses,
-            add_license_to_user,
-            set_user_usage_location,
-            remove_license_from_user,
-            enforce_mfa_for_user,
-            reset_user_password,
-            get_user_password_methods,
-            block_sign_in,
-            unblock_sign_in,
-            # Channel Functions
-            create_standard_channel,
-            create_private_channel,
-            list_channels,
-            delete_channel,
-            list_channels_from_multiple_teams,
-            list_deal_channels,
-            # Team Functions
-            create_team,
-            list_teams,
-            list_team_members,
-            delete_team,
-            search_teams_by_field,
-            # Sharepoint Functions
-            search_sharepoint_sites,
-            traverse_sharepoint_directory_by_item_id,
-            search_sharepoint_graph,
-            # Python Interpreter
-            python_interpreter,
-            # Memory Functions
-            add_memory,
-            get_memory,
-        ],
-    )
+@agent.system_prompt(dynamic=True)
+async def system_prompt(ctx: RunContext[MyDeps]) -> str:
+    return get_system_prompt(ctx.deps.user_object, ctx.deps.memory)
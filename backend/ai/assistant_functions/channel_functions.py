@@ -1,19 +1,21 @@
 from ai.assistant_functions.team_functions import search_teams_by_field, search_teams_by_field_no_ctx
 from custom import RunContext
+import asyncio
 import logging
-import time
 
 # from pydantic_ai import agent_tool # Assuming you'll use agent_tool later, but not crucial for this core logic.
 from typing import Tuple, Optional, Dict, Any, List
-from helpers.RequestHelper import make_request
-from concurrent.futures import ThreadPoolExecutor, as_completed
-
-MAX_RETRIES_PER_TEAM = 3
-DEFAULT_RETRY_SECONDS = 5  # Default wait if Retry-After is missing/invalid
+from helpers import DirectoryMirror as directory_mirror
+from helpers.RequestHelper import (
+    make_request,
+    make_request_async,
+    make_batch_request,
+    make_batch_request_async,
+)
 
 
 ## ✅ 13. Create a standard channel
-def create_standard_channel(
+async def create_standard_channel(
     ctx: RunContext, team_id: str, channel_name: str, description: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Creates a new standard channel within a Microsoft Team.
@@ -30,7 +32,7 @@ def create_standard_channel(
     url = f"https://graph.microsoft.com/v1.0/teams/{team_id}/channels"
     payload = {"displayName": channel_name, "description": description}
 
-    response, error = make_request("POST", url, json_data=payload)
+    response, error = await make_request_async("POST", url, json_data=payload)
 
     if error:
         logging.error(f"Failed to create channel: {error}")
@@ -72,7 +74,7 @@ def create_standard_channel_no_ctx(
 
 
 ## ✅ 13b. Create a private channel
-def create_private_channel(
+async def create_private_channel(
     ctx: RunContext,
     team_id: str,
     channel_name: str,
@@ -101,7 +103,7 @@ def create_private_channel(
         ],
     }
 
-    response, error = make_request("POST", url, json_data=payload)
+    response, error = await make_request_async("POST", url, json_data=payload)
 
     if error:
         logging.error(f"Failed to create private channel: {error}")
@@ -154,7 +156,7 @@ def create_private_channel_no_ctx(
 
 
 ## ✅ 14. List all channels
-def list_channels(
+async def list_channels(
     ctx: "RunContext", team_id: str
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
@@ -190,7 +192,7 @@ def list_channels(
             logging.debug(
                 f"Requesting channels for team {team_id}, page {page_count}, url: {url}"
             )
-            response, error = make_request("GET", url)  # ASSUMPTION HERE!
+            response, error = await make_request_async("GET", url)  # ASSUMPTION HERE!
 
             # --- Primary Error Check ---
             # Assumes make_request returns (None, error_dict) on HTTP error
@@ -390,16 +392,15 @@ def list_channels_no_ctx(
 
 
 ## ✅ 16. List channels from multiple teams
-def list_channels_from_multiple_teams(
+async def list_channels_from_multiple_teams(
     ctx: "RunContext",
     team_ids: List[str],
-    # search_string: str = None, # These params are not used in the current fetch logic
-    # filter_field: str = "displayName" # Consider passing them to list_channels if needed
 ) -> Tuple[Optional[Dict[str, List[Dict[str, Any]]]], Optional[Dict[str, Any]]]:
     """
-    Lists all channels from multiple Microsoft Teams concurrently using multithreading.
+    Lists all channels from multiple Microsoft Teams using Graph JSON batching.
 
-    Handles HTTP 429 errors by respecting the Retry-After header.
+    Up to 20 teams are fetched per `$batch` call; throttled sub-requests are retried
+    after their Retry-After and paged results are followed via @odata.nextLink.
     Collects results for successful teams even if some fail after retries.
 
     Args:
@@ -412,163 +413,21 @@ def list_channels_from_multiple_teams(
         the dictionary and an error if a critical failure occurs during setup.
         Individual team failures after retries are logged but don't stop the overall process.
     """
-    teams_channels: Dict[str, List[Dict[str, Any]]] = {}
-    failed_teams: Dict[str, Dict[str, Any]] = {}  # To track teams that failed
-
-    # Limit concurrent workers to avoid overwhelming the API endpoint
-    # Consider adjusting based on observed API behavior and limits
-    max_workers = min(5, len(team_ids))
     if not team_ids:
         logging.info("No team IDs provided to list channels from.")
         return {}, None
 
-    def fetch_team_channels(
-        team_id: str,
-    ) -> Tuple[str, Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
-        """Worker function to fetch channels for a single team with retry logic."""
-        channels: Optional[List[Dict[str, Any]]] = None
-        error: Optional[Dict[str, Any]] = None
-        retry_count = 0
-
-        # Add a small initial delay - helps prevent initial burst of requests causing 429
-        time.sleep(
-            0.2 * (team_ids.index(team_id) % max_workers)
-        )  # Stagger initial calls slightly
-
-        while retry_count <= MAX_RETRIES_PER_TEAM:
-            # Consider adding small delay even within retries if needed: time.sleep(0.5)
-            channels, error = list_channels(ctx, team_id)  # THE ACTUAL API CALL
-
-            if not error:
-                # Success!
-                return team_id, channels, None
-
-            # --- Error Handling ---
-            is_429 = False
-            status_code = None
-            headers = None
-
-            # *** Adapt this check based on the actual structure of your error object ***
-            if isinstance(error, dict):
-                status_code = error.get("status_code")
-                headers = error.get("headers")
-            # Example if error is an object:
-            # elif hasattr(error, 'status_code'):
-            #     status_code = error.status_code
-            #     headers = getattr(error, 'headers', None)
-
-            if status_code == 429:
-                is_429 = True
-
-            if is_429 and retry_count < MAX_RETRIES_PER_TEAM:
-                retry_after = DEFAULT_RETRY_SECONDS
-                if headers and "Retry-After" in headers:
-                    try:
-                        # Header value can be seconds or an HTTP date
-                        # Simple parsing for seconds:
-                        retry_after = int(headers["Retry-After"])
-                        # Add a small buffer (e.g., 1 second) to be safe
-                        retry_after = max(1, retry_after + 1)
-                        logging.info(
-                            f"Team {team_id}: Parsed Retry-After: {headers['Retry-After']}, waiting {retry_after}s"
-                        )
-                    except (ValueError, TypeError):
-                        logging.warning(
-                            f"Team {team_id}: Invalid Retry-After header value: {headers.get('Retry-After')}. "
-                            f"Using default wait {DEFAULT_RETRY_SECONDS}s."
-                        )
-                        retry_after = DEFAULT_RETRY_SECONDS
-                else:
-                    logging.warning(
-                        f"Team {team_id}: 429 received but no Retry-After header found. "
-                        f"Using default wait {DEFAULT_RETRY_SECONDS}s."
-                    )
+    mirrored = await asyncio.to_thread(directory_mirror.list_team_channels, team_ids)
+    if mirrored is not None:
+        logging.info(f"Served channels for {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
 
-                logging.warning(
-                    f"Rate limited (429) getting channels for team {team_id}. "
-                    f"Retrying after {retry_after} seconds... (Attempt {retry_count + 1}/{MAX_RETRIES_PER_TEAM})"
-                )
-                time.sleep(retry_after)
-                retry_count += 1
-                # Continue to the next iteration of the while loop to retry
-            else:
-                # Not a 429 error, or retries exhausted
-                if is_429:  # Retries exhausted for 429
-                    logging.error(
-                        f"Failed to list channels for team {team_id} after {MAX_RETRIES_PER_TEAM} retries due to persistent 429. Last error: {error}"
-                    )
-                else:  # Non-429 error
-                    logging.error(
-                        f"Failed to list channels for team {team_id} with non-retryable error: {error}"
-                    )
-                # Break the loop, error is already set from list_channels call
-                break
-        # End of while loop
-
-        # Return the final state after loop (either success or last error)
-        return team_id, channels, error
-
-    # --- Main execution block ---
     try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_team = {
-                executor.submit(fetch_team_channels, team_id): team_id
-                for team_id in team_ids
-            }
-
-            # Process completed tasks as they finish
-            for future in as_completed(future_to_team):
-                team_id = future_to_team[future]
-                try:
-                    t_id, result_channels, result_error = future.result()
-                    # Sanity check, should match team_id from future_to_team
-                    if t_id != team_id:
-                        logging.warning(
-                            f"Mismatch in team ID processing: expected {team_id}, got {t_id}"
-                        )
-
-                    if result_error:
-                        # Failure for this specific team was already logged in the worker
-                        failed_teams[team_id] = result_error
-                    elif result_channels is not None:
-                        teams_channels[team_id] = result_channels
-                    else:
-                        # Should not happen if error is None, but good to handle
-                        logging.warning(
-                            f"Worker for team {team_id} returned None for channels and error."
-                        )
-                        failed_teams[team_id] = {
-                            "error": "Worker returned inconsistent state"
-                        }
-
-                except Exception as exc:
-                    # Exception raised during task execution itself (rare)
-                    logging.error(
-                        f"Team {team_id} worker generated an exception: {exc}",
-                        exc_info=True,
-                    )
-                    failed_teams[team_id] = {
-                        "error": "Worker execution failed",
-                        "details": str(exc),
-                    }
-
-        success_count = len(teams_channels)
-        failure_count = len(failed_teams)
-        logging.info(
-            f"Finished fetching channels. Success: {success_count}, Failures: {failure_count} "
-            f"(out of {len(team_ids)} teams) using {max_workers} workers."
+        results = await make_batch_request_async(
+            [{"url": f"/teams/{team_id}/channels"} for team_id in team_ids]
         )
-        if failed_teams:
-            logging.warning(f"Failed Team IDs: {list(failed_teams.keys())}")
-
-        # Return the dictionary of successfully retrieved channels
-        # Error is None because the function itself completed, even if some teams failed.
-        # The caller can check the length of the returned dict vs the input list if needed.
-        return teams_channels, None
-
+        return _collect_team_channels(team_ids, results), None
     except Exception as e:
-        # Catch errors during ThreadPoolExecutor setup or task submission
         logging.exception(
             f"Unexpected critical error during multi-team channel fetching setup: {e}"
         )
@@ -582,9 +441,10 @@ def list_channels_from_multiple_teams_no_ctx(
     team_ids: List[str],
 ) -> Tuple[Optional[Dict[str, List[Dict[str, Any]]]], Optional[Dict[str, Any]]]:
     """
-    Lists all channels from multiple Microsoft Teams concurrently using multithreading.
+    Lists all channels from multiple Microsoft Teams using Graph JSON batching.
 
-    Handles HTTP 429 errors by respecting the Retry-After header.
+    Up to 20 teams are fetched per `$batch` call; throttled sub-requests are retried
+    after their Retry-After and paged results are followed via @odata.nextLink.
     Collects results for successful teams even if some fail after retries.
 
     Args:
@@ -596,163 +456,21 @@ def list_channels_from_multiple_teams_no_ctx(
         the dictionary and an error if a critical failure occurs during setup.
         Individual team failures after retries are logged but don't stop the overall process.
     """
-    teams_channels: Dict[str, List[Dict[str, Any]]] = {}
-    failed_teams: Dict[str, Dict[str, Any]] = {}  # To track teams that failed
-
-    # Limit concurrent workers to avoid overwhelming the API endpoint
-    # Consider adjusting based on observed API behavior and limits
-    max_workers = min(5, len(team_ids))
     if not team_ids:
         logging.info("No team IDs provided to list channels from.")
         return {}, None
 
-    def fetch_team_channels(
-        team_id: str,
-    ) -> Tuple[str, Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
-        """Worker function to fetch channels for a single team with retry logic."""
-        channels: Optional[List[Dict[str, Any]]] = None
-        error: Optional[Dict[str, Any]] = None
-        retry_count = 0
-
-        # Add a small initial delay - helps prevent initial burst of requests causing 429
-        time.sleep(
-            0.2 * (team_ids.index(team_id) % max_workers)
-        )  # Stagger initial calls slightly
-
-        while retry_count <= MAX_RETRIES_PER_TEAM:
-            # Consider adding small delay even within retries if needed: time.sleep(0.5)
-            channels, error = list_channels_no_ctx(team_id)  # THE ACTUAL API CALL
-
-            if not error:
-                # Success!
-                return team_id, channels, None
-
-            # --- Error Handling ---
-            is_429 = False
-            status_code = None
-            headers = None
-
-            # *** Adapt this check based on the actual structure of your error object ***
-            if isinstance(error, dict):
-                status_code = error.get("status_code")
-                headers = error.get("headers")
-            # Example if error is an object:
-            # elif hasattr(error, 'status_code'):
-            #     status_code = error.status_code
-            #     headers = getattr(error, 'headers', None)
-
-            if status_code == 429:
-                is_429 = True
-
-            if is_429 and retry_count < MAX_RETRIES_PER_TEAM:
-                retry_after = DEFAULT_RETRY_SECONDS
-                if headers and "Retry-After" in headers:
-                    try:
-                        # Header value can be seconds or an HTTP date
-                        # Simple parsing for seconds:
-                        retry_after = int(headers["Retry-After"])
-                        # Add a small buffer (e.g., 1 second) to be safe
-                        retry_after = max(1, retry_after + 1)
-                        logging.info(
-                            f"Team {team_id}: Parsed Retry-After: {headers['Retry-After']}, waiting {retry_after}s"
-                        )
-                    except (ValueError, TypeError):
-                        logging.warning(
-                            f"Team {team_id}: Invalid Retry-After header value: {headers.get('Retry-After')}. "
-                            f"Using default wait {DEFAULT_RETRY_SECONDS}s."
-                        )
-                        retry_after = DEFAULT_RETRY_SECONDS
-                else:
-                    logging.warning(
-                        f"Team {team_id}: 429 received but no Retry-After header found. "
-                        f"Using default wait {DEFAULT_RETRY_SECONDS}s."
-                    )
+    mirrored = directory_mirror.list_team_channels(team_ids)
+    if mirrored is not None:
+        logging.info(f"Served channels for {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
 
-                logging.warning(
-                    f"Rate limited (429) getting channels for team {team_id}. "
-                    f"Retrying after {retry_after} seconds... (Attempt {retry_count + 1}/{MAX_RETRIES_PER_TEAM})"
-                )
-                time.sleep(retry_after)
-                retry_count += 1
-                # Continue to the next iteration of the while loop to retry
-            else:
-                # Not a 429 error, or retries exhausted
-                if is_429:  # Retries exhausted for 429
-                    logging.error(
-                        f"Failed to list channels for team {team_id} after {MAX_RETRIES_PER_TEAM} retries due to persistent 429. Last error: {error}"
-                    )
-                else:  # Non-429 error
-                    logging.error(
-                        f"Failed to list channels for team {team_id} with non-retryable error: {error}"
-                    )
-                # Break the loop, error is already set from list_channels call
-                break
-        # End of while loop
-
-        # Return the final state after loop (either success or last error)
-        return team_id, channels, error
-
-    # --- Main execution block ---
     try:
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            # Submit all tasks
-            future_to_team = {
-                executor.submit(fetch_team_channels, team_id): team_id
-                for team_id in team_ids
-            }
-
-            # Process completed tasks as they finish
-            for future in as_completed(future_to_team):
-                team_id = future_to_team[future]
-                try:
-                    t_id, result_channels, result_error = future.result()
-                    # Sanity check, should match team_id from future_to_team
-                    if t_id != team_id:
-                        logging.warning(
-                            f"Mismatch in team ID processing: expected {team_id}, got {t_id}"
-                        )
-
-                    if result_error:
-                        # Failure for this specific team was already logged in the worker
-                        failed_teams[team_id] = result_error
-                    elif result_channels is not None:
-                        teams_channels[team_id] = result_channels
-                    else:
-                        # Should not happen if error is None, but good to handle
-                        logging.warning(
-                            f"Worker for team {team_id} returned None for channels and error."
-                        )
-                        failed_teams[team_id] = {
-                            "error": "Worker returned inconsistent state"
-                        }
-
-                except Exception as exc:
-                    # Exception raised during task execution itself (rare)
-                    logging.error(
-                        f"Team {team_id} worker generated an exception: {exc}",
-                        exc_info=True,
-                    )
-                    failed_teams[team_id] = {
-                        "error": "Worker execution failed",
-                        "details": str(exc),
-                    }
-
-        success_count = len(teams_channels)
-        failure_count = len(failed_teams)
-        logging.info(
-            f"Finished fetching channels. Success: {success_count}, Failures: {failure_count} "
-            f"(out of {len(team_ids)} teams) using {max_workers} workers."
+        results = make_batch_request(
+            [{"url": f"/teams/{team_id}/channels"} for team_id in team_ids]
         )
-        if failed_teams:
-            logging.warning(f"Failed Team IDs: {list(failed_teams.keys())}")
-
-        # Return the dictionary of successfully retrieved channels
-        # Error is None because the function itself completed, even if some teams failed.
-        # The caller can check the length of the returned dict vs the input list if needed.
-        return teams_channels, None
-
+        return _collect_team_channels(team_ids, results), None
     except Exception as e:
-        # Catch errors during ThreadPoolExecutor setup or task submission
         logging.exception(
             f"Unexpected critical error during multi-team channel fetching setup: {e}"
         )
@@ -762,8 +480,32 @@ def list_channels_from_multiple_teams_no_ctx(
         }
 
 
+def _collect_team_channels(
+    team_ids: List[str], results: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]
+) -> Dict[str, List[Dict[str, Any]]]:
+    """Maps batched channel listings back to their team IDs, logging per-team failures."""
+    teams_channels: Dict[str, List[Dict[str, Any]]] = {}
+    failed_teams: Dict[str, Dict[str, Any]] = {}
+
+    for team_id, (response, error) in zip(team_ids, results):
+        if error:
+            logging.error(f"Failed to list channels for team {team_id}: {error}")
+            failed_teams[team_id] = error
+        else:
+            teams_channels[team_id] = response.get("value", [])
+
+    logging.info(
+        f"Finished fetching channels. Success: {len(teams_channels)}, Failures: {len(failed_teams)} "
+        f"(out of {len(team_ids)} teams) using batched requests."
+    )
+    if failed_teams:
+        logging.warning(f"Failed Team IDs: {list(failed_teams.keys())}")
+
+    return teams_channels
+
+
 ## ✅ 15. Delete a channel
-def delete_channel(
+async def delete_channel(
     ctx: RunContext, team_id: str, channel_id: str
 ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
     """Deletes a channel from a Microsoft Team.
@@ -777,7 +519,7 @@ def delete_channel(
         or None and error details if failed
     """
     url = f"https://graph.microsoft.com/v1.0/teams/{team_id}/channels/{channel_id}"
-    response, error = make_request("DELETE", url)
+    response, error = await make_request_async("DELETE", url)
 
     if error:
         logging.error(f"Failed to delete channel: {error}")
@@ -817,11 +559,11 @@ def delete_channel_no_ctx(
     )  # Return success message
 
 
-def list_deal_channels(ctx: RunContext):
+async def list_deal_channels(ctx: RunContext):
     """Lists all channels with 'deals' in their name in teams matching the 'NCA SF XXX' pattern."""
 
     # 1. Find all searcher teams using the naming pattern.
-    teams, error = search_teams_by_field(
+    teams, error = await search_teams_by_field(
         ctx, filter_field="displayName", search_string="NCA SF"
     )
     if error:
@@ -839,7 +581,7 @@ def list_deal_channels(ctx: RunContext):
         print("No searcher teams found.")
         return [], None
 
-    all_channels, error = list_channels_from_multiple_teams(
+    all_channels, error = await list_channels_from_multiple_teams(
         ctx, team_ids=searcher_team_ids
     )
 
@@ -2,7 +2,7 @@ from ai.utils import extract_and_format_memory_data
 from custom.tools import RunContext
 from typing import Tuple
 from dotenv import load_dotenv
-from ai.mem0_local import m
+from ai.mem0_local import memory_client
 import logging
 
 logger = logging.getLogger(__name__)
@@ -25,15 +25,12 @@ def add_memory(ctx: RunContext[str], message: str) -> Tuple[str, str]:
     Returns:
         A tuple containing a success message and the stored memory content
     """
-    if not m:
-        logger.error("Memory client not initialized")
-        return "Memory service unavailable.", "Memory service is not initialized."
-    try:
-        result = m.add(message, user_id=ctx.deps.user_object.uid)
-        return "Memory added successfully.", str(result)
-    except Exception as e:
-        logger.error(f"Error adding memory: {str(e)}", exc_info=True)
-        return "Failed to add memory.", str(e)
+    error, result = memory_client.call(
+        lambda m: m.add(message, user_id=ctx.deps.user_object.uid)
+    )
+    if error:
+        return error, result
+    return "Memory added successfully.", str(result)
 
 
 def get_memory(ctx: RunContext[str], query: str) -> Tuple[str, str]:
@@ -49,18 +46,13 @@ def get_memory(ctx: RunContext[str], query: str) -> Tuple[str, str]:
     Returns:
         A tuple containing the search results and any associated metadata
     """
-    if not m:
-        logger.error("Memory client not initialized")
-        return "Memory service unavailable.", "Memory service is not initialized."
-    try:
-        results = m.search(query, user_id=ctx.deps.user_object.uid)
-
-        memory = extract_and_format_memory_data(str(results))
-
-        return "Memory search completed successfully.", memory
-    except Exception as e:
-        logger.error(f"Error searching memory: {str(e)}", exc_info=True)
-        return "Failed to search memory.", str(e)
+    error, results = memory_client.call(
+        lambda m: m.search(query, user_id=ctx.deps.user_object.uid)
+    )
+    if error:
+        return error, results
+    memory = extract_and_format_memory_data(str(results))
+    return "Memory search completed successfully.", memory
 
 
 def get_memory_no_context(user_id: str, query: str) -> Tuple[str, str]:
@@ -76,17 +68,8 @@ def get_memory_no_context(user_id: str, query: str) -> Tuple[str, str]:
     Returns:
         A tuple containing the search results and any associated metadata
     """
-    if not m:
-        logger.error("Memory client not initialized")
-        return "Memory service unavailable.", "Memory service is not initialized."
-    try:
-        results = m.search(query, user_id=user_id)
-
-        # print("results", results)
-
-
-        memory = extract_and_format_memory_data(str(results))
-        return "Memory from current question.", memory
-    except Exception as e:
-        logger.error(f"Error searching memory: {str(e)}", exc_info=True)
-        return "Failed to search memory.", str(e)
+    error, results = memory_client.call(lambda m: m.search(query, user_id=user_id))
+    if error:
+        return error, results
+    memory = extract_and_format_memory_data(str(results))
+    return "Memory from current question.", memory
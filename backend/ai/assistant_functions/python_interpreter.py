@@ -1,18 +1,213 @@
 # add a python interpreter tool
 
-import sys
-from io import StringIO
-import threading
-import queue
-from typing import Optional, Dict, Any, Tuple
+import importlib
+import io
+import logging
+import os
+from typing import IO, List, Optional, Dict, Any, Tuple
 
 from custom.tools import RunContext
+from helpers.ArtifactStore import artifact_url, new_artifact
+from helpers.EventStream import ToolProgress
+from helpers.InterpreterPool import InterpreterPool, notify_server
+
+# Modules snippets are told to import from, loaded once per worker instead of per snippet
+PRELOADED_MODULES = [
+    "ai.assistant_functions.user_functions",
+    "ai.assistant_functions.channel_functions",
+    "ai.assistant_functions.team_functions",
+    "ai.assistant_functions.sharepoint_functions",
+    "ai.assistant_functions.tool_result_functions",
+]
+
+
+def warm_up_worker() -> Dict[str, Any]:
+    """Runs once in every interpreter worker process before its first snippet.
+
+    Returns:
+        dict: Names predefined for snippets, `directory` is the tenant as DataFrames
+    """
+    for module in PRELOADED_MODULES:
+        importlib.import_module(module)
+    from helpers.DirectorySnapshot import DirectorySnapshot
+    from helpers.RequestHelper import add_write_listener, prefetch_token
+
+    # The server's Graph cache lives in another process, tell it about writes made here
+    add_write_listener(lambda method, url: notify_server(("graph_write", method, url)))
+
+    error = prefetch_token()
+    if error:
+        logging.warning(f"Interpreter worker could not prefetch a Graph token: {error}")
+
+    directory = DirectorySnapshot()
+    directory.preload()
+    return {"directory": directory}
+
+
+# The model and the live stream get at most this much of a snippet's output, the whole
+# output is saved as a downloadable artifact
+INTERPRETER_OUTPUT_MAX_CHARS = int(os.getenv("INTERPRETER_OUTPUT_MAX_CHARS", "20000"))
+# Output past this is not kept at all
+INTERPRETER_SPILL_MAX_CHARS = int(os.getenv("INTERPRETER_SPILL_MAX_CHARS", "10000000"))
+
+
+class InterpreterOutput(io.TextIOBase):
+    """
+    Receives a snippet's stdout while it runs.
+
+    The first `max_chars` are streamed to the chat as tool_progress events and kept for the
+    tool result. Once the output grows past that, all of it is written to an artifact of
+    the conversation and the result tells the model where the rest went.
+    """
+
+    def __init__(
+        self,
+        progress: Optional[ToolProgress] = None,
+        tool_call_id: Optional[str] = None,
+        conversation_id: Optional[str] = None,
+        max_chars: int = INTERPRETER_OUTPUT_MAX_CHARS,
+    ) -> None:
+        self._progress = progress
+        self._tool_call_id = tool_call_id
+        self._conversation_id = conversation_id
+        self._max_chars = max_chars
+        self._head: List[str] = []
+        self.total = 0
+        self.artifact_id: Optional[str] = None
+        self._spill: Optional[IO[str]] = None
+        self._spilled = False
+
+    def writable(self) -> bool:
+        return True
+
+    def _emit(self, data: Dict[str, Any]) -> None:
+        if self._progress is not None:
+            self._progress.emit(self._tool_call_id, "python_interpreter", data)
+
+    def write(self, text: str) -> int:
+        kept = text[: max(0, self._max_chars - self.total)]
+        self.total += len(text)
+        if kept:
+            self._emit({"output": kept})
+        if self.total > self._max_chars and not self._spilled:
+            # Before text joins the head, the artifact gets the head and then all of text
+            self._spilled = True
+            self._start_spill()
+        if kept:
+            self._head.append(kept)
+        if self._spill is not None:
+            try:
+                self._spill.write(text)
+            except OSError:
+                logging.exception(f"Failed to write interpreter output artifact {self.artifact_id}")
+                self._close_spill()
+                self.artifact_id = None
+        return len(text)
+
+    def _start_spill(self) -> None:
+        if self._conversation_id is None:
+            return
+        try:
+            self.artifact_id, path = new_artifact(self._conversation_id)
+            self._spill = open(path, "w", encoding="utf-8")
+            # The artifact holds the whole output, starting with what was already streamed
+            self._spill.write("".join(self._head))
+        except OSError:
+            logging.exception("Failed to create an interpreter output artifact")
+            self.artifact_id = None
+            self._close_spill()
+        else:
+            self._emit({"truncated": True})
+
+    def _close_spill(self) -> None:
+        if self._spill is not None:
+            try:
+                self._spill.close()
+            except OSError:
+                logging.exception(f"Failed to close interpreter output artifact {self.artifact_id}")
+            self._spill = None
+
+    def getvalue(self) -> str:
+        """The output for the tool result, truncated with a note when it was too long."""
+        output = "".join(self._head)
+        if self.total <= self._max_chars:
+            return output
+        note = f"\n[Output truncated, showing {self._max_chars} of {self.total} characters."
+        if self.artifact_id is not None:
+            note += (
+                f" The full output was saved as artifact {self.artifact_id}, the user can download it"
+                " from the chat. Print summaries instead of whole datasets.]"
+            )
+        else:
+            note += " Print summaries instead of whole datasets.]"
+        return output + note
+
+    def close(self) -> None:
+        """Finishes the artifact, if any, and tells the client where to download it."""
+        if self._spill is not None:
+            self._close_spill()
+            self._emit(
+                {
+                    "artifact": {
+                        "id": self.artifact_id,
+                        "url": artifact_url(self._conversation_id, self.artifact_id),
+                        "size": self.total,
+                    }
+                }
+            )
+        super().close()
+
+
+def handle_worker_notice(notice: Any, owner: Optional[str]) -> Any:
+    """
+    Runs in the server for each `notify_server` or `call_server` payload of an interpreter worker.
+
+    owner is the user the snippet runs for, stored tool results are only read for them.
+    """
+    kind, *args = notice
+    if kind == "graph_write":
+        from helpers.RequestHelper import invalidate_cache_for_write
+
+        return invalidate_cache_for_write(*args)
+    if kind == "read_tool_result":
+        from ai.assistant_functions.tool_result_functions import query_stored_rows
+
+        if owner is None:
+            return None, {"error": "Stored tool results can only be read in a user's snippet"}
+        handle, *query = args
+        return query_stored_rows(handle, owner, *query)
+    raise ValueError(f"Unknown interpreter notice {kind}")
+
+
+interpreter_pool = InterpreterPool(
+    size=int(os.getenv("INTERPRETER_POOL_SIZE", "2")),
+    max_runs=int(os.getenv("INTERPRETER_MAX_RUNS", "50")),
+    timeout_seconds=float(os.getenv("INTERPRETER_TIMEOUT", "30")),
+    cpu_seconds=int(os.getenv("INTERPRETER_CPU_SECONDS", "30")),
+    memory_mb=int(os.getenv("INTERPRETER_MEMORY_MB", "1024")),
+    initializer=warm_up_worker,
+    max_sessions=int(os.getenv("INTERPRETER_MAX_SESSIONS", "8")),
+    session_idle_seconds=float(os.getenv("INTERPRETER_SESSION_IDLE_SECONDS", "900")),
+    max_output_chars=INTERPRETER_SPILL_MAX_CHARS,
+    on_notice=handle_worker_notice,
+)
+
 
 def python_interpreter(
     ctx: RunContext, code: str
 ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
     """
     Executes Python code in the current environment.
+    Variables, imports and functions persist between calls in the same conversation,
+    so data fetched in one call can be reused in the next.
+    Output is shown to the user live while the code runs, print progress in long loops.
+    Long output is truncated in the result, print summaries rather than whole datasets.
+    `directory` is predefined: pandas DataFrames of the tenant as of the last directory sync,
+    directory.users, directory.licenses (one row per assigned license, with the user's
+    department), directory.teams, directory.channels and directory.skus. Prefer them over
+    list_*_no_ctx calls for counting, grouping and filtering.
+    A result_handle from another tool is read with read_tool_result_no_ctx from
+    ai.assistant_functions.tool_result_functions.
     You can execute native functions by appending _no_ctx to the function name.
     Currently available no_ctx functions are from user_functions and channel_functions.
     
@@ -42,67 +237,35 @@ def python_interpreter(
             - The output of the Python code.
             - An error dictionary if an error occurred, or None if successful.
     """
-    # Create a queue to store the result
-    result_queue = queue.Queue()
-    
-    def run_code():
-        try:
-            # Capture stdout and stderr
-            old_stdout = sys.stdout
-            old_stderr = sys.stderr
-            stdout_capture = StringIO()
-            stderr_capture = StringIO()
-            sys.stdout = stdout_capture
-            sys.stderr = stderr_capture
-
-            # Execute the code
-            exec(code, globals(), locals())
-
-            # Restore stdout and stderr
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-
-            # Get the captured output
-            output = stdout_capture.getvalue()
-            error_output = stderr_capture.getvalue()
-
-            if error_output:
-                result_queue.put((None, {
-                    "error": "Code execution produced errors",
-                    "details": error_output
-                }))
-            else:
-                result_queue.put((output, None))
-
-        except Exception as e:
-            # Restore stdout and stderr in case of exception
-            sys.stdout = old_stdout
-            sys.stderr = old_stderr
-            result_queue.put((None, {
-                "error": "Execution error",
-                "details": str(e)
-            }))
-
-    # Create and start the thread
-    thread = threading.Thread(target=run_code)
-    thread.daemon = True
-    thread.start()
-
+    conversation_id = ctx.deps.conversation_id if ctx is not None else None
+    owner = ctx.deps.user_object.uid if ctx is not None else None
+    output = InterpreterOutput(
+        progress=ctx.deps.progress if ctx is not None else None,
+        tool_call_id=ctx.tool_call_id if ctx is not None else None,
+        conversation_id=conversation_id,
+    )
     try:
-        # Wait for the result with timeout
-        output, error = result_queue.get(timeout=30)
-        return output, error
-
-    except queue.Empty:
-        # If the thread is still running, we need to stop it
-        if thread.is_alive():
-            # Note: This is a best-effort attempt to stop the thread
-            # Python threads cannot be forcefully terminated
-            pass
-        return None, {
-            "error": "Execution timeout",
-            "details": "Code execution exceeded 30 second timeout"
-        }
+        return interpreter_pool.run(code, session_id=conversation_id, stdout=output, owner=owner)
+    finally:
+        output.close()
+
+
+def list_interpreter_variables(
+    ctx: RunContext,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Lists the variables kept in this conversation's Python interpreter session.
+
+    Use this to check which data from earlier python_interpreter calls can be reused
+    before fetching it again.
+
+    Returns:
+        tuple: (session, error) where session has the variables (name, type and length)
+        and the session's memory use in MB if successful, or None and error details if failed
+    """
+    if ctx.deps.conversation_id is None:
+        return {"variables": [], "memory_mb": None}, None
+    return interpreter_pool.session_variables(ctx.deps.conversation_id)
 
 if __name__ == "__main__":
     print(
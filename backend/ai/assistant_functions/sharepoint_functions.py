@@ -3,9 +3,9 @@ import time
 from typing import Any, Dict, List, Optional, Tuple
 
 from custom import RunContext
-from helpers.RequestHelper import make_request
+from helpers.RequestHelper import make_request_async
 
-def _list_sharepoint_sites(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def _list_sharepoint_sites(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
     Lists all SharePoint sites accessible by the Entra application.
 
@@ -24,7 +24,7 @@ def _list_sharepoint_sites(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any
 
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
             if error:
                 logging.error(f"Failed to list sites: {error}")
                 return None, error
@@ -50,7 +50,7 @@ def _list_sharepoint_sites(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any
 
 
 
-def search_sharepoint_sites(ctx: RunContext, search_term: str) -> List[Dict[str, Any]]:
+async def search_sharepoint_sites(ctx: RunContext, search_term: str) -> List[Dict[str, Any]]:
     """
     Searches a list of SharePoint sites for sites whose name or display name contains the search term.
     When the user asks you to find a sharepoint start with full name it it fails, try each individual word in the search term the user gave you.
@@ -63,7 +63,7 @@ def search_sharepoint_sites(ctx: RunContext, search_term: str) -> List[Dict[str,
     Returns:
         A list of SharePoint site dictionaries that match the search term.  Returns an empty list if no matches are found.
     """
-    sites, error = _list_sharepoint_sites(ctx)
+    sites, error = await _list_sharepoint_sites(ctx)
     if error:
         return error
      
@@ -84,7 +84,7 @@ def search_sharepoint_sites(ctx: RunContext, search_term: str) -> List[Dict[str,
 
 
 
-def list_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: str, item_id: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def list_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: str, item_id: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
     Lists files and folders in a SharePoint directory using Microsoft Graph API,
     identifying the directory by its item ID.
@@ -108,7 +108,7 @@ def list_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: st
 
     try:
         while url:
-            response, error = make_request("GET", url) # Assuming make_request handles authentication
+            response, error = await make_request_async("GET", url) # Assuming make_request handles authentication
             if error:
                 logging.error(f"Failed to list directory: {error}")
                 return None, error
@@ -151,7 +151,7 @@ def list_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: st
         logging.info(f"list_sharepoint_directory_by_item_id function completed in {end_time - start_time:.2f} seconds")
 
 
-def traverse_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: str, root_item_id: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def traverse_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id: str, root_item_id: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
     Traverses the entire directory structure of a SharePoint site starting from a
     specified root item ID, using Microsoft Graph API.
@@ -169,8 +169,8 @@ def traverse_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id
 
     full_structure: List[Dict[str, Any]] = []
 
-    def recursive_list(current_item_id: str):
-        items, error = list_sharepoint_directory_by_item_id(ctx, sharepoint_site_id, current_item_id)
+    async def recursive_list(current_item_id: str):
+        items, error = await list_sharepoint_directory_by_item_id(ctx, sharepoint_site_id, current_item_id)
 
         if error:
             logging.error(f"Error getting directory with item ID {current_item_id}: {error}")
@@ -182,15 +182,15 @@ def traverse_sharepoint_directory_by_item_id(ctx: RunContext, sharepoint_site_id
             # Recursively call for subfolders
             for item in items:
                 if item["type"] == "folder":
-                    recursive_list(item["id"])  # Recursive call uses the item ID
+                    await recursive_list(item["id"])  # Recursive call uses the item ID
 
-    recursive_list(root_item_id)
+    await recursive_list(root_item_id)
 
     return full_structure, None
 
 
 
-def search_sharepoint_graph(ctx: RunContext, search_term: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def search_sharepoint_graph(ctx: RunContext, search_term: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
     Searches SharePoint using the Microsoft Graph Search API, using /me/drive/root/search.
 
@@ -203,7 +203,7 @@ def search_sharepoint_graph(ctx: RunContext, search_term: str) -> Tuple[Optional
     graph_url = f"https://graph.microsoft.com/v1.0/me/drive/root/search(q='{search_term}')"
 
     try:
-        response, error = make_request("GET", graph_url) #  make_request to append the token
+        response, error = await make_request_async("GET", graph_url) #  make_request to append the token
         if error:
            logging.error(f"Failed to list sites: {error}")
            return None, {"error": "Unexpected error listing sites", "details": str(error)}
@@ -1,13 +1,16 @@
 from custom import RunContext
+import asyncio
 import logging
 # from pydantic_ai import agent_tool # Assuming you'll use agent_tool later, but not crucial for this core logic.
 from typing import Tuple, Optional, Dict, Any, List
-from helpers.RequestHelper import make_request
+from helpers import DirectoryMirror as directory_mirror
+from helpers.DirectoryIndex import filter_objects
+from helpers.RequestHelper import make_request, make_request_async
 import time
 
 
 ## ✅ 3. Create a team
-def create_team(ctx: RunContext, team_name:str, description:str, owner_email:str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+async def create_team(ctx: RunContext, team_name:str, description:str, owner_email:str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Creates a new team in Microsoft Teams.
 
     Args:
@@ -33,7 +36,7 @@ def create_team(ctx: RunContext, team_name:str, description:str, owner_email:str
         ]
     }
 
-    response, error = make_request("POST", url, json_data=payload)
+    response, error = await make_request_async("POST", url, json_data=payload)
     if error:
         logging.error(f"Failed to create team: {error}")
         return None, error
@@ -78,18 +81,23 @@ def create_team_no_ctx(team_name:str, description:str, owner_email:str) -> Tuple
 
 
 ## ✅ 5. List all teams
-def list_teams(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def list_teams(ctx: RunContext) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Lists all teams in Microsoft Teams.
 
     Returns:
         tuple: (teams_list, error) where teams_list contains all teams if successful,
         or None and error details if failed
     """
+    mirrored = await asyncio.to_thread(directory_mirror.list_objects, "group", teams_only=True)
+    if mirrored is not None:
+        logging.info(f"list_teams served {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
+
     url = "https://graph.microsoft.com/v1.0/teams"
     all_teams = []
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
 
             if error:
                 logging.error(f"Failed to list teams: {error}")
@@ -113,6 +121,11 @@ def list_teams_no_ctx() -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[s
         tuple: (teams_list, error) where teams_list contains all teams if successful,
         or None and error details if failed
     """
+    mirrored = directory_mirror.list_objects("group", teams_only=True)
+    if mirrored is not None:
+        logging.info(f"list_teams served {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
+
     url = "https://graph.microsoft.com/v1.0/teams"
     all_teams = []
     try:
@@ -135,7 +148,7 @@ def list_teams_no_ctx() -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[s
 
 
 ## ✅ 6. List all members of a specific Microsoft Team
-def list_team_members(ctx: RunContext, team_id:str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def list_team_members(ctx: RunContext, team_id:str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Lists all members of a specific Microsoft Team.
 
     Args:
@@ -149,7 +162,7 @@ def list_team_members(ctx: RunContext, team_id:str) -> Tuple[Optional[List[Dict[
     all_members = []
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
 
             if error:
                 logging.error(f"Failed to list team members: {error}")
@@ -198,7 +211,7 @@ def list_team_members_no_ctx(team_id:str) -> Tuple[Optional[List[Dict[str, Any]]
 
 
 ##list users joined to a team
-def list_users_joined_team(ctx: RunContext, team_id:str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+async def list_users_joined_team(ctx: RunContext, team_id:str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Lists all users joined to a specific Microsoft Team.
 
     Args:
@@ -212,7 +225,7 @@ def list_users_joined_team(ctx: RunContext, team_id:str) -> Tuple[Optional[List[
     all_users = []
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
 
             if error:
                 logging.error(f"Failed to list users joined to team: {error}")
@@ -261,7 +274,7 @@ def list_users_joined_team_no_ctx(team_id:str) -> Tuple[Optional[List[Dict[str,
 
 
 ## ✅ 11. Delete a Microsoft Team
-def delete_team(ctx: RunContext, team_id:str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
+async def delete_team(ctx: RunContext, team_id:str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
     """Deletes a Microsoft Team.
 
     Args:
@@ -272,7 +285,7 @@ def delete_team(ctx: RunContext, team_id:str) -> Tuple[Optional[str], Optional[D
         or None and error details if failed
     """
     url = f"https://graph.microsoft.com/v1.0/teams/{team_id}"
-    response, error = make_request("DELETE", url)
+    response, error = await make_request_async("DELETE", url)
 
     if error:
         logging.error(f"Failed to delete team: {error}")
@@ -303,8 +316,8 @@ def delete_team_no_ctx(team_id:str) -> Tuple[Optional[str], Optional[Dict[str, A
     return f"Successfully deleted team {team_id}", None  # Return success message
 
 
-def search_teams_by_field(
-    ctx: RunContext, search_string: str, filter_field: str
+async def search_teams_by_field(
+    ctx: RunContext, search_string: str, filter_field: str, fuzzy: bool = False
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Searches for teams based on a specified field.
 
@@ -317,6 +330,7 @@ def search_teams_by_field(
             - createdDateTime: When the team was created
             - memberCount: Number of members in the team
             - owner: The team owner's information
+        fuzzy (bool, optional): Also match close spellings (typos), best matches first
 
     Returns:
         tuple: (teams_list, error) where teams_list contains matching teams if successful,
@@ -327,11 +341,16 @@ def search_teams_by_field(
         f"Starting search_teams_by_field function with search string: {search_string} in field: {filter_field}"
     )
 
+    mirrored = await asyncio.to_thread(directory_mirror.search_objects, "group", filter_field, search_string, teams_only=True, fuzzy=fuzzy)
+    if mirrored is not None:
+        logging.info(f"search_teams_by_field served {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
+
     all_teams = []
     url = "https://graph.microsoft.com/v1.0/teams"
 
     while url:
-        response, error = make_request("GET", url)
+        response, error = await make_request_async("GET", url)
 
         if error:
             logging.error(f"Failed to search teams: {error}")
@@ -348,11 +367,7 @@ def search_teams_by_field(
         else:
             url = None
 
-    filtered_teams = [
-        team
-        for team in all_teams
-        if search_string.lower() in str(team.get(filter_field, "")).lower()
-    ]
+    filtered_teams = filter_objects(all_teams, filter_field, search_string, fuzzy)
     logging.info(
         f"Found {len(filtered_teams)} teams matching '{search_string}' in field '{filter_field}'"
     )
@@ -363,7 +378,7 @@ def search_teams_by_field(
     return filtered_teams, None
 
 
-def search_teams_by_field_no_ctx(search_string: str, filter_field: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
+def search_teams_by_field_no_ctx(search_string: str, filter_field: str, fuzzy: bool = False) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Searches for teams based on a specified field.
 
     Args:
@@ -375,6 +390,7 @@ def search_teams_by_field_no_ctx(search_string: str, filter_field: str) -> Tuple
             - createdDateTime: When the team was created
             - memberCount: Number of members in the team
             - owner: The team owner's information
+        fuzzy (bool, optional): Also match close spellings (typos), best matches first
 
     Returns:
         tuple: (teams_list, error) where teams_list contains matching teams if successful,
@@ -385,6 +401,11 @@ def search_teams_by_field_no_ctx(search_string: str, filter_field: str) -> Tuple
         f"Starting search_teams_by_field function with search string: {search_string} in field: {filter_field}"
     )
 
+    mirrored = directory_mirror.search_objects("group", filter_field, search_string, teams_only=True, fuzzy=fuzzy)
+    if mirrored is not None:
+        logging.info(f"search_teams_by_field served {len(mirrored)} teams from the directory mirror")
+        return mirrored, None
+
     all_teams = []
     url = "https://graph.microsoft.com/v1.0/teams"
 
@@ -406,11 +427,7 @@ def search_teams_by_field_no_ctx(search_string: str, filter_field: str) -> Tuple
         else:
             url = None
 
-    filtered_teams = [
-        team
-        for team in all_teams
-        if search_string.lower() in str(team.get(filter_field, "")).lower()
-    ]
+    filtered_teams = filter_objects(all_teams, filter_field, search_string, fuzzy)
     logging.info(
         f"Found {len(filtered_teams)} teams matching '{search_string}' in field '{filter_field}'"
     )
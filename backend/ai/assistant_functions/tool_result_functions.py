@@ -0,0 +1,300 @@
+import functools
+import inspect
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from custom import RunContext
+from helpers.InterpreterPool import call_server, in_worker
+from helpers.ResultStore import ResultStore
+
+# Results whose JSON is longer than this are kept server-side behind a handle
+RESULT_STORE_MIN_CHARS = int(os.getenv("RESULT_STORE_MIN_CHARS", "20000"))
+PREVIEW_ROWS = 5
+PREVIEW_VALUE_CHARS = 200
+MAX_READ_ROWS = 200
+
+result_store = ResultStore(
+    max_entries=int(os.getenv("RESULT_STORE_MAX_ENTRIES", "256")),
+    ttl_seconds=float(os.getenv("RESULT_STORE_TTL", str(6 * 3600))),
+)
+
+
+def _split_rows(data: Any) -> Optional[Tuple[List[Any], Dict[str, Any]]]:
+    """Finds the rows in a tool's data, a list itself or the longest list inside a dict."""
+    if isinstance(data, list):
+        return data, {}
+    if isinstance(data, dict):
+        list_fields = [key for key, value in data.items() if isinstance(value, list)]
+        if list_fields:
+            rows_field = max(list_fields, key=lambda key: len(data[key]))
+            metadata = {key: value for key, value in data.items() if key != rows_field}
+            metadata["rows_field"] = rows_field
+            return data[rows_field], metadata
+    return None
+
+
+def _columns(rows: List[Any]) -> List[str]:
+    columns: Dict[str, None] = {}
+    for row in rows[:100]:
+        if isinstance(row, dict):
+            columns.update(dict.fromkeys(row))
+    return list(columns)
+
+
+def _preview(row: Any) -> Any:
+    if isinstance(row, dict):
+        return {key: _preview(value) for key, value in row.items()}
+    if isinstance(row, str) and len(row) > PREVIEW_VALUE_CHARS:
+        return row[:PREVIEW_VALUE_CHARS] + "..."
+    return row
+
+
+def store_large_result(owner: str, tool_name: str, result: Any) -> Any:
+    """
+    Swaps a large (data, error) tool result for a handle and a summary of the rows.
+
+    Args:
+        owner: The uid of the user whose run produced the result
+        tool_name: The tool that produced it
+        result: The tool's return value
+
+    Returns:
+        The result unchanged when it is small, failed or has no rows, else
+        (summary, None) where summary carries the handle for read_tool_result.
+    """
+    if not isinstance(result, tuple) or len(result) != 2 or result[1] is not None:
+        return result
+    split = _split_rows(result[0])
+    if split is None:
+        return result
+    rows, metadata = split
+    if len(json.dumps(result[0], default=str)) <= RESULT_STORE_MIN_CHARS:
+        return result
+
+    handle = result_store.put(owner, tool_name, rows, metadata)
+    logging.info(f"Stored {len(rows)} rows from {tool_name} as {handle}")
+    return {
+        "result_handle": handle,
+        "row_count": len(rows),
+        "columns": _columns(rows),
+        "first_rows": [_preview(row) for row in rows[:PREVIEW_ROWS]],
+        "metadata": metadata,
+        "note": "The full result is kept on the server. Use read_tool_result with this "
+        "handle to page through, filter or aggregate the rows instead of calling the tool again.",
+    }, None
+
+
+def page_large_results(tool: Callable) -> Callable:
+    """Wraps a RunContext tool so its large results are stored and replaced by a handle."""
+    if inspect.iscoroutinefunction(tool):
+
+        @functools.wraps(tool)
+        async def async_wrapper(ctx: RunContext, *args, **kwargs):
+            result = await tool(ctx, *args, **kwargs)
+            return store_large_result(ctx.deps.user_object.uid, tool.__name__, result)
+
+        return async_wrapper
+
+    @functools.wraps(tool)
+    def wrapper(ctx: RunContext, *args, **kwargs):
+        return store_large_result(ctx.deps.user_object.uid, tool.__name__, tool(ctx, *args, **kwargs))
+
+    return wrapper
+
+
+def _field(row: Any, path: str) -> Any:
+    """Reads a dotted field path such as 'manager.displayName' from a row."""
+    value = row
+    for key in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _aggregate(rows: List[Any], aggregate: str, aggregate_field: Optional[str]) -> Any:
+    if aggregate == "count":
+        return len(rows) if not aggregate_field else sum(
+            1 for row in rows if _field(row, aggregate_field) not in (None, "", [])
+        )
+    values = [n for n in (_number(_field(row, aggregate_field)) for row in rows) if n is not None]
+    if not values:
+        return None
+    if aggregate == "sum":
+        return sum(values)
+    if aggregate == "avg":
+        return sum(values) / len(values)
+    if aggregate == "min":
+        return min(values)
+    return max(values)
+
+
+def query_stored_rows(
+    handle: str,
+    owner: Optional[str] = None,
+    offset: int = 0,
+    limit: int = 50,
+    filter_field: Optional[str] = None,
+    filter_value: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    aggregate: Optional[str] = None,
+    aggregate_field: Optional[str] = None,
+    group_by: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Shared implementation of read_tool_result and read_tool_result_no_ctx."""
+    if offset < 0:
+        return None, {"error": f"Invalid offset {offset}", "details": "offset must be 0 or more."}
+    entry = result_store.get(handle, owner)
+    if entry is None:
+        return None, {
+            "error": f"Unknown or expired result handle {handle}",
+            "details": "Call the original tool again to get a fresh handle.",
+        }
+
+    rows = entry.rows
+    if filter_field and filter_value is not None:
+        needle = str(filter_value).lower()
+        rows = [
+            row for row in rows
+            if _field(row, filter_field) is not None and needle in str(_field(row, filter_field)).lower()
+        ]
+
+    if aggregate:
+        if aggregate not in ("count", "sum", "avg", "min", "max"):
+            return None, {"error": f"Unsupported aggregate {aggregate}", "details": "Use count, sum, avg, min or max."}
+        if aggregate != "count" and not aggregate_field:
+            return None, {"error": f"aggregate_field is required for {aggregate}"}
+        if group_by:
+            groups: Dict[str, List[Any]] = {}
+            for row in rows:
+                groups.setdefault(str(_field(row, group_by)), []).append(row)
+            value: Any = {key: _aggregate(members, aggregate, aggregate_field) for key, members in groups.items()}
+        else:
+            value = _aggregate(rows, aggregate, aggregate_field)
+        return {"result_handle": handle, "matched_rows": len(rows), aggregate: value}, None
+
+    limit = max(1, min(limit, MAX_READ_ROWS))
+    page = rows[offset : offset + limit]
+    if fields:
+        page = [{field: _field(row, field) for field in fields} for row in page]
+    next_offset = offset + len(page)
+    return {
+        "result_handle": handle,
+        "matched_rows": len(rows),
+        "offset": offset,
+        "rows": page,
+        "next_offset": next_offset if next_offset < len(rows) else None,
+    }, None
+
+
+async def read_tool_result(
+    ctx: RunContext,
+    handle: str,
+    offset: int = 0,
+    limit: int = 50,
+    filter_field: Optional[str] = None,
+    filter_value: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    aggregate: Optional[str] = None,
+    aggregate_field: Optional[str] = None,
+    group_by: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Reads rows from a large tool result that was stored on the server behind a result_handle.
+
+    Use this instead of calling the original tool again. Page with offset and limit, narrow
+    with filter_field/filter_value, pick columns with fields, or compute an aggregate.
+
+    Args:
+        handle (str): The result_handle returned in place of the full tool result
+        offset (int, optional): Index of the first row to return, use next_offset to continue
+        limit (int, optional): Number of rows to return, at most 200
+        filter_field (str, optional): Field to filter on, dotted paths like 'manager.displayName' work
+        filter_value (str, optional): Case-insensitive text the filter_field must contain
+        fields (List[str], optional): Only return these fields of each row
+        aggregate (str, optional): One of count, sum, avg, min, max over the (filtered) rows
+        aggregate_field (str, optional): Field to aggregate, required except for count
+        group_by (str, optional): Field to group the aggregate by
+
+    Returns:
+        tuple: (page, error) where page contains the rows or the aggregate if successful,
+        or None and error details if failed
+    """
+    return query_stored_rows(
+        handle,
+        ctx.deps.user_object.uid,
+        offset,
+        limit,
+        filter_field,
+        filter_value,
+        fields,
+        aggregate,
+        aggregate_field,
+        group_by,
+    )
+
+
+def read_tool_result_no_ctx(
+    handle: str,
+    offset: int = 0,
+    limit: int = 50,
+    filter_field: Optional[str] = None,
+    filter_value: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+    aggregate: Optional[str] = None,
+    aggregate_field: Optional[str] = None,
+    group_by: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Reads rows from a large tool result that was stored on the server behind a result_handle.
+
+    Args:
+        handle (str): The result_handle returned in place of the full tool result
+        offset (int, optional): Index of the first row to return
+        limit (int, optional): Number of rows to return, at most 200
+        filter_field (str, optional): Field to filter on, dotted paths work
+        filter_value (str, optional): Case-insensitive text the filter_field must contain
+        fields (List[str], optional): Only return these fields of each row
+        aggregate (str, optional): One of count, sum, avg, min, max
+        aggregate_field (str, optional): Field to aggregate, required except for count
+        group_by (str, optional): Field to group the aggregate by
+
+    Returns:
+        tuple: (page, error) where page contains the rows or the aggregate if successful,
+        or None and error details if failed
+    """
+    if in_worker():
+        # Called from python_interpreter, the results are stored in the server process
+        return call_server(
+            (
+                "read_tool_result",
+                handle,
+                offset,
+                limit,
+                filter_field,
+                filter_value,
+                fields,
+                aggregate,
+                aggregate_field,
+                group_by,
+            )
+        )
+    return query_stored_rows(
+        handle,
+        None,
+        offset,
+        limit,
+        filter_field,
+        filter_value,
+        fields,
+        aggregate,
+        aggregate_field,
+        group_by,
+    )
@@ -1,16 +1,23 @@
 import json
+import asyncio
 from custom import RunContext
 import logging
 import time
 
 # from pydantic_ai import agent_tool # Assuming you'll use agent_tool later, but not crucial for this core logic.
 from typing import Tuple, Optional, Dict, Any, List
-from helpers.RequestHelper import make_request
-from ai.assistant_functions.channel_functions import list_channels, list_channels_no_ctx
+from helpers import DirectoryMirror as directory_mirror
+from helpers.DirectoryIndex import filter_objects
+from helpers.RequestHelper import (
+    make_request,
+    make_request_async,
+    make_batch_request,
+    make_batch_request_async,
+)
 
 
 ## ✅ 1. Create a user
-def create_user(
+async def create_user(
     ctx: RunContext, display_name: str, user_principal_name: str, password: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Creates a new user in Microsoft Azure AD.
@@ -40,7 +47,7 @@ def create_user(
             "password": password,
         },
     }
-    response, error = make_request("POST", url, json_data=payload)
+    response, error = await make_request_async("POST", url, json_data=payload)
     if error:
         logging.error(f"Failed to create user: {error}")
         end_time = time.time()
@@ -109,7 +116,7 @@ def create_user_no_ctx(
 
 
 ## ✅ 2. List all users
-def list_users(
+async def list_users(
     ctx: RunContext,
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Lists all users in Microsoft Azure AD.
@@ -121,12 +128,17 @@ def list_users(
     start_time = time.time()
     logging.info("Starting list_users function")
 
+    mirrored = await asyncio.to_thread(directory_mirror.list_objects, "user")
+    if mirrored is not None:
+        logging.info(f"list_users served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     url = "https://graph.microsoft.com/v1.0/users"
     all_users = []
 
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
             # print("response", response)
 
             if error:
@@ -167,6 +179,11 @@ def list_users_no_ctx() -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[s
     start_time = time.time()
     logging.info("Starting list_users function")
 
+    mirrored = directory_mirror.list_objects("user")
+    if mirrored is not None:
+        logging.info(f"list_users served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     url = "https://graph.microsoft.com/v1.0/users"
     all_users = []
 
@@ -204,7 +221,7 @@ def list_users_no_ctx() -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[s
 
 
 ## ✅ 4. Add a user to a team
-def add_user_to_team(
+async def add_user_to_team(
     ctx: RunContext, team_id: str, user_email: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Adds a user to an existing Microsoft Team.
@@ -229,7 +246,7 @@ def add_user_to_team(
         "user@odata.bind": f"https://graph.microsoft.com/v1.0/users('{user_email}')",
     }
 
-    response, error = make_request("POST", url, json_data=payload)
+    response, error = await make_request_async("POST", url, json_data=payload)
 
     if error:
         logging.error(f"Failed to add user to team: {error}")
@@ -295,7 +312,7 @@ def add_user_to_team_no_ctx(
 
 
 ## ✅ 7. Search for users
-def search_users(
+async def search_users(
     ctx: RunContext, search_string: str
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Searches for users whose display name contains the search string.
@@ -310,11 +327,16 @@ def search_users(
     start_time = time.time()
     logging.info(f"Starting search_users function with search string: {search_string}")
 
+    mirrored = await asyncio.to_thread(directory_mirror.search_objects, "user", "displayName", search_string, True)
+    if mirrored is not None:
+        logging.info(f"search_users served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     url = f"https://graph.microsoft.com/v1.0/users?$filter=startsWith(displayName, '{search_string}')"
     all_users = []
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
 
             if error:
                 logging.error(f"Failed to search users: {error}")
@@ -360,6 +382,11 @@ def search_users_no_ctx(
     start_time = time.time()
     logging.info(f"Starting search_users function with search string: {search_string}")
 
+    mirrored = directory_mirror.search_objects("user", "displayName", search_string, True)
+    if mirrored is not None:
+        logging.info(f"search_users served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     url = f"https://graph.microsoft.com/v1.0/users?$filter=startsWith(displayName, '{search_string}')"
     all_users = []
     try:
@@ -395,8 +422,8 @@ def search_users_no_ctx(
         return None, {"error": "Unexpected error searching users", "details": str(e)}
 
 
-def search_users_by_field(
-    ctx: RunContext, search_string: str, filter_field: str
+async def search_users_by_field(
+    ctx: RunContext, search_string: str, filter_field: str, fuzzy: bool = False
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Searches for users whose display name contains the search string.
 
@@ -411,6 +438,7 @@ def search_users_by_field(
             - jobTitle: The user's job title
             - mobilePhone: The user's mobile phone number
             - officeLocation: The user's office location
+        fuzzy (bool, optional): Also match close spellings (typos), best matches first
 
     Returns:
         tuple: (users_list, error) where users_list contains matching users if successful,
@@ -421,11 +449,16 @@ def search_users_by_field(
         f"Starting search_users_by_field function with search string: {search_string} in field: {filter_field}"
     )
 
+    mirrored = await asyncio.to_thread(directory_mirror.search_objects, "user", filter_field, search_string, fuzzy=fuzzy)
+    if mirrored is not None:
+        logging.info(f"search_users_by_field served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     all_users = []
     url = "https://graph.microsoft.com/v1.0/users"
 
     while url:
-        response, error = make_request("GET", url)
+        response, error = await make_request_async("GET", url)
 
         if error:
             logging.error(f"Failed to search users: {error}")
@@ -442,11 +475,7 @@ def search_users_by_field(
         else:
             url = None
 
-    filtered_users = [
-        user
-        for user in all_users
-        if search_string.lower() in str(user.get(filter_field, "")).lower()
-    ]
+    filtered_users = filter_objects(all_users, filter_field, search_string, fuzzy)
     logging.info(
         f"Found {len(filtered_users)} users matching '{search_string}' in field '{filter_field}'"
     )
@@ -458,7 +487,7 @@ def search_users_by_field(
 
 
 def search_users_by_field_no_ctx(
-    search_string: str, filter_field: str
+    search_string: str, filter_field: str, fuzzy: bool = False
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """Searches for users whose display name contains the search string.
 
@@ -473,6 +502,7 @@ def search_users_by_field_no_ctx(
             - jobTitle: The user's job title
             - mobilePhone: The user's mobile phone number
             - officeLocation: The user's office location
+        fuzzy (bool, optional): Also match close spellings (typos), best matches first
 
     Returns:
         tuple: (users_list, error) where users_list contains matching users if successful,
@@ -483,6 +513,11 @@ def search_users_by_field_no_ctx(
         f"Starting search_users_by_field function with search string: {search_string} in field: {filter_field}"
     )
 
+    mirrored = directory_mirror.search_objects("user", filter_field, search_string, fuzzy=fuzzy)
+    if mirrored is not None:
+        logging.info(f"search_users_by_field served {len(mirrored)} users from the directory mirror")
+        return mirrored, None
+
     all_users = []
     url = "https://graph.microsoft.com/v1.0/users"
 
@@ -504,11 +539,7 @@ def search_users_by_field_no_ctx(
         else:
             url = None
 
-    filtered_users = [
-        user
-        for user in all_users
-        if search_string.lower() in str(user.get(filter_field, "")).lower()
-    ]
+    filtered_users = filter_objects(all_users, filter_field, search_string, fuzzy)
     logging.info(
         f"Found {len(filtered_users)} users matching '{search_string}' in field '{filter_field}'"
     )
@@ -520,7 +551,7 @@ def search_users_by_field_no_ctx(
 
 
 ## ✅ 8. Get details for a specific user by their ID or userPrincipalName.
-def get_user(
+async def get_user(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """Gets details for a specific user by their ID or userPrincipalName.
@@ -536,7 +567,7 @@ def get_user(
     logging.info(f"Starting get_user function for user ID: {user_id}")
 
     url = f"https://graph.microsoft.com/v1.0/users/{user_id}"
-    response, error = make_request("GET", url)
+    response, error = await make_request_async("GET", url)
 
     if error:
         logging.error(f"Failed to get user: {error}")
@@ -589,7 +620,7 @@ def get_user_no_ctx(
 
 
 # make tools for update user display name, job title, and email all separate tools
-def update_user_display_name(
+async def update_user_display_name(
     ctx: RunContext, user_id: str, display_name: str
 ) -> Tuple[None, Optional[Dict[str, Any]]]:
     """Updates a user's display name.
@@ -607,7 +638,7 @@ def update_user_display_name(
     url = f"https://graph.microsoft.com/v1.0/users/{user_id}"
     updates = {"displayName": display_name}
 
-    response, error = make_request("PATCH", url, json_data=updates)
+    response, error = await make_request_async("PATCH", url, json_data=updates)
 
     if error:
         logging.error(f"Failed to update user display name: {error}")
@@ -665,7 +696,7 @@ def update_user_display_name_no_ctx(
     return None, None
 
 
-def update_user_job_title(
+async def update_user_job_title(
     ctx: RunContext, user_id: str, job_title: str
 ) -> Tuple[None, Optional[Dict[str, Any]]]:
     """Updates a user's job title.
@@ -683,7 +714,7 @@ def update_user_job_title(
     url = f"https://graph.microsoft.com/v1.0/users/{user_id}"
     updates = {"jobTitle": job_title}
 
-    response, error = make_request("PATCH", url, json_data=updates)
+    response, error = await make_request_async("PATCH", url, json_data=updates)
 
     if error:
         logging.error(f"Failed to update user job title: {error}")
@@ -741,7 +772,7 @@ def update_user_job_title_no_ctx(
     return None, None
 
 
-def update_user_email(
+async def update_user_email(
     ctx: RunContext, user_id: str, email: str
 ) -> Tuple[None, Optional[Dict[str, Any]]]:
     """Updates a user's email address.
@@ -759,7 +790,7 @@ def update_user_email(
     url = f"https://graph.microsoft.com/v1.0/users/{user_id}"
     updates = {"mail": email, "userPrincipalName": email}
 
-    response, error = make_request("PATCH", url, json_data=updates)
+    response, error = await make_request_async("PATCH", url, json_data=updates)
 
     if error:
         logging.error(f"Failed to update user email: {error}")
@@ -814,7 +845,7 @@ def update_user_email_no_ctx(
 
 
 ## ✅ 10. Delete a user
-def delete_user(
+async def delete_user(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
     """Deletes a user from Microsoft Azure AD.
@@ -830,7 +861,7 @@ def delete_user(
     logging.info(f"Starting delete_user function for user {user_id}")
 
     url = f"https://graph.microsoft.com/v1.0/users/{user_id}"
-    response, error = make_request("DELETE", url)
+    response, error = await make_request_async("DELETE", url)
 
     if error:
         logging.error(f"Failed to delete user: {error}")
@@ -882,7 +913,7 @@ def delete_user_no_ctx(
     return f"Successfully deleted user {user_id}", None  # Return success message
 
 
-def get_user_teams(
+async def get_user_teams(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
@@ -904,7 +935,7 @@ def get_user_teams(
 
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
 
             if error:
                 logging.error(f"Failed to get teams for user {user_id}: {error}")
@@ -986,7 +1017,7 @@ def get_user_teams_no_ctx(
         return None, {"error": "Unexpected error getting user teams", "details": str(e)}
 
 
-def get_user_channels(
+async def get_user_channels(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[Dict[str, List[Dict[str, Any]]]], Optional[Dict[str, Any]]]:
     """
@@ -1002,7 +1033,7 @@ def get_user_channels(
     start_time = time.time()
     logging.info(f"Starting get_user_channels function for user {user_id}")
 
-    user_teams, teams_error = get_user_teams(ctx, user_id)
+    user_teams, teams_error = await get_user_teams(ctx, user_id)
 
     if teams_error:
         end_time = time.time()
@@ -1014,16 +1045,19 @@ def get_user_channels(
     user_channels = {}
     errors = []
 
-    for team in user_teams:
-        team_id = team["id"]
-        channels, channels_error = list_channels(ctx, team_id)
+    team_ids = [team["id"] for team in user_teams]
+    results = await make_batch_request_async(
+        [{"url": f"/teams/{team_id}/channels"} for team_id in team_ids]
+    )
+
+    for team_id, (response, channels_error) in zip(team_ids, results):
         if channels_error:
             logging.warning(
                 f"Error getting channels for team {team_id}: {channels_error}"
             )
             errors.append({team_id: channels_error})
             continue  # Proceed to the next team
-        user_channels[team_id] = channels
+        user_channels[team_id] = response.get("value", [])
 
     logging.info(
         f"Retrieved channels for {len(user_channels)} teams for user {user_id}"
@@ -1062,16 +1096,19 @@ def get_user_channels_no_ctx(
     user_channels = {}
     errors = []
 
-    for team in user_teams:
-        team_id = team["id"]
-        channels, channels_error = list_channels_no_ctx(team_id)
+    team_ids = [team["id"] for team in user_teams]
+    results = make_batch_request(
+        [{"url": f"/teams/{team_id}/channels"} for team_id in team_ids]
+    )
+
+    for team_id, (response, channels_error) in zip(team_ids, results):
         if channels_error:
             logging.warning(
                 f"Error getting channels for team {team_id}: {channels_error}"
             )
             errors.append({team_id: channels_error})
             continue  # Proceed to the next team
-        user_channels[team_id] = channels
+        user_channels[team_id] = response.get("value", [])
 
     logging.info(
         f"Retrieved channels for {len(user_channels)} teams for user {user_id}"
@@ -1083,7 +1120,7 @@ def get_user_channels_no_ctx(
     return user_channels, None if not errors else {"errors": errors}
 
 
-def get_user_licenses(
+async def get_user_licenses(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
@@ -1105,7 +1142,7 @@ def get_user_licenses(
 
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
             if error:
                 logging.error(
                     f"Failed to get license details for user {user_id}: {error}"
@@ -1200,7 +1237,82 @@ def get_user_licenses_no_ctx(
         }
 
 
-def list_available_licenses(
+async def get_licenses_for_users(
+    ctx: RunContext, user_ids: List[str]
+) -> Tuple[Optional[Dict[str, List[Dict[str, Any]]]], Optional[Dict[str, Any]]]:
+    """
+    Retrieves license details for several users at once using Graph JSON batching.
+
+    Args:
+    ctx (RunContext): The context containing configuration and state.
+    user_ids (List[str]): The users' IDs or userPrincipalNames.
+
+    Returns:
+    tuple: (licenses_by_user, error). licenses_by_user maps each user ID to its list of
+    license details for every user that succeeded; error is None, or
+    {"errors": [{user_id: error}, ...]} listing the users that failed.
+    """
+    start_time = time.time()
+    logging.info(f"Starting get_licenses_for_users function for {len(user_ids)} users")
+
+    results = await make_batch_request_async(
+        [{"url": f"/users/{user_id}/licenseDetails"} for user_id in user_ids]
+    )
+    licenses_by_user, errors = _collect_user_licenses(user_ids, results)
+
+    end_time = time.time()
+    logging.info(
+        f"get_licenses_for_users function completed in {end_time - start_time:.2f} seconds"
+    )
+    return licenses_by_user, None if not errors else {"errors": errors}
+
+
+def get_licenses_for_users_no_ctx(
+    user_ids: List[str],
+) -> Tuple[Optional[Dict[str, List[Dict[str, Any]]]], Optional[Dict[str, Any]]]:
+    """
+    Retrieves license details for several users at once using Graph JSON batching.
+
+    Args:
+    user_ids (List[str]): The users' IDs or userPrincipalNames.
+
+    Returns:
+    tuple: (licenses_by_user, error). licenses_by_user maps each user ID to its list of
+    license details for every user that succeeded; error is None, or
+    {"errors": [{user_id: error}, ...]} listing the users that failed.
+    """
+    start_time = time.time()
+    logging.info(f"Starting get_licenses_for_users function for {len(user_ids)} users")
+
+    results = make_batch_request(
+        [{"url": f"/users/{user_id}/licenseDetails"} for user_id in user_ids]
+    )
+    licenses_by_user, errors = _collect_user_licenses(user_ids, results)
+
+    end_time = time.time()
+    logging.info(
+        f"get_licenses_for_users function completed in {end_time - start_time:.2f} seconds"
+    )
+    return licenses_by_user, None if not errors else {"errors": errors}
+
+
+def _collect_user_licenses(
+    user_ids: List[str], results: List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]
+) -> Tuple[Dict[str, List[Dict[str, Any]]], List[Dict[str, Any]]]:
+    """Maps batched licenseDetails responses back to their user IDs."""
+    licenses_by_user = {}
+    errors = []
+    for user_id, (response, error) in zip(user_ids, results):
+        if error:
+            logging.warning(f"Error getting license details for user {user_id}: {error}")
+            errors.append({user_id: error})
+            continue
+        licenses_by_user[user_id] = response.get("value", [])
+    logging.info(f"Retrieved license details for {len(licenses_by_user)} users")
+    return licenses_by_user, errors
+
+
+async def list_available_licenses(
     ctx: RunContext,
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
@@ -1221,7 +1333,7 @@ def list_available_licenses(
 
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
             if error:
                 logging.error(f"Failed to list available licenses: {error}")
                 end_time = time.time()
@@ -1299,7 +1411,7 @@ def list_available_licenses_no_ctx() -> Tuple[Optional[List[Dict[str, Any]]], Op
         }
 
 
-def add_license_to_user(
+async def add_license_to_user(
     ctx: RunContext, user_id: str, sku_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1333,7 +1445,7 @@ def add_license_to_user(
     }
 
     try:
-        response, error = make_request("POST", url, json_data=payload)
+        response, error = await make_request_async("POST", url, json_data=payload)
         if error:
             logging.error(
                 f"Failed to assign license {sku_id} to user {user_id}: {error}"
@@ -1428,7 +1540,7 @@ def add_license_to_user_no_ctx(
         return None, {"error": "Unexpected error assigning license", "details": str(e)}
 
 
-def remove_license_from_user(
+async def remove_license_from_user(
     ctx: RunContext, user_id: str, sku_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1453,7 +1565,7 @@ def remove_license_from_user(
     payload = {"addLicenses": [], "removeLicenses": [sku_id]}
 
     try:
-        response, error = make_request("POST", url, json_data=payload)
+        response, error = await make_request_async("POST", url, json_data=payload)
         if error:
             logging.error(
                 f"Failed to remove license {sku_id} from user {user_id}: {error}"
@@ -1531,7 +1643,7 @@ def remove_license_from_user_no_ctx(
         return None, {"error": "Unexpected error removing license", "details": str(e)}
 
 
-def set_user_usage_location(
+async def set_user_usage_location(
     ctx: RunContext, user_id: str, usage_location: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1551,7 +1663,7 @@ def set_user_usage_location(
 
     try:
         # Assuming make_request is a helper function that sends PATCH requests
-        response, error = make_request("PATCH", url, json_data=payload)
+        response, error = await make_request_async("PATCH", url, json_data=payload)
         if error:
             logging.error(f"Failed to set usage location for user {user_id}: {error}")
             if response:
@@ -1612,7 +1724,7 @@ def set_user_usage_location_no_ctx(
         }
 
 
-def enforce_mfa_for_user(
+async def enforce_mfa_for_user(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1636,7 +1748,7 @@ def enforce_mfa_for_user(
             "perUserMfaState": "enforced"
         }
         
-        mfa_response, mfa_error = make_request("PATCH", mfa_url, json_data=mfa_payload)
+        mfa_response, mfa_error = await make_request_async("PATCH", mfa_url, json_data=mfa_payload)
         
 
         if mfa_error:
@@ -1713,7 +1825,7 @@ def enforce_mfa_for_user_no_ctx(
         return None, {"error": "Unexpected error enabling MFA", "details": str(e)}
 
 
-def reset_user_password(
+async def reset_user_password(
     ctx: RunContext, user_id: str, new_password: str, force_change_password_next_sign_in: bool = True
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1741,7 +1853,7 @@ def reset_user_password(
     }
     
     try:
-        response, error = make_request("PATCH", url, json_data=payload)
+        response, error = await make_request_async("PATCH", url, json_data=payload)
 
         ##print response in full nice json format
         print("response", json.dumps(response, indent=2))
@@ -1826,7 +1938,7 @@ def reset_user_password_no_ctx(
         return None, {"error": "Unexpected error resetting password", "details": str(e)}
 
 
-def get_user_password_methods(
+async def get_user_password_methods(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[List[Dict[str, Any]]], Optional[Dict[str, Any]]]:
     """
@@ -1848,7 +1960,7 @@ def get_user_password_methods(
     
     try:
         while url:
-            response, error = make_request("GET", url)
+            response, error = await make_request_async("GET", url)
             
             if error:
                 logging.error(f"Failed to get password methods for user {user_id}: {error}")
@@ -1929,7 +2041,7 @@ def get_user_password_methods_no_ctx(
         return None, {"error": "Unexpected error getting password methods", "details": str(e)}
 
 
-def block_sign_in(
+async def block_sign_in(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -1952,7 +2064,7 @@ def block_sign_in(
     }
     
     try:
-        response, error = make_request("PATCH", url, json_data=payload)
+        response, error = await make_request_async("PATCH", url, json_data=payload)
         
         if error:
             logging.error(f"Failed to block sign in for user {user_id}: {error}")
@@ -2026,7 +2138,7 @@ def block_sign_in_no_ctx(
         return None, {"error": "Unexpected error blocking sign in", "details": str(e)}
 
 
-def unblock_sign_in(
+async def unblock_sign_in(
     ctx: RunContext, user_id: str
 ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
     """
@@ -2049,7 +2161,7 @@ def unblock_sign_in(
     }
     
     try:
-        response, error = make_request("PATCH", url, json_data=payload)
+        response, error = await make_request_async("PATCH", url, json_data=payload)
         
         if error:
             logging.error(f"Failed to unblock sign in for user {user_id}: {error}")
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ai.models import Blob
+
+try:
+    import zstandard
+except ImportError:  # Optional, blobs are stored uncompressed without it
+    zstandard = None
+
+# Stored message values at least this long (as JSON) go to the blob table
+BLOB_MIN_BYTES = int(os.getenv("BLOB_MIN_BYTES", "2048"))
+BLOB_COMPRESSION = os.getenv("BLOB_COMPRESSION", "zstd")
+BLOB_CACHE_ENTRIES = 512
+
+_BLOB_KEY = "$blob"
+# Reference form for fields typed as str, e.g. SystemPromptPart.content
+_BLOB_TEXT_PREFIX = "$blob:"
+
+_cache: "OrderedDict[str, Any]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def is_blob_ref(value: Any) -> bool:
+    return isinstance(value, dict) and len(value) == 1 and _BLOB_KEY in value
+
+
+def blob_ref(value: Any, blobs: Dict[str, Blob], as_text: bool = False) -> Any:
+    """
+    Moves a large value into a content-addressed blob.
+
+    Args:
+        value: Any JSON-serializable value from a message part
+        blobs: Collects the Blob rows to write alongside the message, keyed by hash
+        as_text: Return the reference as a "$blob:<hash>" string instead of a dict
+
+    Returns:
+        The value itself when small, else a {"$blob": hash} reference to it
+    """
+    encoded = json.dumps(value).encode()
+    if len(encoded) < BLOB_MIN_BYTES:
+        return value
+    digest = hashlib.sha256(encoded).hexdigest()
+    if digest not in blobs:
+        encoding = "raw"
+        data = encoded
+        if BLOB_COMPRESSION == "zstd" and zstandard is not None:
+            encoding = "zstd"
+            data = zstandard.ZstdCompressor().compress(encoded)
+        blobs[digest] = Blob(hash=digest, encoding=encoding, data=data, size=len(encoded))
+        _remember(digest, value)
+    return _BLOB_TEXT_PREFIX + digest if as_text else {_BLOB_KEY: digest}
+
+
+def _remember(digest: str, value: Any) -> None:
+    with _cache_lock:
+        _cache[digest] = value
+        _cache.move_to_end(digest)
+        while len(_cache) > BLOB_CACHE_ENTRIES:
+            _cache.popitem(last=False)
+
+
+def _decode(blob: Blob) -> Any:
+    data = blob.data
+    if blob.encoding == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read compressed blobs")
+        data = zstandard.ZstdDecompressor().decompress(data, max_output_size=blob.size)
+    return json.loads(data)
+
+
+async def load_blobs(session: AsyncSession, hashes: Iterable[str]) -> Dict[str, Any]:
+    """Decoded values for the given hashes, from the cache or one query for the rest."""
+    values: Dict[str, Any] = {}
+    missing = []
+    with _cache_lock:
+        for digest in set(hashes):
+            if digest in _cache:
+                _cache.move_to_end(digest)
+                values[digest] = _cache[digest]
+            else:
+                missing.append(digest)
+    if missing:
+        rows = await session.exec(select(Blob).where(Blob.hash.in_(missing)))
+        for blob in rows.all():
+            try:
+                values[blob.hash] = _decode(blob)
+            except Exception:
+                logging.exception(f"Failed to decode blob {blob.hash}")
+                continue
+            _remember(blob.hash, values[blob.hash])
+    return values
+
+
+def blob_hash(value: Any) -> Optional[str]:
+    """The hash a reference (in either form) points to, None for any other value."""
+    if is_blob_ref(value):
+        return value[_BLOB_KEY]
+    if isinstance(value, str) and value.startswith(_BLOB_TEXT_PREFIX) and len(value) == len(_BLOB_TEXT_PREFIX) + 64:
+        return value[len(_BLOB_TEXT_PREFIX):]
+    return None
+
+
+def as_text_ref(value: Any) -> Any:
+    """A dict reference in its string form, any other value unchanged."""
+    digest = blob_hash(value)
+    return _BLOB_TEXT_PREFIX + digest if digest else value
+
+
+def resolve_blob(value: Any, blobs: Optional[Dict[str, Any]], unloaded: Any = None) -> Any:
+    """
+    The value a reference points to, or value itself when it is not a reference.
+
+    References that were deliberately not loaded resolve to `unloaded` when given.
+    """
+    digest = blob_hash(value)
+    if digest is None:
+        return value
+    if blobs is not None and digest in blobs:
+        return blobs[digest]
+    if unloaded is not None:
+        return unloaded
+    logging.warning(f"Blob {digest} is not loaded")
+    return "[content unavailable]"
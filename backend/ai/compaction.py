@@ -0,0 +1,119 @@
+import dataclasses
+import json
+import os
+from typing import Any, List
+
+from custom.messages import (
+    ModelMessage,
+    ModelRequest,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+# Pending history (tokens after the last summary) that triggers a compaction
+COMPACTION_TOKEN_THRESHOLD = int(os.getenv("COMPACTION_TOKEN_THRESHOLD", "40000"))
+# Newest history kept verbatim when compacting
+COMPACTION_KEEP_TOKENS = int(os.getenv("COMPACTION_KEEP_TOKENS", "12000"))
+# Tool results larger than this are stubbed once they are out of the newest turns
+STALE_TOOL_RESULT_TOKENS = int(os.getenv("STALE_TOOL_RESULT_TOKENS", "1000"))
+FRESH_TOOL_RESULT_TURNS = int(os.getenv("FRESH_TOOL_RESULT_TURNS", "2"))
+# Per tool result, when rendering turns for the summarizer
+TRANSCRIPT_TOOL_RESULT_CHARS = 2000
+
+
+def _content_text(content: Any) -> str:
+    return content if isinstance(content, str) else json.dumps(content, default=str)
+
+
+def is_user_turn(message: ModelMessage) -> bool:
+    """Whether a message starts a new turn, i.e. carries the user's prompt"""
+    return isinstance(message, ModelRequest) and any(
+        isinstance(part, UserPromptPart) for part in message.parts
+    )
+
+
+def stub_stale_tool_results(
+    messages: List[ModelMessage],
+    fresh_turns: int = FRESH_TOOL_RESULT_TURNS,
+    max_tokens: int = STALE_TOOL_RESULT_TOKENS,
+) -> List[ModelMessage]:
+    """Replace large tool results older than the newest fresh_turns turns with a short stub"""
+    turn_starts = [index for index, message in enumerate(messages) if is_user_turn(message)]
+    if len(turn_starts) <= fresh_turns:
+        return messages
+    fresh_from = turn_starts[-fresh_turns] if fresh_turns > 0 else len(messages)
+
+    compacted = []
+    for index, message in enumerate(messages):
+        if index < fresh_from and isinstance(message, ModelRequest):
+            parts = []
+            for part in message.parts:
+                if isinstance(part, ToolReturnPart):
+                    tokens = len(_content_text(part.content)) // 4
+                    if tokens > max_tokens:
+                        part = dataclasses.replace(
+                            part,
+                            content=f"[Elided {part.tool_name} result of about {tokens} tokens, "
+                            "call the tool again if it is needed]",
+                        )
+                parts.append(part)
+            message = dataclasses.replace(message, parts=parts)
+        compacted.append(message)
+    return compacted
+
+
+def add_summary(messages: List[ModelMessage], summary: str) -> List[ModelMessage]:
+    """Put the rolling summary right after the system prompt of the conversation's first message"""
+    if not summary or not messages or not isinstance(messages[0], ModelRequest):
+        return messages
+    first = messages[0]
+    parts = list(first.parts)
+    parts.insert(
+        1 if parts and isinstance(parts[0], SystemPromptPart) else 0,
+        SystemPromptPart(content=f"Summary of the earlier conversation:\n{summary}"),
+    )
+    return [dataclasses.replace(first, parts=parts)] + messages[1:]
+
+
+def render_transcript(messages: List[ModelMessage]) -> str:
+    """Plain-text rendering of turns for the summarizer, with tool results truncated"""
+    lines = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, UserPromptPart):
+                lines.append(f"User: {_content_text(part.content)}")
+            elif isinstance(part, TextPart):
+                lines.append(f"Assistant: {part.content}")
+            elif isinstance(part, ToolCallPart):
+                lines.append(f"Assistant called {part.tool_name}({_content_text(part.args)})")
+            elif isinstance(part, ToolReturnPart):
+                result = _content_text(part.content)
+                if len(result) > TRANSCRIPT_TOOL_RESULT_CHARS:
+                    result = result[:TRANSCRIPT_TOOL_RESULT_CHARS] + " ...(truncated)"
+                lines.append(f"{part.tool_name} returned: {result}")
+    return "\n".join(lines)
+
+
+def compaction_cut(messages: List[ModelMessage], token_estimates: List[int], keep_tokens: int) -> int:
+    """
+    Index of the first message to keep verbatim, everything before it gets summarized.
+
+    The newest keep_tokens worth of messages are kept, and the cut is moved to the start
+    of a user turn so a tool call is never separated from its return. Returns 0 when
+    nothing can be summarized.
+    """
+    cut = len(messages)
+    kept = 0
+    while cut > 0 and kept + token_estimates[cut - 1] <= keep_tokens:
+        cut -= 1
+        kept += token_estimates[cut]
+
+    turn_starts = [index for index, message in enumerate(messages) if is_user_turn(message)]
+    earlier = [index for index in turn_starts if 0 < index <= cut]
+    if earlier:
+        return earlier[-1]
+    later = [index for index in turn_starts if index > cut]
+    return later[0] if later else 0
@@ -0,0 +1,274 @@
+import dataclasses
+import logging
+import os
+from typing import List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ai.compaction import (
+    COMPACTION_KEEP_TOKENS,
+    COMPACTION_TOKEN_THRESHOLD,
+    add_summary,
+    compaction_cut,
+    is_user_turn,
+    render_transcript,
+    stub_stale_tool_results,
+)
+from ai.message_codec import load_model_messages
+from ai.models import Conversation, Message as DBMessage
+from custom.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    RetryPromptPart,
+    SystemPromptPart,
+    ToolCallPart,
+    ToolReturnPart,
+)
+from helpers.helper_funcs import summarize_conversation
+
+# How much stored history is sent back to the model each turn
+HISTORY_MAX_MESSAGES = int(os.getenv("HISTORY_MAX_MESSAGES", "200"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "60000"))
+# Rows read at a time when looking back for the start of the newest turn
+NEWEST_TURN_BATCH = 20
+
+
+def _tool_call_ids(message: ModelMessage, part_type: type) -> set:
+    return {
+        part.tool_call_id
+        for part in message.parts
+        if isinstance(part, part_type) and part.tool_call_id
+    }
+
+
+def trim_to_complete_turns(messages: List[ModelMessage]) -> List[ModelMessage]:
+    """Drop messages at the edges of a history window that would split a tool call from its return"""
+    start = next(
+        (index for index, message in enumerate(messages) if is_user_turn(message)),
+        None,
+    )
+    if start is None:
+        # No user turn starts inside the window, only skip returns whose call was cut off
+        start = 0
+        while start < len(messages) and isinstance(messages[start], ModelRequest) and (
+            _tool_call_ids(messages[start], ToolReturnPart)
+            or _tool_call_ids(messages[start], RetryPromptPart)
+        ):
+            start += 1
+    messages = messages[start:]
+
+    # A run that stopped after asking for tools leaves calls that never got a return
+    if messages and isinstance(messages[-1], ModelResponse) and _tool_call_ids(
+        messages[-1], ToolCallPart
+    ):
+        messages = messages[:-1]
+    return messages
+
+
+def with_system_prompt(
+    first: Optional[ModelMessage], messages: List[ModelMessage]
+) -> List[ModelMessage]:
+    """
+    Put the system prompt of the conversation's first message ahead of a window that starts later.
+
+    Only the SystemPromptParts are kept, the first user prompt is stale by now. They are
+    merged into the window's opening request so the history never has two requests in a row.
+    """
+    system_parts = [
+        part
+        for part in (first.parts if isinstance(first, ModelRequest) else [])
+        if isinstance(part, SystemPromptPart)
+    ]
+    if not system_parts:
+        return messages
+    if messages and isinstance(messages[0], ModelRequest):
+        opening = dataclasses.replace(messages[0], parts=[*system_parts, *messages[0].parts])
+        return [opening] + messages[1:]
+    return [ModelRequest(parts=system_parts)] + messages
+
+
+async def _newest_turn(
+    session: AsyncSession, conversation_id: str, max_messages: int, after_id: Optional[int]
+) -> Tuple[list, List[ModelMessage]]:
+    """Rows and messages of the newest turn, read back in batches until its user prompt is found"""
+    rows: list = []
+    messages: List[Optional[ModelMessage]] = []
+    while len(rows) < max_messages:
+        batch = (
+            await session.exec(
+                select(DBMessage.id, DBMessage.codec, DBMessage.content, DBMessage.payload)
+                .where(DBMessage.conversation_id == conversation_id)
+                .where(DBMessage.id > (after_id or 0))
+                .order_by(DBMessage.created_at.desc(), DBMessage.id.desc())
+                .offset(len(rows))
+                .limit(min(NEWEST_TURN_BATCH, max_messages - len(rows)))
+            )
+        ).all()
+        if not batch:
+            break
+        batch = list(reversed(batch))
+        rows = batch + rows
+        messages = await load_model_messages(session, batch) + messages
+        starts = [
+            index
+            for index, message in enumerate(messages)
+            if message is not None and is_user_turn(message)
+        ]
+        if starts:
+            return rows[starts[-1]:], [message for message in messages[starts[-1]:] if message]
+    return [], []
+
+
+async def get_message_history(
+    session: AsyncSession,
+    conversation_id: str,
+    max_messages: int = HISTORY_MAX_MESSAGES,
+    token_budget: int = HISTORY_TOKEN_BUDGET,
+    after_id: Optional[int] = None,
+) -> List[ModelMessage]:
+    """Load the newest messages that fit in max_messages and token_budget as ModelMessages for the model.
+
+    The window is picked in SQL from the stored token estimates. The newest complete turn
+    is always sent, even when it alone is over the budget, with its large tool results
+    stubbed. When the window starts after the conversation's first message, that message's
+    system prompt is kept in front of it. Messages up to after_id are left out, they are
+    covered by the conversation's summary.
+    """
+    running_tokens = (
+        func.sum(DBMessage.token_estimate)
+        .over(order_by=(DBMessage.created_at.desc(), DBMessage.id.desc()))
+        .label("running_tokens")
+    )
+    newest = (
+        select(
+            DBMessage.id,
+            DBMessage.codec,
+            DBMessage.content,
+            DBMessage.payload,
+            DBMessage.created_at,
+            running_tokens,
+        )
+        .where(DBMessage.conversation_id == conversation_id)
+        .where(DBMessage.id > (after_id or 0))
+        .order_by(DBMessage.created_at.desc(), DBMessage.id.desc())
+        .limit(max_messages)
+        .subquery()
+    )
+    window = (
+        await session.exec(
+            select(newest.c.id, newest.c.codec, newest.c.content, newest.c.payload)
+            .where(newest.c.running_tokens <= token_budget)
+            .order_by(newest.c.created_at, newest.c.id)
+        )
+    ).all()
+    first = (
+        await session.exec(
+            select(DBMessage.id, DBMessage.codec, DBMessage.content, DBMessage.payload)
+            .where(DBMessage.conversation_id == conversation_id)
+            .order_by(DBMessage.created_at, DBMessage.id)
+            .limit(1)
+        )
+    ).first()
+    if first is None:
+        return []
+
+    decoded = await load_model_messages(session, window)
+    messages = trim_to_complete_turns([message for message in decoded if message is not None])
+    if not any(is_user_turn(message) for message in messages):
+        # Not even the newest turn fits, send it anyway rather than a history without it
+        turn_rows, turn = await _newest_turn(session, conversation_id, max_messages, after_id)
+        if turn_rows:
+            window = turn_rows
+            messages = stub_stale_tool_results(trim_to_complete_turns(turn), fresh_turns=0)
+
+    if window and window[0][0] == first[0]:
+        # The window starts at the first message, its system prompt is already there
+        return messages
+    (first_message,) = await load_model_messages(session, [first])
+    return with_system_prompt(first_message, messages)
+
+
+async def compact_conversation(session: AsyncSession, conversation: Conversation) -> None:
+    """Fold older turns into the conversation's summary once the history after it passes the threshold"""
+    threshold = conversation.compaction_token_threshold or COMPACTION_TOKEN_THRESHOLD
+    after_id = conversation.summary_through_id or 0
+    pending_tokens = (
+        await session.exec(
+            select(func.sum(DBMessage.token_estimate))
+            .where(DBMessage.conversation_id == conversation.id)
+            .where(DBMessage.id > after_id)
+        )
+    ).first()
+    if not pending_tokens or pending_tokens <= threshold:
+        return
+
+    rows = (
+        await session.exec(
+            select(
+                DBMessage.id,
+                DBMessage.codec,
+                DBMessage.content,
+                DBMessage.payload,
+                DBMessage.token_estimate,
+            )
+            .where(DBMessage.conversation_id == conversation.id)
+            .where(DBMessage.id > after_id)
+            .order_by(DBMessage.created_at, DBMessage.id)
+        )
+    ).all()
+    first_id = (
+        await session.exec(
+            select(DBMessage.id)
+            .where(DBMessage.conversation_id == conversation.id)
+            .order_by(DBMessage.created_at, DBMessage.id)
+            .limit(1)
+        )
+    ).first()
+
+    parsed = await load_model_messages(session, [tuple(row[:4]) for row in rows])
+    ids, messages, token_estimates = [], [], []
+    for (message_id, *_, token_estimate), model_message in zip(rows, parsed):
+        if model_message is not None and message_id == first_id:
+            # Its system prompt stays in the history, the opening question goes to the summary
+            parts = [part for part in model_message.parts if not isinstance(part, SystemPromptPart)]
+            model_message = dataclasses.replace(model_message, parts=parts) if parts else None
+        if model_message is not None:
+            ids.append(message_id)
+            messages.append(model_message)
+            token_estimates.append(token_estimate)
+
+    cut = compaction_cut(messages, token_estimates, COMPACTION_KEEP_TOKENS)
+    if cut == 0:
+        return
+    try:
+        summary = await summarize_conversation(
+            conversation.summary, render_transcript(messages[:cut])
+        )
+    except Exception:
+        logging.exception(f"Failed to compact conversation {conversation.id}")
+        return
+
+    conversation.summary = summary
+    conversation.summary_through_id = ids[cut - 1]
+    session.add(conversation)
+    await session.commit()
+    logging.info(
+        f"Compacted {cut} messages of conversation {conversation.id} into its summary"
+    )
+
+
+async def get_compacted_history(
+    session: AsyncSession, conversation: Conversation
+) -> List[ModelMessage]:
+    """History for the next turn: the rolling summary, the turns after it, and stale tool results stubbed"""
+    if not conversation.compaction_enabled:
+        return await get_message_history(session, conversation.id)
+
+    await compact_conversation(session, conversation)
+    message_history = await get_message_history(
+        session, conversation.id, after_id=conversation.summary_through_id
+    )
+    return add_summary(stub_stale_tool_results(message_history), conversation.summary)
@@ -1,6 +1,9 @@
+import asyncio
 import os
+import threading
+import time
+from typing import Any, Callable, Optional, Tuple
 from dotenv import load_dotenv
-from mem0 import Memory
 import requests
 from requests.exceptions import RequestException
 import logging
@@ -11,12 +14,19 @@ load_dotenv()
 # logging.basicConfig(level=logging.DEBUG)
 logger = logging.getLogger(__name__)
 
+# How often the background probe checks Qdrant, and reconnects when it is back
+MEMORY_PROBE_INTERVAL_SECONDS = float(os.getenv("MEMORY_PROBE_INTERVAL_SECONDS", "30"))
+# Consecutive failed memory calls that mark the service unavailable
+MEMORY_FAILURE_THRESHOLD = int(os.getenv("MEMORY_FAILURE_THRESHOLD", "3"))
+# How long it stays unavailable before one call is let through to try again
+MEMORY_COOLDOWN_SECONDS = float(os.getenv("MEMORY_COOLDOWN_SECONDS", "60"))
+MEMORY_HEALTH_TIMEOUT_SECONDS = float(os.getenv("MEMORY_HEALTH_TIMEOUT_SECONDS", "5"))
 
 
 def verify_qdrant_connection(url: str, api_key: str) -> bool:
     try:
         headers = {"api-key": api_key}
-        response = requests.get(f"{url}/healthz", headers=headers, timeout=5)
+        response = requests.get(f"{url}/healthz", headers=headers, timeout=MEMORY_HEALTH_TIMEOUT_SECONDS)
         logger.debug(f"Qdrant health check response: {response.status_code}")
         return response.status_code == 200
     except RequestException as e:
@@ -57,22 +67,162 @@ config = {
     "history_db_path": "db/history.db",
     "version": "v1.1",
 }
-# m = Memory.from_config(config)
 
 
-try:
-    qdrant_url = f"https://{config['vector_store']['config']['host']}"
-    qdrant_api_key = config["vector_store"]["config"]["api_key"]
-    
-    logger.debug(f"Attempting to connect to Qdrant at {qdrant_url}")
-    if not verify_qdrant_connection(qdrant_url, qdrant_api_key):
-        raise ConnectionError("Could not connect to Qdrant server")
-    
-    logger.debug("Initializing Memory client...")
-    m = Memory.from_config(config)
-    logger.debug("Memory client initialized successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize Memory: {str(e)}", exc_info=True)
-    m = None
+class MemoryClient:
+    """
+    The mem0 client, connected in the background so nothing waits on Qdrant or Neo4j.
 
+    `get` never blocks: it returns the client, or None while it is connecting or the
+    service is unavailable, and starts a connection attempt when there is none. A circuit
+    breaker opens after MEMORY_FAILURE_THRESHOLD consecutive failed calls (or a failed
+    health check), during which `get` returns None right away. After MEMORY_COOLDOWN_SECONDS
+    one call is let through, its success closes the breaker again. `run_memory_probe`
+    checks Qdrant periodically and reconnects once it is healthy.
+    """
 
+    def __init__(self, memory_config: dict) -> None:
+        self._config = memory_config
+        self._memory: Optional[Any] = None
+        self._lock = threading.Lock()
+        self._connecting = False
+        self._failures = 0
+        # While the breaker is open, the monotonic time the next trial call is allowed at
+        self._open_until: Optional[float] = None
+        self._trial_running = False
+        self.last_error: Optional[str] = None
+
+    def status(self) -> str:
+        """Why the client is unavailable, for tool results and logs."""
+        if self._connecting:
+            return "Memory service is connecting."
+        if self._memory is None:
+            return f"Memory service is not connected: {self.last_error or 'not started'}."
+        return f"Memory service is temporarily unavailable: {self.last_error}."
+
+    def get(self) -> Optional[Any]:
+        """The mem0 Memory client, or None without blocking when it cannot be used now."""
+        with self._lock:
+            if self._memory is None:
+                start = self._claim_connect()
+            elif self._open_until is None:
+                return self._memory
+            elif time.monotonic() >= self._open_until and not self._trial_running:
+                # Half open: this call decides whether the breaker closes
+                self._trial_running = True
+                return self._memory
+            else:
+                return None
+        if start:
+            threading.Thread(target=self.connect, name="mem0-connect", daemon=True).start()
+        return None
+
+    def call(self, fn: Callable[[Any], Any]) -> Tuple[Optional[str], Any]:
+        """
+        Runs fn with the client and records the outcome for the breaker, never waiting on a connection.
+
+        Returns (None, fn's result) on success. When the client is unavailable it returns
+        "Memory service unavailable." with `status`, and when fn raises "Memory service call
+        failed." with the error.
+        """
+        memory = self.get()
+        if memory is None:
+            return "Memory service unavailable.", self.status()
+        try:
+            result = fn(memory)
+        except Exception as e:
+            self.record_failure(e)
+            logger.error(f"Memory service call failed: {str(e)}", exc_info=True)
+            return "Memory service call failed.", str(e)
+        self.record_success()
+        return None, result
+
+    def record_success(self) -> None:
+        with self._lock:
+            if self._open_until is not None:
+                logger.info("Memory service recovered")
+            self._failures = 0
+            self._open_until = None
+            self._trial_running = False
+
+    def record_failure(self, error: Any) -> None:
+        with self._lock:
+            self.last_error = str(error)
+            self._failures += 1
+            self._trial_running = False
+            if self._open_until is not None or self._failures >= MEMORY_FAILURE_THRESHOLD:
+                if self._open_until is None:
+                    logger.warning(
+                        f"Memory service marked unavailable for {MEMORY_COOLDOWN_SECONDS:g}s "
+                        f"after {self._failures} failures: {error}"
+                    )
+                self._open_until = time.monotonic() + MEMORY_COOLDOWN_SECONDS
+
+    def _healthy(self) -> bool:
+        qdrant_url = f"https://{self._config['vector_store']['config']['host']}"
+        qdrant_api_key = self._config["vector_store"]["config"]["api_key"]
+        return verify_qdrant_connection(qdrant_url, qdrant_api_key)
+
+    def _claim_connect(self) -> bool:
+        """Whether the caller should connect now, called with the lock held."""
+        if self._connecting or self._memory is not None:
+            return False
+        if self._open_until is not None and time.monotonic() < self._open_until:
+            return False
+        self._connecting = True
+        return True
+
+    def connect(self) -> bool:
+        """Checks Qdrant and builds the client, blocking. Callers claim it with `_claim_connect`."""
+        try:
+            if not self._healthy():
+                raise ConnectionError("Could not connect to Qdrant server")
+            # mem0 pulls in litellm and the Neo4j driver, only pay for it once connecting
+            from mem0 import Memory
+
+            logger.debug("Initializing Memory client...")
+            memory = Memory.from_config(self._config)
+        except Exception as e:
+            logger.error(f"Failed to initialize Memory: {str(e)}", exc_info=True)
+            with self._lock:
+                self._connecting = False
+                self.last_error = str(e)
+                self._open_until = time.monotonic() + MEMORY_COOLDOWN_SECONDS
+            return False
+        with self._lock:
+            self._connecting = False
+            self._memory = memory
+            self._failures = 0
+            self._open_until = None
+            self._trial_running = False
+        logger.info("Memory client initialized")
+        return True
+
+    def probe(self) -> None:
+        """One health check: reconnects when needed, opens or closes the breaker."""
+        if self._memory is None:
+            with self._lock:
+                claimed = self._claim_connect()
+            if claimed:
+                self.connect()
+            return
+        if self._healthy():
+            if self._open_until is not None:
+                self.record_success()
+        else:
+            with self._lock:
+                self.last_error = "Qdrant health check failed"
+                self._open_until = time.monotonic() + MEMORY_COOLDOWN_SECONDS
+
+
+memory_client = MemoryClient(config)
+
+
+async def run_memory_probe() -> None:
+    """Connects the memory client and keeps checking it until cancelled, meant to run as a lifespan task."""
+    while True:
+        try:
+            await asyncio.to_thread(memory_client.probe)
+        except Exception as e:
+            logger.exception(f"Unexpected error while probing the memory service: {e}")
+        await asyncio.sleep(MEMORY_PROBE_INTERVAL_SECONDS)
@@ -0,0 +1,354 @@
+import asyncio
+import dataclasses
+import json
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import pydantic
+from sqlalchemy import bindparam, update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ai.blobs import as_text_ref, blob_hash, blob_ref, load_blobs, resolve_blob, zstandard
+from ai.models import Blob, Message, async_engine
+from custom.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    ReasoningPart,
+    RetryPromptPart,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+# Message.codec values. CODEC_JSON rows hold model_message_to_dict JSON in content,
+# CODEC_V1 rows hold an encode_message payload.
+CODEC_JSON = 0
+CODEC_V1 = 1
+
+# Payload header: a version byte, then a flags byte
+_PAYLOAD_V1 = 1
+_FLAG_ZSTD = 1
+_COMPRESS_MIN_BYTES = 1024
+
+_message_ta: pydantic.TypeAdapter[ModelMessage] = pydantic.TypeAdapter(
+    ModelMessage, config=pydantic.ConfigDict(ser_json_bytes="base64")
+)
+
+
+def _for_storage(message: ModelMessage, blobs: Dict[str, Blob]) -> ModelMessage:
+    """Copy of message with bulk values swapped for blob references and part kinds repaired."""
+    parts = []
+    for part in message.parts:
+        changes: Dict[str, Any] = {}
+        # Messages rebuilt from old JSON rows may carry a wrong part_kind, the discriminator needs the real one
+        part_kind = type(part).__dataclass_fields__["part_kind"].default
+        if part.part_kind != part_kind:
+            changes["part_kind"] = part_kind
+        if isinstance(part, SystemPromptPart):
+            changes["content"] = as_text_ref(blob_ref(part.content, blobs, as_text=True))
+        elif isinstance(part, ToolReturnPart):
+            changes["content"] = blob_ref(part.content, blobs)
+        parts.append(dataclasses.replace(part, **changes) if changes else part)
+    return dataclasses.replace(message, parts=parts)
+
+
+def encode_message(message: ModelMessage, blobs: Dict[str, Blob]) -> Tuple[bytes, int]:
+    """
+    Encodes a model message with pydantic-core's compiled serializer.
+
+    Args:
+        message: The ModelRequest or ModelResponse to store
+        blobs: Collects Blob rows for the large values the payload references
+
+    Returns:
+        tuple: (payload, size) where payload is a CODEC_V1 payload, zstd-compressed when
+               large and zstandard is installed, and size its uncompressed length
+    """
+    body = _message_ta.dump_json(_for_storage(message, blobs))
+    if zstandard is not None and len(body) >= _COMPRESS_MIN_BYTES:
+        return bytes((_PAYLOAD_V1, _FLAG_ZSTD)) + zstandard.ZstdCompressor().compress(body), len(body)
+    return bytes((_PAYLOAD_V1, 0)) + body, len(body)
+
+
+def decode_message(payload: bytes) -> ModelMessage:
+    """Decodes a CODEC_V1 payload, blob references are left for `resolve_message_blobs`."""
+    version, flags = payload[0], payload[1]
+    if version != _PAYLOAD_V1:
+        raise ValueError(f"Unknown message payload version {version}")
+    body = payload[2:]
+    if flags & _FLAG_ZSTD:
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read compressed messages")
+        body = zstandard.ZstdDecompressor().decompress(body)
+    return _message_ta.validate_json(body)
+
+
+def message_blob_hashes(messages: List[ModelMessage], include_system_prompt: bool) -> List[str]:
+    """Hashes of the blobs referenced by tool results, and system prompts when asked."""
+    hashes = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, ToolReturnPart) or (
+                include_system_prompt and isinstance(part, SystemPromptPart)
+            ):
+                digest = blob_hash(part.content)
+                if digest:
+                    hashes.append(digest)
+    return hashes
+
+
+def resolve_message_blobs(messages: List[ModelMessage], blobs: Dict[str, Any]) -> None:
+    """Replaces blob references in the messages' parts with the loaded values, in place."""
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, ToolReturnPart):
+                part.content = resolve_blob(part.content, blobs)
+            elif isinstance(part, SystemPromptPart):
+                # Not loaded unless asked for, the chat endpoint rebuilds the prompt
+                part.content = resolve_blob(part.content, blobs, unloaded="")
+
+
+StoredRow = Tuple[int, int, str, Optional[bytes]]
+
+
+def decode_row(row: StoredRow) -> Optional[ModelMessage]:
+    """Decodes an (id, codec, content, payload) row of either codec, None when unreadable."""
+    message_id, codec, content, payload = row
+    try:
+        if codec == CODEC_V1 and payload is not None:
+            return decode_message(payload)
+        return dict_to_model_message(json.loads(content))
+    except (json.JSONDecodeError, KeyError, ValueError, RuntimeError) as e:
+        logging.error(f"Error processing message {message_id}: {str(e)}")
+        return None
+
+
+async def load_model_messages(
+    session: AsyncSession, rows: List[StoredRow], include_system_prompt: bool = False
+) -> List[Optional[ModelMessage]]:
+    """
+    Decodes stored rows, loading the blobs they reference in one query.
+
+    Returns one entry per row, None where a row could not be decoded. System prompt
+    blobs are only loaded on request since the chat endpoint rebuilds the prompt.
+    """
+    messages = [decode_row(row) for row in rows]
+    decoded = [message for message in messages if message is not None]
+    hashes = message_blob_hashes(decoded, include_system_prompt)
+    resolve_message_blobs(decoded, await load_blobs(session, hashes) if hashes else {})
+    return messages
+
+
+# Rows converted per transaction by the background migration
+MIGRATION_BATCH_SIZE = 200
+
+
+async def migrate_json_messages() -> None:
+    """
+    Background task rewriting CODEC_JSON rows as CODEC_V1 payloads, moving their bulk into blobs.
+
+    Runs in small batches so it never holds the write lock for long. Rows that are not
+    model messages (e.g. plain text posted to /messages/) are left as they are.
+    """
+    after_id = 0
+    converted = 0
+    while True:
+        try:
+            after_id, batch = await _migrate_batch(after_id)
+        except Exception:
+            logging.exception(f"Message codec migration stopped after id {after_id}")
+            return
+        if batch is None:
+            break
+        converted += batch
+        # Let request handlers in between batches
+        await asyncio.sleep(0.05)
+    if converted:
+        logging.info(f"Converted {converted} stored messages to the binary codec")
+
+
+async def _migrate_batch(after_id: int) -> Tuple[int, Optional[int]]:
+    """Converts the rows after after_id, returning the new cursor and how many converted (None when done)."""
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        rows = (
+            await session.exec(
+                select(Message.id, Message.content)
+                .where(Message.codec == CODEC_JSON)
+                .where(Message.id > after_id)
+                .order_by(Message.id)
+                .limit(MIGRATION_BATCH_SIZE)
+            )
+        ).all()
+        if not rows:
+            return after_id, None
+
+        blobs: Dict[str, Blob] = {}
+        updates = []
+        for message_id, content in rows:
+            try:
+                payload, _ = encode_message(dict_to_model_message(json.loads(content)), blobs)
+            except (json.JSONDecodeError, KeyError, TypeError, AttributeError, ValueError):
+                continue
+            updates.append({"message_id": message_id, "new_payload": payload})
+
+        if blobs:
+            await session.exec(
+                insert(Blob)
+                .values(
+                    [
+                        {
+                            "hash": blob.hash,
+                            "encoding": blob.encoding,
+                            "data": blob.data,
+                            "size": blob.size,
+                            "created_at": blob.created_at,
+                        }
+                        for blob in blobs.values()
+                    ]
+                )
+                .on_conflict_do_nothing(index_elements=["hash"])
+            )
+        if updates:
+            # codec is checked again in case a request rewrote the row meanwhile
+            table = Message.__table__
+            await session.execute(
+                update(table)
+                .where(table.c.id == bindparam("message_id"))
+                .where(table.c.codec == CODEC_JSON)
+                .values(codec=CODEC_V1, payload=bindparam("new_payload"), content=""),
+                updates,
+            )
+        await session.commit()
+        return rows[-1][0], len(updates)
+
+
+# Legacy JSON codec, still used to read CODEC_JSON rows and to render messages for the client
+
+
+def model_message_to_dict(message: Union[ModelRequest, ModelResponse]) -> dict:
+    """Convert a ModelRequest or ModelResponse to a dictionary for storage"""
+
+    def part_to_dict(part):
+        if isinstance(part, ToolCallPart):
+            content = {
+                "name": part.tool_name,
+                "args": part.args,
+                "tool_call_id": part.tool_call_id,
+            }
+        elif isinstance(part, ReasoningPart):
+            content = part.reasoning
+        elif isinstance(part, UserPromptPart):
+            content = part.content
+        elif isinstance(part, TextPart):
+            content = part.content
+        elif isinstance(part, SystemPromptPart):
+            content = part.content
+        elif isinstance(part, RetryPromptPart):
+            content = part.content
+        elif isinstance(part, ToolReturnPart):
+            # print("I am here", part)
+            content = {
+                "name": part.tool_name,
+                "content": part.content,
+                "tool_call_id": part.tool_call_id,
+            }
+        return {
+            "type": part.__class__.__name__,
+            "content": content,
+            "part_kind": part.part_kind if hasattr(part, "part_kind") else "text",
+        }
+
+    if isinstance(message, ModelRequest):
+        return {
+            "type": "model_request",
+            "parts": [part_to_dict(part) for part in message.parts],
+            "kind": message.kind,
+        }
+    else:  # ModelResponse
+        return {
+            "type": "model_response",
+            "parts": [part_to_dict(part) for part in message.parts],
+            "model_name": message.model_name,
+            "timestamp": message.timestamp.isoformat() if message.timestamp else None,
+            "kind": message.kind,
+        }
+
+
+def dict_to_model_message(data: dict) -> Union[ModelRequest, ModelResponse]:
+    """Convert a dictionary back to a ModelRequest or ModelResponse
+
+    Blob references are left in place, see `resolve_message_blobs`.
+    """
+    parts = []
+    for part_data in data["parts"]:
+        if part_data["type"] == "ToolCallPart":
+            # print(part_data)
+            parts.append(
+                ToolCallPart(
+                    tool_name=part_data["content"].get("name"),
+                    args=part_data["content"].get("args"),
+                    tool_call_id=part_data["content"].get("tool_call_id"),
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+        elif part_data["type"] == "ReasoningPart":
+            parts.append(
+                ReasoningPart(
+                    reasoning=part_data["content"],
+                    part_kind=part_data.get("part_kind", "reasoning"),
+                )
+            )
+        elif part_data["type"] == "UserPromptPart":
+            parts.append(
+                UserPromptPart(
+                    content=part_data["content"],
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+        elif part_data["type"] == "TextPart":
+            parts.append(
+                TextPart(
+                    content=part_data["content"],
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+        elif part_data["type"] == "SystemPromptPart":
+            parts.append(
+                SystemPromptPart(
+                    content=part_data["content"],
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+        elif part_data["type"] == "RetryPromptPart":
+            parts.append(
+                RetryPromptPart(
+                    content=part_data["content"],
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+        elif part_data["type"] == "ToolReturnPart":
+            parts.append(
+                ToolReturnPart(
+                    tool_name=part_data["content"].get("name"),
+                    content=part_data["content"].get("content"),
+                    tool_call_id=part_data["content"].get("tool_call_id"),
+                    part_kind=part_data.get("part_kind", "text"),
+                )
+            )
+    if data["type"] == "model_request":
+        return ModelRequest(parts=parts, kind="request")
+    else:  # model_response
+        return ModelResponse(
+            parts=parts,
+            model_name=data.get("model_name"),
+            timestamp=datetime.fromisoformat(data["timestamp"])
+            if data.get("timestamp")
+            else datetime.now(),
+            kind="response",
+        )
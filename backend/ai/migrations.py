@@ -0,0 +1,137 @@
+import logging
+from datetime import datetime
+from typing import Any, Callable, List, Tuple
+
+from sqlalchemy.engine import Connection
+
+from ai.models import async_engine
+
+# SQLite's own DATETIME text layout, what SQLAlchemy writes and expects back
+_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+
+def _add_history_indexes(connection: Connection) -> None:
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_message_conversation_created "
+        "ON message (conversation_id, created_at)"
+    )
+    connection.exec_driver_sql(
+        "CREATE INDEX IF NOT EXISTS ix_conversation_user_updated "
+        "ON conversation (user_id, updated_at)"
+    )
+
+
+def _normalize_timestamp(value: Any) -> str:
+    """Parses whatever an old row holds (text or epoch) into SQLite DATETIME text."""
+    parsed = None
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, (int, float)):
+        # Epoch milliseconds or seconds
+        parsed = datetime.fromtimestamp(value / 1000 if value > 1e11 else value)
+    elif value:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+        except ValueError:
+            logging.warning(f"Unreadable timestamp {value!r}, replacing it with the current time")
+    if parsed is None:
+        parsed = datetime.now()
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed.strftime(_DATETIME_FORMAT)
+
+
+def _user_timestamps_as_datetime(connection: Connection) -> None:
+    tables = {row[0] for row in connection.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    if "user" not in tables and "user_new" in tables:
+        # A previous run stopped between the drop and the rename
+        connection.exec_driver_sql('ALTER TABLE user_new RENAME TO "user"')
+        return
+    connection.exec_driver_sql("DROP TABLE IF EXISTS user_new")
+
+    column_types = {row[1]: row[2].upper() for row in connection.exec_driver_sql('PRAGMA table_info("user")')}
+    rows = connection.exec_driver_sql(
+        'SELECT id, email, name, created_at, updated_at FROM "user"'
+    ).fetchall()
+    if column_types.get("created_at") == "DATETIME" and column_types.get("updated_at") == "DATETIME":
+        # Right type already, only rewrite values that were not stored in DATETIME layout
+        for user_id, _, _, created_at, updated_at in rows:
+            connection.exec_driver_sql(
+                'UPDATE "user" SET created_at = ?, updated_at = ? WHERE id = ?',
+                (_normalize_timestamp(created_at), _normalize_timestamp(updated_at), user_id),
+            )
+        return
+
+    # SQLite cannot change a column's type in place, rebuild the table instead
+    connection.exec_driver_sql(
+        "CREATE TABLE user_new ("
+        "id VARCHAR NOT NULL, "
+        "email VARCHAR NOT NULL, "
+        "name VARCHAR, "
+        "created_at DATETIME NOT NULL, "
+        "updated_at DATETIME NOT NULL, "
+        "PRIMARY KEY (id), "
+        "UNIQUE (email))"
+    )
+    for user_id, email, name, created_at, updated_at in rows:
+        connection.exec_driver_sql(
+            "INSERT INTO user_new (id, email, name, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+            (user_id, email, name, _normalize_timestamp(created_at), _normalize_timestamp(updated_at)),
+        )
+    connection.exec_driver_sql('DROP TABLE "user"')
+    connection.exec_driver_sql('ALTER TABLE user_new RENAME TO "user"')
+
+
+def _add_column(connection: Connection, table: str, column: str, definition: str) -> None:
+    columns = {row[1] for row in connection.exec_driver_sql(f"PRAGMA table_info({table})")}
+    if column not in columns:
+        connection.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _message_token_estimates(connection: Connection) -> None:
+    _add_column(connection, "message", "token_estimate", "INTEGER NOT NULL DEFAULT 0")
+    # Same formula as ai.models.estimate_tokens
+    connection.exec_driver_sql(
+        "UPDATE message SET token_estimate = length(content) / 4 + 1 WHERE token_estimate = 0"
+    )
+
+
+def _conversation_compaction(connection: Connection) -> None:
+    _add_column(connection, "conversation", "compaction_enabled", "BOOLEAN NOT NULL DEFAULT 1")
+    _add_column(connection, "conversation", "compaction_token_threshold", "INTEGER")
+    _add_column(connection, "conversation", "summary", "VARCHAR NOT NULL DEFAULT ''")
+    _add_column(connection, "conversation", "summary_through_id", "INTEGER")
+
+
+def _message_codec(connection: Connection) -> None:
+    # Existing rows stay JSON, ai.message_codec.migrate_json_messages converts them in the background
+    _add_column(connection, "message", "codec", "INTEGER NOT NULL DEFAULT 0")
+    _add_column(connection, "message", "payload", "BLOB")
+
+
+# (version, description, migration), applied in order. Each must be safe to run again,
+# a crash can leave one half applied before user_version is bumped.
+MIGRATIONS: List[Tuple[int, str, Callable[[Connection], None]]] = [
+    (1, "indexes for history loads and conversation lists", _add_history_indexes),
+    (2, "user timestamps stored as DATETIME", _user_timestamps_as_datetime),
+    (3, "per-message token estimates", _message_token_estimates),
+    (4, "conversation compaction settings and summary", _conversation_compaction),
+    (5, "binary message payloads", _message_codec),
+]
+
+
+def _migrate(connection: Connection) -> None:
+    current = connection.exec_driver_sql("PRAGMA user_version").scalar() or 0
+    for version, description, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logging.info(f"Applying chat database migration {version}: {description}")
+        migration(connection)
+        connection.exec_driver_sql(f"PRAGMA user_version = {version}")
+        current = version
+
+
+async def run_migrations() -> None:
+    """Brings an existing chat database up to the current schema, run after create_all at startup."""
+    async with async_engine.begin() as connection:
+        await connection.run_sync(_migrate)
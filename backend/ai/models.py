@@ -1,29 +1,55 @@
 from typing import List, Optional
 from datetime import datetime
 from sqlmodel import Field, Relationship, Session, SQLModel, create_engine
-from sqlalchemy import String, Column
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import Column, Index, LargeBinary, event
+from sqlalchemy.ext.asyncio import create_async_engine
 
 # Define the database URL
 DATABASE_URL = "sqlite:///./db/chat_history.sqlite"
+# Same file through aiosqlite, used by the request handlers so queries never block the loop
+ASYNC_DATABASE_URL = "sqlite+aiosqlite:///./db/chat_history.sqlite"
+
+# Applied to every new connection. WAL lets the stream's writes run alongside reads,
+# synchronous=NORMAL is durable in WAL mode short of power loss.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": "-65536",  # 64 MiB
+    "temp_store": "MEMORY",
+    "mmap_size": "268435456",
+    "busy_timeout": "5000",
+}
 
 # Create models matching your frontend Prisma schema
 class User(SQLModel, table=True):
     id: str = Field(primary_key=True)
     email: str = Field(unique=True)
     name: Optional[str] = None
-    created_at: datetime = Field(default_factory=datetime.now, sa_column=Column(String))
-    updated_at: datetime = Field(default_factory=datetime.now, sa_column=Column(String))
+    created_at: datetime = Field(default_factory=datetime.now)
+    updated_at: datetime = Field(default_factory=datetime.now)
     
     # Relationships
     conversations: List["Conversation"] = Relationship(back_populates="user")
 
 
 class Conversation(SQLModel, table=True):
+    __table_args__ = (
+        # Serves a user's conversation list, newest activity first
+        Index("ix_conversation_user_updated", "user_id", "updated_at"),
+    )
+
     id: str = Field(primary_key=True)
     title: str
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     
+    # Compaction settings and state, older turns are folded into summary (see ai/compaction.py)
+    compaction_enabled: bool = Field(default=True)
+    compaction_token_threshold: Optional[int] = None
+    summary: str = Field(default="")
+    summary_through_id: Optional[int] = None
+
     # Foreign keys
     user_id: str = Field(foreign_key="user.id")
     
@@ -33,10 +59,20 @@ class Conversation(SQLModel, table=True):
 
 
 class Message(SQLModel, table=True):
+    __table_args__ = (
+        # Serves history loads, which read one conversation in creation order
+        Index("ix_message_conversation_created", "conversation_id", "created_at"),
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     reasoning: str = Field(default="")
     content: str = Field(default="")
+    # 0: content holds JSON or plain text, 1: payload holds an ai.message_codec payload
+    codec: int = Field(default=0)
+    payload: Optional[bytes] = Field(default=None, sa_column=Column(LargeBinary))
     is_user_message: bool = Field(default=True)
+    # Rough size in model tokens, lets history loads stop at a budget without parsing content
+    token_estimate: int = Field(default=0)
     created_at: datetime = Field(default_factory=datetime.now)
     updated_at: datetime = Field(default_factory=datetime.now)
     
@@ -47,16 +83,48 @@ class Message(SQLModel, table=True):
     conversation: Conversation = Relationship(back_populates="messages")
 
 
+class Blob(SQLModel, table=True):
+    """Large message content (system prompts, tool results) stored once by sha256 of its JSON"""
+
+    hash: str = Field(primary_key=True)
+    encoding: str = Field(default="raw")  # raw or zstd
+    data: bytes = Field(sa_column=Column(LargeBinary, nullable=False))
+    size: int = Field(default=0)  # Uncompressed bytes
+    created_at: datetime = Field(default_factory=datetime.now)
+
+
+def estimate_tokens(content: str) -> int:
+    """Cheap token count for stored message content, about four characters per token."""
+    return len(content) // 4 + 1
+
+
 # Setup database connection
 engine = create_engine(DATABASE_URL, echo=False)
+async_engine = create_async_engine(ASYNC_DATABASE_URL, echo=False)
+
+
+@event.listens_for(engine, "connect")
+@event.listens_for(async_engine.sync_engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
 
 
 # Function to create all tables in the database
-def create_db_and_tables():
-    SQLModel.metadata.create_all(engine)
+async def create_db_and_tables():
+    async with async_engine.begin() as connection:
+        await connection.run_sync(SQLModel.metadata.create_all)
 
 
 # Database session management
 def get_session():
     with Session(engine) as session:
-        yield session
\ No newline at end of file
+        yield session
+
+
+async def get_async_session():
+    # Objects stay readable after commit, relationships must be queried explicitly
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
@@ -133,6 +133,10 @@ class Agent(Generic[AgentDepsT, ResultDataT]):
     _max_result_retries: int = dataclasses.field(repr=False)
     _override_deps: _utils.Option[AgentDepsT] = dataclasses.field(default=None, repr=False)
     _override_model: _utils.Option[models.Model] = dataclasses.field(default=None, repr=False)
+    _graphs: dict[
+        tuple[str | None, Any],
+        Graph[_agent_graph.GraphAgentState, _agent_graph.GraphAgentDeps[AgentDepsT, Any], FinalResult[Any]],
+    ] = dataclasses.field(repr=False)
 
     def __init__(
         self,
@@ -212,6 +216,7 @@ class Agent(Generic[AgentDepsT, ResultDataT]):
         self._system_prompt_dynamic_functions: dict[str, _system_prompt.SystemPromptRunner[AgentDepsT]] = {}
 
         self._function_tools: dict[str, Tool[AgentDepsT]] = {}
+        self._graphs = {}
 
         self._default_retries = retries
         self._max_result_retries = result_retries if result_retries is not None else retries
@@ -1199,7 +1204,16 @@ class Agent(Generic[AgentDepsT, ResultDataT]):
     def _build_graph(
         self, result_type: type[RunResultDataT] | None
     ) -> Graph[_agent_graph.GraphAgentState, _agent_graph.GraphAgentDeps[AgentDepsT, Any], FinalResult[Any]]:
-        return _agent_graph.build_agent_graph(self.name, self._deps_type, result_type or self.result_type)
+        """Build the agent graph, reusing a previously built graph for the same name and result type.
+
+        Graphs hold no per-run state, so a long-lived agent only needs to build one per result type.
+        """
+        result_type = result_type or self.result_type
+        key = (self.name, result_type)
+        graph = self._graphs.get(key)
+        if graph is None:
+            graph = self._graphs[key] = _agent_graph.build_agent_graph(self.name, self._deps_type, result_type)
+        return graph
 
     def _prepare_result_schema(
         self, result_type: type[RunResultDataT] | None
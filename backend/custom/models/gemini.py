@@ -292,25 +292,21 @@ class GeminiModel(Model):
     async def _process_streamed_response(self, http_response: HTTPResponse) -> StreamedResponse:
         """Process a streamed response, and prepare a streaming response to return."""
         aiter_bytes = http_response.aiter_bytes()
-        start_response: _GeminiResponse | None = None
-        content = bytearray()
+        parser = _GeminiStreamParser()
+        responses: list[_GeminiResponse] = []
 
         async for chunk in aiter_bytes:
-            content.extend(chunk)
-            responses = _gemini_streamed_response_ta.validate_json(
-                _ensure_decodeable(content),
-                experimental_allow_partial='trailing-strings',
-            )
+            responses.extend(parser.feed(chunk))
             if responses:
                 last = responses[-1]
                 if last['candidates'] and last['candidates'][0].get('content', {}).get('parts'):
-                    start_response = last
                     break
-
-        if start_response is None:
+        else:
             raise UnexpectedModelBehavior('Streamed response ended without content or tool calls')
 
-        return GeminiStreamedResponse(_model_name=self._model_name, _content=content, _stream=aiter_bytes)
+        return GeminiStreamedResponse(
+            _model_name=self._model_name, _parser=parser, _responses=responses, _stream=aiter_bytes
+        )
 
     @classmethod
     async def _message_to_gemini_content(
@@ -397,7 +393,8 @@ class GeminiStreamedResponse(StreamedResponse):
     """Implementation of `StreamedResponse` for the Gemini model."""
 
     _model_name: GeminiModelName
-    _content: bytearray
+    _parser: _GeminiStreamParser
+    _responses: list[_GeminiResponse]
     _stream: AsyncIterator[bytes]
     _timestamp: datetime = field(default_factory=_utils.now_utc, init=False)
 
@@ -430,36 +427,18 @@ class GeminiStreamedResponse(StreamedResponse):
                     assert 'function_response' in gemini_part, f'Unexpected part: {gemini_part}'
 
     async def _get_gemini_responses(self) -> AsyncIterator[_GeminiResponse]:
-        # This method exists to ensure we only yield completed items, so we don't need to worry about
-        # partial gemini responses, which would make everything more complicated
+        # The parser only hands back array elements once their closing brace has arrived, so every response
+        # yielded here is complete, and each byte of the stream is scanned and validated exactly once.
+        for r in self._responses:
+            self._usage += _metadata_as_usage(r)
+            yield r
+        self._responses = []
 
-        gemini_responses: list[_GeminiResponse] = []
-        current_gemini_response_index = 0
-        # Right now, there are some circumstances where we will have information that could be yielded sooner than it is
-        # But changing that would make things a lot more complicated.
         async for chunk in self._stream:
-            self._content.extend(chunk)
-
-            gemini_responses = _gemini_streamed_response_ta.validate_json(
-                _ensure_decodeable(self._content),
-                experimental_allow_partial='trailing-strings',
-            )
-
-            # The idea: yield only up to the latest response, which might still be partial.
-            # Note that if the latest response is complete, we could yield it immediately, but there's not a good
-            # allow_partial API to determine if the last item in the list is complete.
-            responses_to_yield = gemini_responses[:-1]
-            for r in responses_to_yield[current_gemini_response_index:]:
-                current_gemini_response_index += 1
+            for r in self._parser.feed(chunk):
                 self._usage += _metadata_as_usage(r)
                 yield r
 
-        # Now yield the final response, which should be complete
-        if gemini_responses:
-            r = gemini_responses[-1]
-            self._usage += _metadata_as_usage(r)
-            yield r
-
     @property
     def model_name(self) -> GeminiModelName:
         """Get the model name of the response."""
@@ -795,8 +774,8 @@ class _GeminiPromptFeedback(TypedDict):
 _gemini_request_ta = pydantic.TypeAdapter(_GeminiRequest)
 _gemini_response_ta = pydantic.TypeAdapter(_GeminiResponse)
 
-# steam requests return a list of https://ai.google.dev/api/generate-content#method:-models.streamgeneratecontent
-_gemini_streamed_response_ta = pydantic.TypeAdapter(list[_GeminiResponse], config=pydantic.ConfigDict(defer_build=True))
+# steam requests return a list of https://ai.google.dev/api/generate-content#method:-models.streamgeneratecontent,
+# the elements are split out of the stream by `_GeminiStreamParser` and validated one by one with `_gemini_response_ta`
 
 
 class _GeminiJsonSchema:
@@ -875,17 +854,63 @@ class _GeminiJsonSchema:
             self._simplify(items_schema, refs_stack)
 
 
-def _ensure_decodeable(content: bytearray) -> bytearray:
-    """Trim any invalid unicode point bytes off the end of a bytearray.
+_STREAM_TOKEN_RE = re.compile(rb'["\\{}\[\]]')
+
 
-    This is necessary before attempting to parse streaming JSON bytes.
+class _GeminiStreamParser:
+    """Incrementally split the JSON array returned by `streamGenerateContent` into its elements.
 
-    This is a temporary workaround until https://github.com/pydantic/pydantic-core/issues/1633 is resolved
+    Only bytes that haven't been seen before are scanned, and each element is validated on its own as soon as its
+    closing brace arrives, so the cost of parsing grows linearly with the length of the response.
+
+    Scanning works on raw bytes: every JSON structural character is ASCII, and bytes of multibyte UTF-8 sequences
+    are all >= 0x80, so chunks split in the middle of a code point need no special handling.
     """
-    while True:
-        try:
-            content.decode()
-        except UnicodeDecodeError:
-            content = content[:-1]  # this will definitely succeed before we run out of bytes
-        else:
-            return content
+
+    def __init__(self) -> None:
+        self._buffer = bytearray()
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._element_start: int | None = None
+
+    def feed(self, chunk: bytes) -> list[_GeminiResponse]:
+        """Add a chunk of the stream and return the array elements it completed."""
+        buffer = self._buffer
+        buffer.extend(chunk)
+        completed: list[_GeminiResponse] = []
+        consumed = 0
+
+        while match := _STREAM_TOKEN_RE.search(buffer, self._pos):
+            token = match.group()
+            self._pos = match.end()
+            if self._in_string:
+                if token == b'\\':
+                    # skip the escaped byte, possibly past the end of the buffer if it hasn't arrived yet
+                    self._pos += 1
+                elif token == b'"':
+                    self._in_string = False
+            elif token == b'"':
+                self._in_string = True
+            elif token in b'{[':
+                # depth 1 is inside the top level array, elements start at depth 2
+                if self._depth == 1 and token == b'{':
+                    self._element_start = match.start()
+                self._depth += 1
+            else:
+                self._depth -= 1
+                if self._depth == 1 and self._element_start is not None:
+                    element = bytes(buffer[self._element_start : self._pos])
+                    completed.append(_gemini_response_ta.validate_json(element))
+                    consumed = self._pos
+                    self._element_start = None
+
+        if self._element_start is None:
+            # nothing between here and the end of the buffer is part of an unfinished element
+            consumed = max(consumed, min(self._pos, len(buffer)))
+        if consumed:
+            del buffer[:consumed]
+            self._pos -= consumed
+            if self._element_start is not None:
+                self._element_start -= consumed
+        return completed
@@ -0,0 +1,70 @@
+import logging
+import os
+import re
+import secrets
+import shutil
+import time
+from pathlib import Path
+from typing import Optional, Tuple
+
+# Files too large to hand to the model, e.g. long interpreter output, kept for download
+ARTIFACTS_DIR = Path(os.getenv("ARTIFACTS_DIR", "./db/artifacts"))
+ARTIFACT_TTL_SECONDS = float(os.getenv("ARTIFACT_TTL_SECONDS", str(7 * 24 * 3600)))
+
+_ARTIFACT_ID = re.compile(r"^art_[0-9a-f]{16}$")
+
+
+def new_artifact(conversation_id: str) -> Tuple[str, Path]:
+    """
+    Reserves an artifact in a conversation.
+
+    Args:
+        conversation_id: The conversation the artifact belongs to, downloads check its owner
+
+    Returns:
+        tuple: (artifact_id, path) where path is the file to write the artifact to
+    """
+    artifact_id = f"art_{secrets.token_hex(8)}"
+    directory = ARTIFACTS_DIR / conversation_id
+    directory.mkdir(parents=True, exist_ok=True)
+    return artifact_id, directory / f"{artifact_id}.txt"
+
+
+def artifact_path(conversation_id: str, artifact_id: str) -> Optional[Path]:
+    """The file of an artifact, None when the id is malformed or the file is gone."""
+    if not _ARTIFACT_ID.match(artifact_id):
+        return None
+    root = ARTIFACTS_DIR.resolve()
+    path = (ARTIFACTS_DIR / conversation_id / f"{artifact_id}.txt").resolve()
+    # conversation_id comes from the URL, never serve anything outside the artifacts directory
+    if root not in path.parents or not path.is_file():
+        return None
+    return path
+
+
+def artifact_url(conversation_id: str, artifact_id: str) -> str:
+    """The API path the client downloads an artifact from."""
+    return f"/api/v1/chats/conversations/{conversation_id}/artifacts/{artifact_id}"
+
+
+def prune_artifacts() -> int:
+    """Deletes artifacts older than ARTIFACT_TTL_SECONDS, returns how many were removed."""
+    if not ARTIFACTS_DIR.is_dir():
+        return 0
+    cutoff = time.time() - ARTIFACT_TTL_SECONDS
+    removed = 0
+    for directory in ARTIFACTS_DIR.iterdir():
+        if not directory.is_dir():
+            continue
+        for path in directory.glob("art_*.txt"):
+            try:
+                if path.stat().st_mtime < cutoff:
+                    path.unlink()
+                    removed += 1
+            except OSError:
+                logging.exception(f"Failed to remove artifact {path}")
+        if not any(directory.iterdir()):
+            shutil.rmtree(directory, ignore_errors=True)
+    if removed:
+        logging.info(f"Removed {removed} expired artifacts")
+    return removed
@@ -0,0 +1,164 @@
+import threading
+from typing import Any, Dict, Iterable, List, Set
+
+# Share of the query's trigrams a value must contain to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+
+def _value_text(obj: Dict[str, Any], field: str) -> str:
+    value = obj.get(field)
+    return "" if value is None else str(value).lower()
+
+
+def _raw_trigrams(text: str) -> Set[str]:
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+def _word_trigrams(text: str) -> Set[str]:
+    """Trigrams of each word padded with spaces, these make short typos still overlap."""
+    trigrams = set()
+    for word in text.split():
+        trigrams |= _raw_trigrams(f"  {word} ")
+    return trigrams
+
+
+class _FieldColumn:
+    """Lowercased values of one field plus a trigram posting list over them."""
+
+    def __init__(self) -> None:
+        self.values: Dict[str, str] = {}
+        self.postings: Dict[str, Set[str]] = {}
+
+    def add(self, object_id: str, text: str) -> None:
+        self.values[object_id] = text
+        for trigram in _raw_trigrams(text) | _word_trigrams(text):
+            self.postings.setdefault(trigram, set()).add(object_id)
+
+    def remove(self, object_id: str) -> None:
+        text = self.values.pop(object_id, None)
+        if text is None:
+            return
+        for trigram in _raw_trigrams(text) | _word_trigrams(text):
+            ids = self.postings.get(trigram)
+            if ids is not None:
+                ids.discard(object_id)
+                if not ids:
+                    del self.postings[trigram]
+
+    def substring_ids(self, query: str) -> Iterable[str]:
+        trigrams = _raw_trigrams(query)
+        if not trigrams:
+            # Too short for trigrams, the lowercase column is still cheaper than the dicts
+            return [object_id for object_id, text in self.values.items() if query in text]
+        candidate_sets = sorted((self.postings.get(t, set()) for t in trigrams), key=len)
+        candidates = set.intersection(*candidate_sets) if candidate_sets[0] else set()
+        return [object_id for object_id in candidates if query in self.values[object_id]]
+
+    def fuzzy_scores(self, query: str) -> Dict[str, float]:
+        query_trigrams = _word_trigrams(query)
+        if not query_trigrams:
+            return {}
+        hits: Dict[str, int] = {}
+        for trigram in query_trigrams:
+            for object_id in self.postings.get(trigram, ()):
+                hits[object_id] = hits.get(object_id, 0) + 1
+        return {
+            object_id: count / len(query_trigrams)
+            for object_id, count in hits.items()
+            if count / len(query_trigrams) >= FUZZY_THRESHOLD
+        }
+
+
+class DirectoryIndex:
+    """
+    In-memory search index over directory objects (users or teams) keyed by id.
+
+    Each searched field gets a lowercase column and a trigram posting list, built the
+    first time that field is queried and then kept current by `upsert` and `remove`.
+    Safe to use from several threads.
+    """
+
+    def __init__(self, objects: Iterable[Dict[str, Any]] = ()) -> None:
+        self._lock = threading.RLock()
+        self._objects: Dict[str, Dict[str, Any]] = {}
+        self._columns: Dict[str, _FieldColumn] = {}
+        # Insertion sequence per id, results are returned in mirror order
+        self._positions: Dict[str, int] = {}
+        self._next_position = 0
+        for obj in objects:
+            self.upsert(obj)
+
+    def __len__(self) -> int:
+        return len(self._objects)
+
+    def values(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._objects.values())
+
+    def upsert(self, obj: Dict[str, Any]) -> None:
+        with self._lock:
+            object_id = obj["id"]
+            self._objects[object_id] = obj
+            if object_id not in self._positions:
+                self._positions[object_id] = self._next_position
+                self._next_position += 1
+            for field, column in self._columns.items():
+                column.remove(object_id)
+                column.add(object_id, _value_text(obj, field))
+
+    def remove(self, object_id: str) -> None:
+        with self._lock:
+            if self._objects.pop(object_id, None) is None:
+                return
+            del self._positions[object_id]
+            for column in self._columns.values():
+                column.remove(object_id)
+
+    def _column(self, field: str) -> _FieldColumn:
+        column = self._columns.get(field)
+        if column is None:
+            column = _FieldColumn()
+            for object_id, obj in self._objects.items():
+                column.add(object_id, _value_text(obj, field))
+            self._columns[field] = column
+        return column
+
+    def search(
+        self, field: str, query: str, prefix: bool = False, fuzzy: bool = False
+    ) -> List[Dict[str, Any]]:
+        """
+        Finds objects whose field contains (or starts with) query, case-insensitively.
+
+        Args:
+            field: The property to match, e.g. 'displayName'.
+            query: The text to look for.
+            prefix: Only match at the start of the value.
+            fuzzy: Also return close matches by trigram overlap, best matches first.
+
+        Returns:
+            List[Dict[str, Any]]: The matching objects.
+        """
+        query = query.lower()
+        with self._lock:
+            column = self._column(field)
+            ids = column.substring_ids(query)
+            if prefix:
+                ids = [object_id for object_id in ids if column.values[object_id].startswith(query)]
+            if not fuzzy:
+                ids = sorted(ids, key=self._positions.__getitem__)
+                return [self._objects[object_id] for object_id in ids]
+
+            scores = column.fuzzy_scores(query)
+            scores.update({object_id: 2.0 for object_id in ids})  # Exact matches rank first
+            ranked = sorted(scores, key=scores.get, reverse=True)
+            return [self._objects[object_id] for object_id in ranked]
+
+
+def filter_objects(
+    objects: List[Dict[str, Any]], field: str, query: str, fuzzy: bool = False
+) -> List[Dict[str, Any]]:
+    """One-off version of `DirectoryIndex.search` for lists fetched live from Graph."""
+    if not fuzzy:
+        query = query.lower()
+        return [obj for obj in objects if query in _value_text(obj, field)]
+    return DirectoryIndex(objects).search(field, query, fuzzy=True)
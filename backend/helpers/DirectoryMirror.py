@@ -0,0 +1,474 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from helpers.DirectoryIndex import DirectoryIndex
+from helpers.RequestHelper import (
+    GRAPH_BASE_URL,
+    add_write_listener,
+    make_batch_request,
+    make_request,
+)
+
+load_dotenv()
+
+# Local copy of users, groups/teams and channels, kept fresh with Graph delta queries.
+# Lives next to chat_history.sqlite.
+MIRROR_DB_PATH = "./db/directory_mirror.sqlite"
+MIRROR_ENABLED = os.getenv("DIRECTORY_MIRROR_ENABLED", "true").lower() != "false"
+MIRROR_SYNC_INTERVAL_SECONDS = int(os.getenv("DIRECTORY_MIRROR_SYNC_INTERVAL", "300"))
+# Reads fall back to live Graph once the last successful sync is older than this
+MIRROR_MAX_AGE_SECONDS = int(os.getenv("DIRECTORY_MIRROR_MAX_AGE", "900"))
+
+USER_DELTA_URL = (
+    f"{GRAPH_BASE_URL}/users/delta?$select=id,displayName,givenName,surname,userPrincipalName,"
+    "mail,jobTitle,department,officeLocation,companyName,usageLocation,accountEnabled,"
+    "assignedLicenses,mobilePhone,businessPhones,preferredLanguage,createdDateTime"
+)
+GROUP_DELTA_URL = (
+    f"{GRAPH_BASE_URL}/groups/delta?$select=id,displayName,description,visibility,"
+    "mail,mailNickname,createdDateTime,resourceProvisioningOptions"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS directory_object (
+    kind TEXT NOT NULL,
+    id TEXT NOT NULL,
+    parent_id TEXT,
+    data TEXT NOT NULL,
+    PRIMARY KEY (kind, id)
+);
+CREATE INDEX IF NOT EXISTS ix_directory_object_parent ON directory_object (kind, parent_id);
+CREATE TABLE IF NOT EXISTS delta_state (
+    kind TEXT PRIMARY KEY,
+    delta_link TEXT,
+    synced_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS mirror_write (
+    kind TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+);
+"""
+# Added after the first release. A delta link only carries the properties of the query it
+# started from, synced_writes is the mirror_write count the last successful sync covers.
+_DELTA_STATE_COLUMNS = {"initial_url": "TEXT", "synced_writes": "INTEGER NOT NULL DEFAULT 0"}
+
+_TEAM_FILTER = (
+    "EXISTS (SELECT 1 FROM json_each(data, '$.resourceProvisioningOptions') "
+    "WHERE json_each.value = 'Team')"
+)
+
+_sync_lock = threading.Lock()
+# In-memory search indexes over the mirror: 'user', 'group' and 'team' (groups that are teams),
+# each with the synced_at of the mirror state it reflects. Interpreter workers read the mirror
+# from other processes, an index is rebuilt once a sync elsewhere moved synced_at on.
+_indexes: Dict[str, Tuple[float, DirectoryIndex]] = {}
+_index_lock = threading.Lock()
+_schema_ready = False
+# Concurrent first connections would otherwise both run the ALTERs and fail on the duplicate column
+_schema_lock = threading.Lock()
+
+
+@contextmanager
+def _connect() -> Iterator[sqlite3.Connection]:
+    """Opens the mirror database, committing on success and always closing."""
+    global _schema_ready
+
+    connection = sqlite3.connect(MIRROR_DB_PATH, timeout=30)
+    try:
+        if not _schema_ready:
+            with _schema_lock:
+                if not _schema_ready:
+                    connection.executescript(_SCHEMA)
+                    columns = {row[1] for row in connection.execute("PRAGMA table_info(delta_state)")}
+                    for column, definition in _DELTA_STATE_COLUMNS.items():
+                        if column not in columns:
+                            try:
+                                connection.execute(f"ALTER TABLE delta_state ADD COLUMN {column} {definition}")
+                            except sqlite3.OperationalError as e:
+                                # Another process (e.g. an interpreter worker) added it first
+                                if "duplicate column" not in str(e):
+                                    raise
+                    _schema_ready = True
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+def _mark_stale_for_write(method: str, url: str) -> None:
+    """
+    Write listener, a successful POST/PATCH/DELETE makes the affected kind stale.
+
+    Writes are counted in the mirror database, so a write made in an interpreter worker
+    makes the server (and every other worker) skip the mirror too, and the reverse.
+    """
+    path = url.split("?", 1)[0]
+    kinds = []
+    if "/channels" in path:
+        kinds.append("channel")
+    elif "/users" in path:
+        kinds.append("user")
+    if "/groups" in path or "/teams" in path:
+        kinds.append("group")
+    if not kinds or not MIRROR_ENABLED:
+        return
+    with _connect() as connection:
+        connection.executemany(
+            "INSERT INTO mirror_write (kind, count) VALUES (?, 1) "
+            "ON CONFLICT(kind) DO UPDATE SET count = count + 1",
+            [(kind,) for kind in kinds],
+        )
+
+
+add_write_listener(_mark_stale_for_write)
+
+
+def _write_count(kind: str) -> int:
+    with _connect() as connection:
+        row = connection.execute("SELECT count FROM mirror_write WHERE kind = ?", (kind,)).fetchone()
+    return row[0] if row else 0
+
+
+def _fresh_synced_at(kind: str) -> Optional[float]:
+    """The synced_at of a kind when the mirror can answer reads for it, else None."""
+    if not MIRROR_ENABLED:
+        return None
+    try:
+        with _connect() as connection:
+            row = connection.execute(
+                "SELECT delta_state.synced_at, delta_state.synced_writes, COALESCE(mirror_write.count, 0) "
+                "FROM delta_state LEFT JOIN mirror_write ON mirror_write.kind = delta_state.kind "
+                "WHERE delta_state.kind = ?",
+                (kind,),
+            ).fetchone()
+    except sqlite3.Error as e:
+        logging.error(f"Failed to read directory mirror state for {kind}: {e}")
+        return None
+    if row is None or row[1] != row[2] or time.time() - row[0] > MIRROR_MAX_AGE_SECONDS:
+        return None
+    return row[0]
+
+
+def is_fresh(kind: str) -> bool:
+    """
+    Tells whether the mirror can answer reads for a kind ('user', 'group' or 'channel').
+
+    Returns:
+        bool: True if mirroring is enabled, the kind has been synced within
+              MIRROR_MAX_AGE_SECONDS and no write has touched it since.
+    """
+    return _fresh_synced_at(kind) is not None
+
+
+def _is_team(group: Dict[str, Any]) -> bool:
+    return "Team" in (group.get("resourceProvisioningOptions") or [])
+
+
+def _get_index(kind: str, teams_only: bool, synced: float) -> DirectoryIndex:
+    """
+    Returns the search index for a kind as of the sync at `synced`.
+
+    Loaded from the mirror on first use, and again when the mirror was synced since.
+    """
+    name = "team" if teams_only else kind
+    entry = _indexes.get(name)
+    if entry is None or entry[0] != synced:
+        with _index_lock:
+            entry = _indexes.get(name)
+            if entry is None or entry[0] != synced:
+                query = "SELECT data FROM directory_object WHERE kind = ?"
+                if teams_only:
+                    query += f" AND {_TEAM_FILTER}"
+                with _connect() as connection:
+                    rows = connection.execute(query, (kind,)).fetchall()
+                entry = _indexes[name] = (synced, DirectoryIndex(json.loads(row[0]) for row in rows))
+                logging.info(f"Built directory index for {name} with {len(entry[1])} entries")
+    return entry[1]
+
+
+def _update_indexes(
+    kind: str, applied: List[Tuple[str, Optional[Dict[str, Any]]]], full: bool, synced: float
+) -> None:
+    """
+    Applies synced changes to loaded indexes, a full resync drops them for a lazy rebuild.
+
+    Updated indexes are tagged with the new synced_at, so `_get_index` keeps them.
+    """
+    names = ("group", "team") if kind == "group" else (kind,)
+    with _index_lock:
+        if full:
+            for name in names:
+                _indexes.pop(name, None)
+            return
+        for name in names:
+            entry = _indexes.get(name)
+            if entry is None:
+                continue
+            _, index = entry
+            for object_id, data in applied:
+                if data is None or (name == "team" and not _is_team(data)):
+                    index.remove(object_id)
+                else:
+                    index.upsert(data)
+            _indexes[name] = (synced, index)
+
+
+def list_objects(kind: str, teams_only: bool = False) -> Optional[List[Dict[str, Any]]]:
+    """
+    Returns every mirrored object of a kind, or None when the mirror is stale.
+
+    Args:
+        kind: 'user' or 'group'.
+        teams_only: Only return groups that are provisioned as Microsoft Teams.
+    """
+    synced = _fresh_synced_at(kind)
+    if synced is None:
+        return None
+    try:
+        index = _get_index(kind, teams_only, synced)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to load directory index for {kind}: {e}")
+        return None
+    return index.values()
+
+
+def search_objects(
+    kind: str,
+    filter_field: str,
+    search_string: str,
+    prefix: bool = False,
+    teams_only: bool = False,
+    fuzzy: bool = False,
+) -> Optional[List[Dict[str, Any]]]:
+    """
+    Case-insensitive substring (or prefix) search over one field of mirrored objects.
+
+    Args:
+        kind: 'user' or 'group'.
+        filter_field: Graph property name to match.
+        search_string: The string to look for.
+        prefix: Match only at the start of the field, like Graph's startsWith.
+        teams_only: Only return groups that are provisioned as Microsoft Teams.
+        fuzzy: Also return close matches by trigram overlap, best matches first.
+
+    Returns:
+        Optional[List[Dict[str, Any]]]: Matching objects, or None when the mirror is
+        stale and the caller should query Graph directly.
+    """
+    synced = _fresh_synced_at(kind)
+    if synced is None:
+        return None
+    try:
+        index = _get_index(kind, teams_only, synced)
+    except sqlite3.Error as e:
+        logging.error(f"Failed to load directory index for {kind}: {e}")
+        return None
+    return index.search(filter_field, search_string, prefix=prefix, fuzzy=fuzzy)
+
+
+def list_team_channels(team_ids: Iterable[str]) -> Optional[Dict[str, List[Dict[str, Any]]]]:
+    """
+    Returns the mirrored channels for each team, or None when any team is not mirrored.
+
+    Every team has at least its General channel, so a team without rows is unknown
+    to the mirror rather than empty.
+    """
+    team_ids = list(team_ids)
+    if not is_fresh("channel"):
+        return None
+
+    teams_channels: Dict[str, List[Dict[str, Any]]] = {team_id: [] for team_id in team_ids}
+    try:
+        with _connect() as connection:
+            for start in range(0, len(team_ids), 500):
+                chunk = team_ids[start : start + 500]
+                rows = connection.execute(
+                    "SELECT parent_id, data FROM directory_object WHERE kind = 'channel' "
+                    f"AND parent_id IN ({','.join('?' * len(chunk))})",
+                    chunk,
+                ).fetchall()
+                for parent_id, data in rows:
+                    teams_channels[parent_id].append(json.loads(data))
+    except sqlite3.Error as e:
+        logging.error(f"Directory mirror channel query failed: {e}")
+        return None
+
+    if any(not channels for channels in teams_channels.values()):
+        return None
+    return teams_channels
+
+
+def synced_at() -> Dict[str, float]:
+    """When each kind was last synced (epoch seconds), empty before the first sync."""
+    with _connect() as connection:
+        return dict(connection.execute("SELECT kind, synced_at FROM delta_state").fetchall())
+
+
+def dump_objects(kind: str, teams_only: bool = False) -> List[Tuple[Optional[str], Dict[str, Any]]]:
+    """
+    Every mirrored object of a kind with its parent id, whether or not the mirror is fresh.
+
+    Args:
+        kind: 'user', 'group' or 'channel' (whose parent is its team).
+        teams_only: Only return groups that are provisioned as Microsoft Teams.
+    """
+    query = "SELECT parent_id, data FROM directory_object WHERE kind = ?"
+    if teams_only:
+        query += f" AND {_TEAM_FILTER}"
+    with _connect() as connection:
+        rows = connection.execute(query, (kind,)).fetchall()
+    return [(parent_id, json.loads(data)) for parent_id, data in rows]
+
+
+def _fetch_delta(kind: str, url: str) -> Tuple[Optional[List[Dict[str, Any]]], Optional[str], Optional[Dict[str, Any]]]:
+    """Follows a delta round to its end, returning (changes, new delta link, error)."""
+    changes: List[Dict[str, Any]] = []
+    while url:
+        response, error = make_request("GET", url)
+        if error:
+            return None, None, error
+        changes.extend(response.get("value", []))
+        delta_link = response.get("@odata.deltaLink")
+        if delta_link:
+            return changes, delta_link, None
+        url = response.get("@odata.nextLink")
+    return None, None, {"error": f"Delta query for {kind} ended without a deltaLink"}
+
+
+def _sync_delta(kind: str, initial_url: str, write_count: int) -> Optional[Dict[str, Any]]:
+    """
+    Applies one delta round for 'user' or 'group', starting over if the token expired.
+
+    write_count is the kind's mirror_write count read before the round, the writes it
+    covers. Writes made during the round keep the kind stale until the next one.
+    """
+    with _connect() as connection:
+        row = connection.execute(
+            "SELECT delta_link, initial_url FROM delta_state WHERE kind = ?", (kind,)
+        ).fetchone()
+    delta_link = row[0] if row else None
+    if delta_link and row[1] != initial_url:
+        # The query changed (e.g. more $select properties), only a full round returns them
+        logging.info(f"Delta query for {kind} changed, running a full resync")
+        delta_link = None
+
+    changes, new_link, error = _fetch_delta(kind, delta_link or initial_url)
+    if error and delta_link and error.get("status_code") == 410:
+        # The delta token is no longer valid, Graph requires a full resync
+        logging.warning(f"Delta token for {kind} expired, running a full resync")
+        delta_link = None
+        changes, new_link, error = _fetch_delta(kind, initial_url)
+    if error:
+        logging.error(f"Directory mirror sync failed for {kind}: {error}")
+        return error
+
+    applied: List[Tuple[str, Optional[Dict[str, Any]]]] = []
+    with _connect() as connection:
+        if delta_link is None:
+            # A full round lists every live object, anything else was deleted
+            connection.execute("DELETE FROM directory_object WHERE kind = ?", (kind,))
+        for item in changes:
+            if "@removed" in item:
+                connection.execute(
+                    "DELETE FROM directory_object WHERE kind = ? AND id = ?", (kind, item["id"])
+                )
+                applied.append((item["id"], None))
+                continue
+            existing = connection.execute(
+                "SELECT data FROM directory_object WHERE kind = ? AND id = ?", (kind, item["id"])
+            ).fetchone()
+            # Updates only carry changed properties, merge them over what we have
+            data = {**json.loads(existing[0]), **item} if existing else item
+            connection.execute(
+                "INSERT OR REPLACE INTO directory_object (kind, id, parent_id, data) VALUES (?, ?, NULL, ?)",
+                (kind, item["id"], json.dumps(data)),
+            )
+            applied.append((item["id"], data))
+        synced = time.time()
+        connection.execute(
+            "INSERT OR REPLACE INTO delta_state (kind, delta_link, synced_at, initial_url, synced_writes) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (kind, new_link, synced, initial_url, write_count),
+        )
+    _update_indexes(kind, applied, full=delta_link is None, synced=synced)
+    logging.info(f"Directory mirror applied {len(changes)} {kind} changes")
+    return None
+
+
+def _sync_channels(write_count: int) -> Optional[Dict[str, Any]]:
+    """Refreshes the channels of every mirrored team, Graph has no app-level channel delta."""
+    with _connect() as connection:
+        team_ids = [
+            row[0]
+            for row in connection.execute(
+                f"SELECT id FROM directory_object WHERE kind = 'group' AND {_TEAM_FILTER}"
+            )
+        ]
+
+    results = make_batch_request([{"url": f"/teams/{team_id}/channels"} for team_id in team_ids])
+
+    failed = 0
+    with _connect() as connection:
+        connection.execute("DELETE FROM directory_object WHERE kind = 'channel'")
+        for team_id, (response, error) in zip(team_ids, results):
+            if error:
+                # Left out on purpose, reads for this team fall back to Graph
+                failed += 1
+                continue
+            connection.executemany(
+                "INSERT OR REPLACE INTO directory_object (kind, id, parent_id, data) VALUES ('channel', ?, ?, ?)",
+                [(channel["id"], team_id, json.dumps(channel)) for channel in response.get("value", [])],
+            )
+        connection.execute(
+            "INSERT OR REPLACE INTO delta_state (kind, delta_link, synced_at, synced_writes) "
+            "VALUES ('channel', NULL, ?, ?)",
+            (time.time(), write_count),
+        )
+    logging.info(f"Directory mirror refreshed channels for {len(team_ids) - failed}/{len(team_ids)} teams")
+    return None
+
+
+def sync_directory() -> Dict[str, Optional[Dict[str, Any]]]:
+    """
+    Brings the mirror up to date, users and groups via delta, channels via $batch.
+
+    Blocking, run it in a thread from async code.
+
+    Returns:
+        dict: Maps each kind to None on success or its error dictionary.
+    """
+    with _sync_lock:
+        start_time = time.time()
+        results = {}
+        for kind, initial_url in (("user", USER_DELTA_URL), ("group", GROUP_DELTA_URL)):
+            results[kind] = _sync_delta(kind, initial_url, _write_count(kind))
+
+        if results["group"] is None:
+            results["channel"] = _sync_channels(_write_count("channel"))
+        else:
+            results["channel"] = results["group"]
+
+        logging.info(f"Directory mirror sync completed in {time.time() - start_time:.2f} seconds")
+        return results
+
+
+async def run_directory_sync() -> None:
+    """Keeps the mirror fresh until cancelled, meant to run as a lifespan task."""
+    if not MIRROR_ENABLED:
+        logging.info("Directory mirror disabled")
+        return
+    while True:
+        try:
+            await asyncio.to_thread(sync_directory)
+        except Exception as e:
+            logging.exception(f"Unexpected error while syncing the directory mirror: {e}")
+        await asyncio.sleep(MIRROR_SYNC_INTERVAL_SECONDS)
@@ -0,0 +1,185 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List
+
+import pandas
+
+from helpers import DirectoryMirror as directory_mirror
+from helpers.RequestHelper import GRAPH_BASE_URL, make_request
+
+USER_COLUMNS = [
+    "id",
+    "displayName",
+    "userPrincipalName",
+    "mail",
+    "department",
+    "jobTitle",
+    "officeLocation",
+    "companyName",
+    "usageLocation",
+    "accountEnabled",
+    "createdDateTime",
+]
+TEAM_COLUMNS = ["id", "displayName", "description", "visibility", "mail", "createdDateTime"]
+CHANNEL_COLUMNS = ["id", "team_id", "displayName", "membershipType", "email", "createdDateTime"]
+LICENSE_COLUMNS = ["user_id", "userPrincipalName", "department", "accountEnabled", "sku_id", "sku"]
+SKU_COLUMNS = ["sku_id", "sku", "enabled", "consumed"]
+
+# The mirrored kind each table is built from, it is rebuilt when that kind was synced
+# again. SKU unit counts change with license assignments, so skus follow the users.
+_SOURCES = {
+    "users": "user",
+    "licenses": "user",
+    "skus": "user",
+    "teams": "group",
+    "channels": "channel",
+}
+
+
+def _frame(rows: List[Dict[str, Any]], columns: List[str]) -> pandas.DataFrame:
+    return pandas.DataFrame.from_records(
+        [{column: row.get(column) for column in columns} for row in rows], columns=columns
+    )
+
+
+class DirectorySnapshot:
+    """
+    The directory mirror as pandas DataFrames, for analysis in the Python interpreter.
+
+    Tables are built on first access and rebuilt once the mirror has synced their kind
+    again, so a snippet sees data as fresh as the last sync without paging through Graph.
+
+    Tables:
+        users: one row per user (USER_COLUMNS) plus license_count and licenses, the
+            part numbers (e.g. ENTERPRISEPACK) of the SKUs assigned to the user
+        licenses: one row per assigned license (LICENSE_COLUMNS)
+        teams: one row per Microsoft Team (TEAM_COLUMNS)
+        channels: one row per channel, team_id links it to teams.id (CHANNEL_COLUMNS)
+        skus: the tenant's subscribed SKUs with enabled and consumed units (SKU_COLUMNS)
+    """
+
+    def __init__(self) -> None:
+        self._tables: Dict[str, pandas.DataFrame] = {}
+        self._built_from: Dict[str, float] = {}
+        self._sku_names: Dict[str, str] = {}
+        # Reentrant, building users and licenses builds skus first
+        self._lock = threading.RLock()
+
+    def __repr__(self) -> str:
+        return (
+            "DirectorySnapshot(users, licenses, teams, channels, skus), "
+            f"synced {self.age_seconds():.0f} seconds ago"
+        )
+
+    def age_seconds(self) -> float:
+        """Seconds since the mirror last synced users, inf before the first sync."""
+        synced = directory_mirror.synced_at().get("user")
+        return time.time() - synced if synced else float("inf")
+
+    def _skus(self) -> pandas.DataFrame:
+        response, error = make_request("GET", f"{GRAPH_BASE_URL}/subscribedSkus")
+        if error:
+            logging.warning(f"Could not load subscribed SKUs for the directory snapshot: {error}")
+            return _frame([], SKU_COLUMNS)
+        rows = [
+            {
+                "sku_id": sku.get("skuId"),
+                "sku": sku.get("skuPartNumber"),
+                "enabled": (sku.get("prepaidUnits") or {}).get("enabled"),
+                "consumed": sku.get("consumedUnits"),
+            }
+            for sku in response.get("value", [])
+        ]
+        self._sku_names = {row["sku_id"]: row["sku"] for row in rows}
+        return _frame(rows, SKU_COLUMNS)
+
+    def _build(self, name: str) -> pandas.DataFrame:
+        if name == "skus":
+            return self._skus()
+        if name == "teams":
+            teams = directory_mirror.dump_objects("group", teams_only=True)
+            return _frame([data for _, data in teams], TEAM_COLUMNS)
+        if name == "channels":
+            channels = directory_mirror.dump_objects("channel")
+            return _frame([{**data, "team_id": team_id} for team_id, data in channels], CHANNEL_COLUMNS)
+
+        # Licenses are shown by part number, e.g. ENTERPRISEPACK for Office 365 E3
+        self._cached("skus")
+        sku_names = self._sku_names
+        users = [data for _, data in directory_mirror.dump_objects("user")]
+        if name == "licenses":
+            return _frame(
+                [
+                    {
+                        "user_id": user.get("id"),
+                        "userPrincipalName": user.get("userPrincipalName"),
+                        "department": user.get("department"),
+                        "accountEnabled": user.get("accountEnabled"),
+                        "sku_id": assigned.get("skuId"),
+                        "sku": sku_names.get(assigned.get("skuId"), assigned.get("skuId")),
+                    }
+                    for user in users
+                    for assigned in user.get("assignedLicenses") or []
+                ],
+                LICENSE_COLUMNS,
+            )
+        frame = _frame(users, USER_COLUMNS)
+        licenses = [
+            [
+                sku_names.get(assigned.get("skuId"), assigned.get("skuId"))
+                for assigned in user.get("assignedLicenses") or []
+            ]
+            for user in users
+        ]
+        frame["license_count"] = [len(user_licenses) for user_licenses in licenses]
+        frame["licenses"] = licenses
+        return frame
+
+    def _cached(self, name: str) -> pandas.DataFrame:
+        """The shared copy of a table, built if the mirror synced since it was last built."""
+        with self._lock:
+            if name not in _SOURCES:
+                raise KeyError(f"Unknown directory table {name}, use one of {', '.join(_SOURCES)}")
+            synced = directory_mirror.synced_at().get(_SOURCES[name], 0.0)
+            if name not in self._tables or self._built_from.get(name) != synced:
+                started = time.monotonic()
+                self._tables[name] = self._build(name)
+                self._built_from[name] = synced
+                logging.info(
+                    f"Built directory snapshot table {name} with {len(self._tables[name])} rows "
+                    f"in {time.monotonic() - started:.2f}s"
+                )
+            return self._tables[name]
+
+    def table(self, name: str) -> pandas.DataFrame:
+        """Returns a table by name, a copy so snippets can modify it without affecting the next one."""
+        return self._cached(name).copy()
+
+    def preload(self) -> None:
+        """Builds every table ahead of the first snippet."""
+        for name in ("skus", "users", "licenses", "teams", "channels"):
+            try:
+                self._cached(name)
+            except Exception:
+                logging.exception(f"Failed to preload directory snapshot table {name}")
+
+    @property
+    def users(self) -> pandas.DataFrame:
+        return self.table("users")
+
+    @property
+    def licenses(self) -> pandas.DataFrame:
+        return self.table("licenses")
+
+    @property
+    def teams(self) -> pandas.DataFrame:
+        return self.table("teams")
+
+    @property
+    def channels(self) -> pandas.DataFrame:
+        return self.table("channels")
+
+    @property
+    def skus(self) -> pandas.DataFrame:
+        return self.table("skus")
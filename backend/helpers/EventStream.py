@@ -0,0 +1,185 @@
+import asyncio
+import os
+from dataclasses import replace
+from typing import Any, AsyncIterable, AsyncIterator, Dict, List, Optional, TypeVar, Union
+
+import pydantic_core
+
+from custom._utils import group_by_temporal
+from custom.messages import (
+    PartDeltaEvent,
+    PartStartEvent,
+    ReasoningPart,
+    ReasoningPartDelta,
+    TextPart,
+    TextPartDelta,
+)
+
+# Deltas arriving within this many seconds of each other are sent as one frame, 0 disables
+SSE_COALESCE_INTERVAL = float(os.getenv("SSE_COALESCE_INTERVAL", "0.05"))
+# A merged frame is closed once its text reaches this many characters
+SSE_COALESCE_MAX_CHARS = int(os.getenv("SSE_COALESCE_MAX_CHARS", "4096"))
+
+StreamEvent = Union[PartStartEvent, PartDeltaEvent]
+T = TypeVar("T")
+
+
+def sse_frame(payload: Any) -> str:
+    """
+    Encodes a payload as a server-sent event frame.
+
+    Uses pydantic-core's serializer, which is several times faster than json.dumps on
+    the small dicts sent per event and falls back to str() for values it cannot encode.
+    """
+    return "data: " + pydantic_core.to_json(payload, fallback=str).decode() + "\n\n"
+
+
+def _text(event: StreamEvent) -> Optional[str]:
+    """The streamed text of a text or reasoning event, None for events that are never merged"""
+    if isinstance(event, PartStartEvent):
+        if isinstance(event.part, TextPart):
+            return event.part.content
+        if isinstance(event.part, ReasoningPart):
+            return event.part.reasoning
+    elif isinstance(event, PartDeltaEvent):
+        if isinstance(event.delta, TextPartDelta):
+            return event.delta.content_delta
+        if isinstance(event.delta, ReasoningPartDelta):
+            return event.delta.reasoning_delta
+    return None
+
+
+def _kind(event: StreamEvent) -> str:
+    return event.part.part_kind if isinstance(event, PartStartEvent) else event.delta.part_delta_kind
+
+
+def _merged(first: StreamEvent, fragments: List[str]) -> StreamEvent:
+    """first with the text of the deltas that followed it appended"""
+    if len(fragments) == 1:
+        return first
+    text = "".join(fragments)
+    if isinstance(first, PartStartEvent):
+        if isinstance(first.part, TextPart):
+            return replace(first, part=replace(first.part, content=text))
+        return replace(first, part=replace(first.part, reasoning=text))
+    if isinstance(first.delta, TextPartDelta):
+        return replace(first, delta=replace(first.delta, content_delta=text))
+    return replace(first, delta=replace(first.delta, reasoning_delta=text))
+
+
+def coalesce_events(events: List[StreamEvent], max_chars: int = SSE_COALESCE_MAX_CHARS) -> List[StreamEvent]:
+    """
+    Merges runs of text (or reasoning) deltas for the same part into one event.
+
+    A part start absorbs the deltas that directly follow it. Any other event, a delta for
+    another part or a run reaching max_chars ends the run, so order is preserved.
+    """
+    coalesced: List[StreamEvent] = []
+    first: Optional[StreamEvent] = None
+    fragments: List[str] = []
+    size = 0
+
+    for event in events:
+        text = _text(event)
+        if (
+            first is not None
+            and text is not None
+            and isinstance(event, PartDeltaEvent)
+            and event.index == first.index
+            and _kind(event) == _kind(first)
+            and size + len(text) <= max_chars
+        ):
+            fragments.append(text)
+            size += len(text)
+            continue
+
+        if first is not None:
+            coalesced.append(_merged(first, fragments))
+            first = None
+        if text is None:
+            coalesced.append(event)
+        else:
+            first, fragments, size = event, [text], len(text)
+
+    if first is not None:
+        coalesced.append(_merged(first, fragments))
+    return coalesced
+
+
+async def coalesced_stream(
+    events: AsyncIterable[StreamEvent], interval: float = SSE_COALESCE_INTERVAL
+) -> AsyncIterator[StreamEvent]:
+    """
+    Re-yields a model response stream with deltas that arrive close together merged.
+
+    Events are batched with `group_by_temporal`, so a quiet stream is not delayed by more
+    than interval and a busy one goes out in fewer, larger frames.
+    """
+    async with group_by_temporal(events, interval if interval > 0 else None) as groups:
+        async for group in groups:
+            for event in coalesce_events(group):
+                yield event
+
+
+class ToolProgress:
+    """
+    Carries progress from running tools to the chat stream, e.g. interpreter output.
+
+    Sync tools run in executor threads, `emit` hands their events to the stream's event
+    loop. Created per chat run and given to tools through MyDeps.
+    """
+
+    def __init__(self) -> None:
+        self._loop = asyncio.get_running_loop()
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue()
+
+    def emit(self, tool_call_id: Optional[str], tool_name: str, data: Dict[str, Any]) -> None:
+        """Queues a {"type": "tool_progress"} payload, safe to call from any thread."""
+        payload = {
+            "type": "tool_progress",
+            "data": {"tool_call_id": tool_call_id, "name": tool_name, **data},
+        }
+        self._loop.call_soon_threadsafe(self._queue.put_nowait, payload)
+
+    def _drain(self) -> List[Dict[str, Any]]:
+        payloads = []
+        while not self._queue.empty():
+            payloads.append(self._queue.get_nowait())
+        return payloads
+
+    async def merged(self, events: AsyncIterable[T]) -> AsyncIterator[Union[T, Dict[str, Any]]]:
+        """
+        Re-yields events with the progress payloads emitted while waiting for them.
+
+        Progress queued before an event is yielded first, so a tool's last output comes
+        ahead of its result.
+        """
+        iterator = events.__aiter__()
+        next_event = asyncio.ensure_future(iterator.__anext__())
+        next_progress = asyncio.ensure_future(self._queue.get())
+        try:
+            while True:
+                done, _ = await asyncio.wait(
+                    {next_event, next_progress}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_progress in done:
+                    yield next_progress.result()
+                    next_progress = asyncio.ensure_future(self._queue.get())
+                if next_event in done:
+                    try:
+                        event = next_event.result()
+                    except StopAsyncIteration:
+                        break
+                    for payload in self._drain():
+                        yield payload
+                    yield event
+                    next_event = asyncio.ensure_future(iterator.__anext__())
+        finally:
+            next_event.cancel()
+            # A progress payload may have been taken off the queue while an event was yielded
+            leftover = next_progress.result() if next_progress.done() else None
+            next_progress.cancel()
+        if leftover is not None:
+            yield leftover
+        for payload in self._drain():
+            yield payload
@@ -1,9 +1,13 @@
+import asyncio
+import hashlib
+import time
+from collections import OrderedDict
 from fastapi import HTTPException, Security
 from fastapi.security import HTTPAuthorizationCredentials
 from firebase_admin import auth
 from pydantic import BaseModel
 from fastapi.security import HTTPBearer
-from typing import List, Callable
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
 from fastapi import Depends, Request
 
 
@@ -25,35 +29,89 @@ class Token(BaseModel):
 
 
 
+# LRU caches of (token exp, value). Verified ID tokens are keyed by a hash of the token,
+# user records for tokens without a roles claim by (uid, token exp)
+_verified_tokens: "OrderedDict[str, Tuple[float, FirebaseUser]]" = OrderedDict()
+_user_records: "OrderedDict[Tuple[str, float], Tuple[float, auth.UserRecord]]" = OrderedDict()
+_MAX_CACHED_TOKENS = 1024
+
+
+def _cache_get(cache: OrderedDict, key: Hashable) -> Optional[Any]:
+    """The cached value, or None when it is missing or its token has expired (the entry is dropped)."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry[0] <= time.time():
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return entry[1]
+
+
+def _cache_put(cache: OrderedDict, key: Hashable, exp: float, value: Any) -> None:
+    """Stores the value until exp, evicting the least recently used entries past _MAX_CACHED_TOKENS."""
+    cache[key] = (exp, value)
+    cache.move_to_end(key)
+    while len(cache) > _MAX_CACHED_TOKENS:
+        cache.popitem(last=False)
+
+
+async def _build_firebase_user(decoded_token: Dict[str, Any]) -> FirebaseUser:
+    """
+    Creates the FirebaseUser for a verified token.
+
+    Custom claims are embedded in the ID token, so roles come from the token when it
+    carries them. Only tokens without a roles claim fall back to one user record
+    lookup per uid and token lifetime.
+    """
+    uid = decoded_token['uid']
+    if 'roles' in decoded_token:
+        return FirebaseUser(
+            uid=uid,
+            email=decoded_token.get('email', ''),
+            roles=decoded_token.get('roles') or [],
+            name=decoded_token.get('name', ''),
+        )
+
+    exp = float(decoded_token['exp'])
+    user = _cache_get(_user_records, (uid, exp))
+    if user is None:
+        user = await asyncio.to_thread(auth.get_user, uid)
+        _cache_put(_user_records, (uid, exp), exp, user)
+
+    # Check email
+    email = user.email if user.email else decoded_token.get('email', '')
+    name = user.display_name if user.display_name else decoded_token.get('name', '')
+
+    # Get custom claims
+    custom_claims = user.custom_claims or {}
+    roles = custom_claims.get('roles', [])
+    return FirebaseUser(uid=uid, email=email, roles=roles, name=name)
+
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)) -> FirebaseUser:
     """
     Validate Firebase ID token and verify the user has access to the resource
+
+    Verified tokens are cached until they expire, so repeat requests with the same
+    token skip verification and the user lookup entirely.
     """
     try:
         # The token comes in the format "Bearer <token>"
         token = credentials.credentials
-        # Verify the token with Firebase Admin SDK
-        decoded_token = auth.verify_id_token(token)
-        
-        # Get user claims to check
-        uid = decoded_token['uid']
-        user = auth.get_user(uid)
-        
-        # Check email
-        email = user.email if user.email else decoded_token.get('email', '')
-        name = user.display_name if user.display_name else decoded_token.get('name', '')
-        
-        # Get custom claims
-        custom_claims = user.custom_claims or {}
-        roles = custom_claims.get('roles', [])
-        # Create user object
-        firebase_user = FirebaseUser(uid=uid, email=email, roles=roles, name=name)
-
-        print(firebase_user)
-        
-            
+        token_key = hashlib.sha256(token.encode()).hexdigest()
+
+        cached = _cache_get(_verified_tokens, token_key)
+        if cached is not None:
+            return cached
+
+        # Verify the token with Firebase Admin SDK, off the event loop as it may fetch certificates
+        decoded_token = await asyncio.to_thread(auth.verify_id_token, token)
+        firebase_user = await _build_firebase_user(decoded_token)
+
+        _cache_put(_verified_tokens, token_key, float(decoded_token['exp']), firebase_user)
         return firebase_user
-        
+
     except auth.RevokedIdTokenError:
         raise HTTPException(status_code=401, detail="Firebase ID token has been revoked. Please sign in again.")
     except auth.ExpiredIdTokenError:
@@ -71,35 +129,23 @@ def role_based_access(required_roles: List[str]) -> Callable:
     async def check_role(request: Request, current_user: FirebaseUser = Depends(get_current_user)) -> None:
         """
         Dependency that checks if the user has the required roles in their custom claims.
+
+        Uses the roles resolved by `get_current_user`, so no extra Firebase call is made.
         """
-        try:
-            user = auth.get_user(current_user.uid)
-            custom_claims = user.custom_claims or {}
-            roles = custom_claims.get('roles', [])
-
-            # Check if all required roles are present
-            missing_roles = [role for role in required_roles if role not in roles]
-
-            # If user has developer role, grant access to all roles
-            if "developer" in roles:
-                missing_roles = []
-
-            if missing_roles:
-                raise HTTPException(
-                    status_code=403,
-                    detail=f"User does not have the required roles: {', '.join(missing_roles)}"
-                )
-            # Store the user in the request state so it can be accessed in endpoints
-            request.state.user = current_user
-
-        except auth.UserNotFoundError:
-            raise HTTPException(
-                status_code=404,
-                detail="User not found"
-            )
-        except Exception as e:
+        roles = current_user.roles
+
+        # Check if all required roles are present
+        missing_roles = [role for role in required_roles if role not in roles]
+
+        # If user has developer role, grant access to all roles
+        if "developer" in roles:
+            missing_roles = []
+
+        if missing_roles:
             raise HTTPException(
-                status_code=500,
-                detail=f"Error retrieving user claims: {str(e)}"
+                status_code=403,
+                detail=f"User does not have the required roles: {', '.join(missing_roles)}"
             )
-    return check_role
\ No newline at end of file
+        # Store the user in the request state so it can be accessed in endpoints
+        request.state.user = current_user
+    return check_role
@@ -0,0 +1,262 @@
+import asyncio
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Returned by a fetch function when Graph answered 304 Not Modified to If-None-Match
+NOT_MODIFIED: Dict[str, Any] = {}
+
+GraphResult = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+# (name, path pattern, ttl seconds), first match wins. Paths are relative to /v1.0.
+DEFAULT_TTL_RULES: List[Tuple[str, str, int]] = [
+    ("delta", r"^/(users|groups)/delta", 0),  # Delta links are single-use
+    ("subscribedSkus", r"^/subscribedskus", 3600),
+    ("channels", r"^/teams/[^/]+/channels", 120),
+    ("collections", r"^/(users|groups|teams)$", 120),
+    ("user", r"^/users/[^/]+$", 120),
+    ("members", r"^/(teams|groups)/[^/]+/members", 60),
+]
+
+# (write pattern, TTL rules it also drops), for writes that change resources outside
+# their own path. Patterns are matched against "METHOD /path".
+DEFAULT_DEPENDENT_RULES: List[Tuple[str, List[str]]] = [
+    # Assigning, removing or freeing licenses changes the SKUs' consumed units
+    (r"^POST /users/[^/]+/assignlicense$", ["subscribedSkus"]),
+    (r"^DELETE /users/[^/]+$", ["subscribedSkus"]),
+]
+
+
+class _CacheEntry:
+    __slots__ = ("path", "rule", "response", "etag", "expires_at")
+
+    def __init__(self, path: str, rule: str, response: Dict[str, Any], ttl: int) -> None:
+        self.path = path
+        self.rule = rule
+        self.response = response
+        self.etag = response.get("@odata.etag")
+        self.expires_at = time.monotonic() + ttl
+
+
+class _Flight:
+    """A GET in progress that other threads asking for the same key wait on."""
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: GraphResult = (None, None)
+        # Set when the owner's fetch raised, waiters then fetch for themselves
+        self.failed = False
+
+
+class GraphCache:
+    """
+    Cache for Graph GET responses, keyed by tenant and URL.
+
+    Entries live for a per-endpoint TTL. Expired entries that carried an @odata.etag
+    are revalidated with If-None-Match instead of refetched. Concurrent identical GETs
+    share one request (singleflight), and a successful write drops every entry on the
+    written resource, its parent collection and anything beneath them, plus the entries
+    of any TTL rule its dependent rules name.
+
+    Cached responses are shared between callers and must be treated as read-only.
+    """
+
+    def __init__(
+        self,
+        tenant: Optional[str],
+        base_url: str,
+        ttl_rules: List[Tuple[str, str, int]] = DEFAULT_TTL_RULES,
+        dependent_rules: List[Tuple[str, List[str]]] = DEFAULT_DEPENDENT_RULES,
+        default_ttl: int = 60,
+        max_entries: int = 2048,
+    ) -> None:
+        self.tenant = tenant
+        self.base_url = base_url
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self._rules = [(name, re.compile(pattern), ttl) for name, pattern, ttl in ttl_rules]
+        self._dependent_rules = [(re.compile(pattern), set(rules)) for pattern, rules in dependent_rules]
+        self._entries: "OrderedDict[Tuple[Optional[str], str], _CacheEntry]" = OrderedDict()
+        self._flights: Dict[Tuple[Optional[str], str], _Flight] = {}
+        self._async_flights: Dict[Tuple[Optional[str], str], "asyncio.Future[Optional[GraphResult]]"] = {}
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, int]] = {}
+        # Bumped by every invalidation, so a fetch that raced a write is not stored
+        self._generation = 0
+
+    def _path(self, url: str) -> str:
+        path = url[len(self.base_url):] if url.startswith(self.base_url) else url
+        return path.split("?", 1)[0].rstrip("/").lower()
+
+    def _rule_for(self, path: str) -> Tuple[str, int]:
+        for name, pattern, ttl in self._rules:
+            if pattern.search(path):
+                return name, ttl
+        return "default", self.default_ttl
+
+    def _count(self, rule: str, counter: str) -> None:
+        counters = self._stats.setdefault(
+            rule, {"hits": 0, "misses": 0, "revalidated": 0, "shared": 0, "invalidated": 0}
+        )
+        counters[counter] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per TTL rule plus totals, for tuning the TTLs."""
+        with self._lock:
+            by_rule = {rule: dict(counters) for rule, counters in self._stats.items()}
+            entries = len(self._entries)
+        totals: Dict[str, int] = {}
+        for counters in by_rule.values():
+            for counter, value in counters.items():
+                totals[counter] = totals.get(counter, 0) + value
+        return {"entries": entries, "totals": totals, "rules": by_rule}
+
+    def _lookup(self, url: str) -> Tuple[Tuple[Optional[str], str], str, int, Optional[_CacheEntry]]:
+        """Returns (key, rule, ttl, entry) where entry is the cached one, fresh or not."""
+        path = self._path(url)
+        rule, ttl = self._rule_for(path)
+        key = (self.tenant, url)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return key, rule, ttl, entry
+
+    def _store(
+        self, key: Tuple[Optional[str], str], rule: str, ttl: int,
+        stale: Optional[_CacheEntry], generation: int, result: GraphResult,
+    ) -> GraphResult:
+        """Records a fetch result, returns what the caller should see."""
+        response, error = result
+        with self._lock:
+            if error is None and response is NOT_MODIFIED and stale is not None:
+                self._count(rule, "revalidated")
+                stale.expires_at = time.monotonic() + ttl
+                return stale.response, None
+            if (
+                error is None
+                and response is not None
+                and response is not NOT_MODIFIED
+                and generation == self._generation
+            ):
+                self._entries[key] = _CacheEntry(self._path(key[1]), rule, response, ttl)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        if response is NOT_MODIFIED:
+            # A 304 without anything cached to serve, should not happen
+            return None, {"error": "Not Modified without a cached response", "status_code": 304}
+        return result
+
+    def fetch(self, url: str, fetch: Callable[[Optional[str]], GraphResult]) -> GraphResult:
+        """
+        Returns the cached response for a GET, or runs fetch(etag) once for all callers.
+
+        Args:
+            url: The absolute Graph URL being read.
+            fetch: Performs the GET, sending If-None-Match when given an etag.
+        """
+        with self._lock:
+            key, rule, ttl, entry = self._lookup(url)
+            generation = self._generation
+            if ttl <= 0:
+                flight = None
+            elif entry is not None and entry.expires_at > time.monotonic():
+                self._count(rule, "hits")
+                return entry.response, None
+            else:
+                flight = self._flights.get(key)
+                owner = flight is None
+                if owner:
+                    self._count(rule, "misses")
+                    flight = self._flights[key] = _Flight()
+                else:
+                    self._count(rule, "shared")
+        if flight is None:
+            return fetch(None)
+        if not owner:
+            flight.done.wait()
+            if flight.failed:
+                return self.fetch(url, fetch)
+            return flight.result
+
+        try:
+            flight.result = self._store(key, rule, ttl, entry, generation, fetch(entry.etag if entry else None))
+        except BaseException:
+            # Waiters retry on their own rather than inherit this caller's failure
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+        return flight.result
+
+    async def fetch_async(
+        self, url: str, fetch: Callable[[Optional[str]], Awaitable[GraphResult]]
+    ) -> GraphResult:
+        """Async version of `fetch`, concurrent callers await the same future."""
+        with self._lock:
+            key, rule, ttl, entry = self._lookup(url)
+            generation = self._generation
+            if ttl <= 0:
+                future = None
+            elif entry is not None and entry.expires_at > time.monotonic():
+                self._count(rule, "hits")
+                return entry.response, None
+            else:
+                future = self._async_flights.get(key)
+                owner = future is None
+                if owner:
+                    self._count(rule, "misses")
+                    future = self._async_flights[key] = asyncio.get_running_loop().create_future()
+                else:
+                    self._count(rule, "shared")
+        if future is None:
+            return await fetch(None)
+        if not owner:
+            shared = await asyncio.shield(future)
+            # None when the owner's fetch raised, see below
+            return shared if shared is not None else await self.fetch_async(url, fetch)
+
+        try:
+            result = self._store(key, rule, ttl, entry, generation, await fetch(entry.etag if entry else None))
+        except BaseException:
+            # Waiters retry on their own rather than inherit this caller's failure
+            future.set_result(None)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                self._async_flights.pop(key, None)
+        return result
+
+    def invalidate_for_write(self, method: str, url: str) -> None:
+        """
+        Write listener, drops entries on the written resource's parent, its subtree and
+        ancestors, and those of the TTL rules a matching dependent rule names.
+        """
+        path = self._path(url)
+        scope = path.rsplit("/", 1)[0] if path.count("/") > 1 else path
+        write = f"{method.upper()} {path}"
+        dependent = set().union(
+            *(rules for pattern, rules in self._dependent_rules if pattern.search(write))
+        )
+        with self._lock:
+            self._generation += 1
+            stale_keys = [
+                key
+                for key, entry in self._entries.items()
+                if entry.path == scope
+                or entry.path.startswith(scope + "/")
+                or scope.startswith(entry.path + "/")
+                or entry.rule in dependent
+            ]
+            for key in stale_keys:
+                self._count(self._entries[key].rule, "invalidated")
+                del self._entries[key]
+        if stale_keys:
+            logging.debug(f"Graph cache dropped {len(stale_keys)} entries after {method} {url}")
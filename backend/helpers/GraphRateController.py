@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+GraphResult = Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]
+
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 60.0
+MAX_RETRY_AFTER_SECONDS = 120.0
+
+# Statuses that mean Graph did not process the request, safe to retry for any method
+_THROTTLE_STATUSES = (429, 503)
+# Only retried for reads, a write may already have been applied
+_READ_RETRY_STATUSES = (502, 504, None)
+
+
+def retry_after_seconds(error: Dict[str, Any]) -> Optional[float]:
+    """Reads Retry-After (in seconds) from an error dict's headers, None when absent."""
+    for key, value in (error.get("headers") or {}).items():
+        if key.lower() == "retry-after":
+            try:
+                return min(MAX_RETRY_AFTER_SECONDS, max(0.0, float(value)))
+            except (TypeError, ValueError):
+                return None
+    return None
+
+
+class GraphRateController:
+    """
+    Shared limit on in-flight Graph requests for one tenant, with throttle-aware retries.
+
+    The limit follows AIMD: every successful request adds 1/limit (about +1 per
+    round of requests), every throttled one halves it. A Retry-After pauses every
+    new request for the tenant, not only the one that was throttled.
+    """
+
+    def __init__(self, initial_limit: float = 8, min_limit: float = 1, max_limit: float = 32) -> None:
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self._limit = float(initial_limit)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._condition = threading.Condition()
+        self._async_waiters: List[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = []
+
+    @property
+    def limit(self) -> int:
+        return max(int(self._limit), 1)
+
+    def _wait_time(self) -> Optional[float]:
+        """None when a slot is free now, else how long to wait (0 means until a release)."""
+        pause = self._paused_until - time.monotonic()
+        if pause > 0:
+            return pause
+        return None if self._in_flight < self.limit else 0.0
+
+    def _wake_async_waiters(self) -> None:
+        waiters, self._async_waiters = self._async_waiters, []
+        for loop, future in waiters:
+            loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def _release(self, throttled_for: Optional[float], succeeded: bool) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            if throttled_for is not None:
+                self._limit = max(self.min_limit, self._limit / 2)
+                self._paused_until = max(self._paused_until, time.monotonic() + throttled_for)
+                logging.warning(
+                    f"Graph throttled, concurrency limit now {self.limit}, pausing {throttled_for:.1f}s"
+                )
+            elif succeeded:
+                self._limit = min(self.max_limit, self._limit + 1 / self._limit)
+            self._condition.notify_all()
+            self._wake_async_waiters()
+
+    def record_throttle(self, retry_after: float) -> None:
+        """Reports throttling seen outside `run`, e.g. inside a $batch response."""
+        with self._condition:
+            self._in_flight += 1
+        self._release(retry_after, succeeded=False)
+
+    def _acquire(self) -> None:
+        with self._condition:
+            while (wait := self._wait_time()) is not None:
+                self._condition.wait(timeout=wait or None)
+            self._in_flight += 1
+
+    async def _acquire_async(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                wait = self._wait_time()
+                if wait is None:
+                    self._in_flight += 1
+                    return
+                future = loop.create_future()
+                self._async_waiters.append((loop, future))
+            try:
+                await asyncio.wait_for(future, timeout=wait or None)
+            except asyncio.TimeoutError:
+                pass
+
+    def _next_delay(self, method: str, result: GraphResult, attempt: int) -> Optional[float]:
+        """Seconds to wait before retrying, or None when the result should be returned."""
+        _, error = result
+        if not error or attempt + 1 >= MAX_ATTEMPTS:
+            return None
+        status = error.get("status_code")
+        if status not in _THROTTLE_STATUSES and not (
+            method.upper() == "GET" and status in _READ_RETRY_STATUSES
+        ):
+            return None
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None:
+            return retry_after
+        # Full jitter keeps many waiting workers from retrying in lockstep
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2**attempt))
+
+    def _finish(self, method: str, result: GraphResult, attempt: int) -> Optional[float]:
+        """Releases the slot, feeding the outcome to AIMD, and returns the retry delay."""
+        delay = self._next_delay(method, result, attempt)
+        error = result[1]
+        throttled_for = None
+        if error and error.get("status_code") in _THROTTLE_STATUSES:
+            throttled_for = delay if delay is not None else (retry_after_seconds(error) or 0.0)
+        self._release(throttled_for, succeeded=error is None)
+        return delay
+
+    def run(self, method: str, send: Callable[[], GraphResult]) -> GraphResult:
+        """
+        Sends a request within the tenant's concurrency limit, retrying throttled ones.
+
+        Args:
+            method: The HTTP method, writes are only retried when Graph throttled them.
+            send: Performs the request once, returning make_request's (json, error).
+
+        Returns:
+            tuple: The first non-retryable result, or the last one once attempts run out.
+        """
+        for attempt in range(MAX_ATTEMPTS):
+            self._acquire()
+            result: GraphResult = (None, None)
+            try:
+                result = send()
+            finally:
+                delay = self._finish(method, result, attempt)
+            if delay is None:
+                return result
+            logging.warning(
+                f"Graph {method} returned {result[1].get('status_code')}, "
+                f"retrying in {delay:.1f}s (attempt {attempt + 2}/{MAX_ATTEMPTS})"
+            )
+            time.sleep(delay)
+        return result
+
+    async def run_async(self, method: str, send: Callable[[], Awaitable[GraphResult]]) -> GraphResult:
+        """Async version of `run`."""
+        for attempt in range(MAX_ATTEMPTS):
+            await self._acquire_async()
+            result: GraphResult = (None, None)
+            try:
+                result = await send()
+            finally:
+                delay = self._finish(method, result, attempt)
+            if delay is None:
+                return result
+            logging.warning(
+                f"Graph {method} returned {result[1].get('status_code')}, "
+                f"retrying in {delay:.1f}s (attempt {attempt + 2}/{MAX_ATTEMPTS})"
+            )
+            await asyncio.sleep(delay)
+        return result
+
+
+_controllers: Dict[Optional[str], GraphRateController] = {}
+_controllers_lock = threading.Lock()
+
+
+def get_rate_controller(tenant: Optional[str]) -> GraphRateController:
+    """Returns the process-wide rate controller for a tenant."""
+    with _controllers_lock:
+        controller = _controllers.get(tenant)
+        if controller is None:
+            controller = _controllers[tenant] = GraphRateController()
+        return controller
@@ -0,0 +1,173 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+
+# Refresh this long before the token expires, callers keep the old token meanwhile
+REFRESH_MARGIN_SECONDS = 300
+
+_SHARED_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS graph_token (
+    tenant_id TEXT NOT NULL,
+    client_id TEXT NOT NULL,
+    access_token TEXT NOT NULL,
+    expires_at REAL NOT NULL,
+    PRIMARY KEY (tenant_id, client_id)
+)
+"""
+
+
+class GraphTokenManager:
+    """
+    Client-credentials token for Microsoft Graph, refreshed on demand.
+
+    The token is refreshed by whichever caller first finds it within
+    REFRESH_MARGIN_SECONDS of expiry, others keep using the current token until it
+    actually expires and only then wait for that refresh (single-flight, no timers).
+
+    With `shared_cache_path` set, the token is also stored in a small SQLite file and
+    refreshed under its write lock, so uvicorn workers on the same machine reuse one
+    token instead of each fetching their own.
+    """
+
+    def __init__(
+        self,
+        tenant_id: Optional[str],
+        client_id: Optional[str],
+        client_secret: Optional[str],
+        shared_cache_path: Optional[str] = None,
+    ) -> None:
+        self.tenant_id = tenant_id
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.shared_cache_path = shared_cache_path
+        self._token: Optional[str] = None
+        self._headers: Dict[str, str] = {}
+        self._expires_at = 0.0
+        self._lock = threading.Lock()
+
+    def _needs_refresh(self) -> bool:
+        return time.time() >= self._expires_at - REFRESH_MARGIN_SECONDS
+
+    def _is_expired(self) -> bool:
+        return time.time() >= self._expires_at
+
+    def _use(self, token: str, expires_at: float) -> None:
+        self._token = token
+        self._headers = {
+            "Authorization": f"Bearer {token}",
+            "Content-Type": "application/json",
+        }
+        self._expires_at = expires_at
+
+    def get_headers(self) -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, Any]]]:
+        """
+        Returns request headers carrying a valid token, refreshing it if needed.
+
+        Returns:
+            tuple: (headers, None) on success, or (None, error_details) when no valid
+                   token could be obtained.
+        """
+        if not self._needs_refresh():
+            return self._headers, None
+
+        if not self._is_expired():
+            # Still valid, refresh only if nobody else already is
+            if not self._lock.acquire(blocking=False):
+                return self._headers, None
+        else:
+            self._lock.acquire()
+
+        try:
+            if not self._needs_refresh():
+                return self._headers, None
+            error = self._refresh()
+            if error and self._is_expired():
+                return None, error
+            return self._headers, None
+        finally:
+            self._lock.release()
+
+    async def get_headers_async(self) -> Tuple[Optional[Dict[str, str]], Optional[Dict[str, Any]]]:
+        """Async version of `get_headers`, the refresh itself runs in a thread."""
+        if not self._needs_refresh():
+            return self._headers, None
+        return await asyncio.to_thread(self.get_headers)
+
+    def _refresh(self) -> Optional[Dict[str, Any]]:
+        if not self.shared_cache_path:
+            return self._fetch_and_use()
+
+        try:
+            connection = sqlite3.connect(self.shared_cache_path, timeout=30, isolation_level=None)
+        except sqlite3.Error as e:
+            logging.warning(f"Shared token cache unavailable, fetching a token directly: {e}")
+            return self._fetch_and_use()
+
+        try:
+            connection.execute(_SHARED_CACHE_SCHEMA)
+            # Take the write lock first so only one worker fetches a token at a time
+            connection.execute("BEGIN IMMEDIATE")
+            row = connection.execute(
+                "SELECT access_token, expires_at FROM graph_token WHERE tenant_id = ? AND client_id = ?",
+                (self.tenant_id, self.client_id),
+            ).fetchone()
+            if row and time.time() < row[1] - REFRESH_MARGIN_SECONDS:
+                logging.info("Using Graph token refreshed by another worker.")
+                self._use(row[0], row[1])
+                connection.execute("COMMIT")
+                return None
+
+            error = self._fetch_and_use()
+            if error is None:
+                connection.execute(
+                    "INSERT OR REPLACE INTO graph_token (tenant_id, client_id, access_token, expires_at) "
+                    "VALUES (?, ?, ?, ?)",
+                    (self.tenant_id, self.client_id, self._token, self._expires_at),
+                )
+            connection.execute("COMMIT")
+            return error
+        except sqlite3.Error as e:
+            logging.warning(f"Shared token cache failed, fetching a token directly: {e}")
+            return None if not self._needs_refresh() else self._fetch_and_use()
+        finally:
+            connection.close()
+
+    def _fetch_and_use(self) -> Optional[Dict[str, Any]]:
+        """Requests a new client-credentials token from Entra ID."""
+        token_url = f"https://login.microsoftonline.com/{self.tenant_id}/oauth2/v2.0/token"
+        token_data = {
+            "grant_type": "client_credentials",
+            "client_id": self.client_id,
+            "client_secret": self.client_secret,
+            "scope": "https://graph.microsoft.com/.default",
+        }
+
+        try:
+            response = requests.post(token_url, data=token_data, timeout=30)
+            response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
+            data = response.json()
+            token = data.get("access_token")
+            expires_in = data.get("expires_in")  # Get token lifetime
+
+            if not token:
+                logging.error("Failed to get token: " + response.text)
+                return {"error": "Failed to get token", "details": response.text}
+
+            self._use(token, time.time() + int(expires_in))
+            logging.info("Token refreshed successfully.")
+            return None
+
+        except requests.exceptions.RequestException as e:
+            logging.error(f"Request failed: {e}")
+            return {"error": "Failed to refresh token", "details": str(e)}
+        except Exception as e:
+            logging.exception("An unexpected error occurred during token refresh.")
+            return {
+                "error": "Unexpected error during token refresh",
+                "details": str(e),
+            }
@@ -0,0 +1,629 @@
+import builtins
+import contextlib
+import io
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import types
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, TextIO, Tuple
+
+try:
+    import resource
+except ImportError:  # Unavailable on Windows, workers then only have the wall-clock limit
+    resource = None
+
+InterpreterResult = Tuple[Optional[str], Optional[Dict[str, Any]]]
+# Runs once per worker, may return names every snippet's namespace starts with
+Initializer = Callable[[], Optional[Dict[str, Any]]]
+
+# A snippet's stdout is sent to the server in chunks of about this size, and at least
+# this often while it prints, so long runs show their progress
+_OUTPUT_CHUNK_CHARS = 4096
+_OUTPUT_FLUSH_SECONDS = 0.1
+
+# Set in worker processes, everything sent to the server goes through _send_to_server
+_worker_conn = None
+_worker_send_lock = threading.Lock()
+
+
+def _send_to_server(message: Tuple[str, Any]) -> None:
+    with _worker_send_lock:
+        _worker_conn.send(message)
+
+
+# Held for a request and its reply, so concurrent callers in a snippet get their own reply
+_worker_call_lock = threading.Lock()
+
+
+def in_worker() -> bool:
+    """Whether this code runs in an interpreter worker process."""
+    return _worker_conn is not None
+
+
+def notify_server(payload: Any) -> None:
+    """
+    Hands payload to the pool's `on_notice` callback in the server process.
+
+    Meant for code running in a worker, e.g. to report a Graph write so the server drops
+    what it cached. Does nothing outside a worker.
+    """
+    if _worker_conn is not None:
+        _send_to_server(("notice", payload))
+
+
+def call_server(payload: Any) -> Any:
+    """
+    Passes payload to the pool's `on_notice` callback in the server and returns its result.
+
+    For worker code that needs state only the server has, e.g. stored tool results.
+    Raises RuntimeError outside a worker or when the callback failed.
+    """
+    if _worker_conn is None:
+        raise RuntimeError("call_server only works in an interpreter worker")
+    with _worker_call_lock:
+        _send_to_server(("request", payload))
+        ok, value = _worker_conn.recv()
+    if not ok:
+        raise RuntimeError(value)
+    return value
+
+
+def _statm(field: int) -> Optional[int]:
+    """A /proc/self/statm field in bytes (0: virtual size, 1: resident), None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[field]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _limit_memory(memory_bytes: int) -> None:
+    # On top of what the warmed-up worker already maps, imports are not charged to snippets
+    current = _statm(0)
+    if resource is None or current is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = current + memory_bytes
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+
+
+def _limit_cpu(cpu_seconds: Optional[int]) -> None:
+    """Lets the worker use cpu_seconds more CPU time before the kernel stops it, None lifts the limit."""
+    if resource is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    if cpu_seconds is None:
+        resource.setrlimit(resource.RLIMIT_CPU, (hard, hard))
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    soft = int(usage.ru_utime + usage.ru_stime) + 1 + cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+
+def _new_namespace(predefined: Dict[str, Any]) -> Dict[str, Any]:
+    return {**predefined, "__name__": "__main__", "__builtins__": builtins}
+
+
+class _StreamedOutput(io.TextIOBase):
+    """A snippet's stdout, sent to the server as ("output", text) messages while it runs."""
+
+    def __init__(self, max_chars: int) -> None:
+        self._max_chars = max_chars
+        self._pending: List[str] = []
+        self._pending_chars = 0
+        self.written = 0
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        # A print followed by a long computation is sent without waiting for the next print
+        self._flusher = threading.Thread(target=self._flush_periodically, daemon=True)
+        self._flusher.start()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if not isinstance(text, str):
+            raise TypeError(f"write() argument must be str, not {type(text).__name__}")
+        with self._lock:
+            # Past max_chars output is only counted, it would flood the pipe and the chat
+            kept = text[: max(0, self._max_chars - self.written)]
+            self.written += len(text)
+            if kept:
+                self._pending.append(kept)
+                self._pending_chars += len(kept)
+            if self._pending_chars >= _OUTPUT_CHUNK_CHARS:
+                self._send()
+        return len(text)
+
+    def _send(self) -> None:
+        if self._pending:
+            chunk = "".join(self._pending)
+            self._pending = []
+            self._pending_chars = 0
+            _send_to_server(("output", chunk))
+
+    def flush(self) -> None:
+        with self._lock:
+            self._send()
+
+    def _flush_periodically(self) -> None:
+        while not self._done.wait(_OUTPUT_FLUSH_SECONDS):
+            self.flush()
+
+    def close(self) -> None:
+        self._done.set()
+        self._flusher.join()
+        super().close()
+
+    @property
+    def omitted(self) -> int:
+        """Characters written past max_chars, which were not sent."""
+        return max(0, self.written - self._max_chars)
+
+
+def _execute(code: str, cpu_seconds: int, namespace: Dict[str, Any], stdout: TextIO) -> Optional[Dict[str, Any]]:
+    """Runs one snippet in namespace, printing to stdout, returns error details if it failed."""
+    stderr = io.StringIO()
+    _limit_cpu(cpu_seconds)
+    try:
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            exec(compile(code, "<interpreter>", "exec"), namespace)
+    except (Exception, SystemExit) as e:
+        details = f"{type(e).__name__}: {e}" if str(e) else type(e).__name__
+        return {"error": "Execution error", "details": details}
+    finally:
+        _limit_cpu(None)
+
+    error_output = stderr.getvalue()
+    if error_output:
+        return {"error": "Code execution produced errors", "details": error_output}
+    return None
+
+
+def _describe(namespace: Dict[str, Any], predefined: Dict[str, Any]) -> Dict[str, Any]:
+    """The variables a session holds, with their type and size, and the worker's memory use."""
+    variables = []
+    for name, value in namespace.items():
+        if name.startswith("__") or isinstance(value, types.ModuleType):
+            continue
+        if name in predefined and predefined[name] is value:
+            continue
+        variable = {"name": name, "type": type(value).__name__}
+        try:
+            variable["length"] = len(value)
+        except TypeError:
+            pass
+        variables.append(variable)
+    resident = _statm(1)
+    return {
+        "variables": variables,
+        "memory_mb": round(resident / (1024 * 1024), 1) if resident is not None else None,
+    }
+
+
+def _worker_main(conn, initializer: Optional[Initializer], memory_bytes: int) -> None:
+    """
+    Entry point of a worker process: warm up once, then run snippets until told to stop.
+
+    Every job is answered with ("done", reply), a run first sends its output as
+    ("output", text) messages, `notify_server` payloads as ("notice", payload) and
+    `call_server` payloads as ("request", payload), which the server answers. A run's reply is (omitted, error), where omitted counts
+    the output characters that were over the limit and not sent.
+    """
+    global _worker_conn
+
+    # Ctrl+C on the server reaches the whole process group, the parent stops workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_conn = conn
+    predefined: Dict[str, Any] = {}
+    if initializer is not None:
+        try:
+            predefined = initializer() or {}
+        except Exception:
+            logging.exception("Interpreter worker warm-up failed")
+    _limit_memory(memory_bytes)
+
+    # Variables kept between snippets when the worker backs a session
+    session: Dict[str, Any] = _new_namespace(predefined)
+    while True:
+        try:
+            job = conn.recv()
+        except EOFError:
+            return
+        if job is None:
+            return
+        command, args = job
+        if command == "variables":
+            _send_to_server(("done", _describe(session, predefined)))
+            continue
+        code, cpu_seconds, persistent, max_output_chars = args
+        stdout = _StreamedOutput(max_output_chars)
+        error = _execute(code, cpu_seconds, session if persistent else _new_namespace(predefined), stdout)
+        stdout.close()
+        _send_to_server(("done", (stdout.omitted, error)))
+
+
+class _Worker:
+    def __init__(self, context, initializer: Optional[Initializer], memory_bytes: int) -> None:
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, initializer, memory_bytes),
+            name="interpreter-worker",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.runs = 0
+
+    def close(self) -> None:
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join(timeout=1)
+        self.conn.close()
+
+    def kill(self) -> Optional[int]:
+        """Stops the process right away, returns its exit code."""
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+        return self.process.exitcode
+
+
+class _Session:
+    __slots__ = ("worker", "lock", "last_used", "closed")
+
+    def __init__(self) -> None:
+        self.worker: Optional[_Worker] = None
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+        self.closed = False
+
+
+class InterpreterPool:
+    """
+    Pre-started worker processes that run interpreter snippets.
+
+    Each snippet runs alone in a worker, so its output is captured per execution and it
+    never holds the server's GIL. A worker is killed (and replaced) when a snippet passes
+    `timeout_seconds` of wall-clock time, `cpu_seconds` of CPU time (RLIMIT_CPU) or
+    allocates more than `memory_mb` (RLIMIT_AS), and recycled after `max_runs` snippets.
+
+    Snippets run with a session id share one namespace: the session gets a worker of its
+    own that keeps its variables between snippets, so `memory_mb` caps each session. At
+    most `max_sessions` are kept, the least recently used is closed first, and sessions
+    idle for `session_idle_seconds` are closed by a background sweep.
+
+    A snippet's stdout is streamed to the server while it runs, see `run`. Output past
+    `max_output_chars` is dropped in the worker and only reported by its size.
+
+    Workers are started with the "spawn" method, forking the server would copy its event
+    loop and threads. `initializer` runs once in every new worker, e.g. to import the
+    tool modules snippets use and fetch a Graph token, so snippets start warm. The names
+    in the dict it returns are predefined in every snippet's namespace. Worker code can
+    reach the server process with `notify_server` and `call_server`, whose payloads are
+    passed to `on_notice` along with the owner the snippet was run for. For `call_server`
+    its return value is sent back. The owner is added here in the server, a snippet
+    cannot claim to run for someone else.
+    """
+
+    def __init__(
+        self,
+        size: int = 2,
+        max_runs: int = 50,
+        timeout_seconds: float = 30,
+        cpu_seconds: int = 30,
+        memory_mb: int = 1024,
+        initializer: Optional[Initializer] = None,
+        max_sessions: int = 8,
+        session_idle_seconds: float = 900,
+        max_output_chars: int = 10_000_000,
+        on_notice: Optional[Callable[[Any, Optional[str]], Any]] = None,
+    ) -> None:
+        self.size = size
+        self.max_runs = max_runs
+        self.timeout_seconds = timeout_seconds
+        self.cpu_seconds = cpu_seconds
+        self.memory_bytes = memory_mb * 1024 * 1024
+        self.initializer = initializer
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: List[_Worker] = []
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(size)
+        self._closed = False
+        self.max_sessions = max_sessions
+        self.session_idle_seconds = session_idle_seconds
+        self.max_output_chars = max_output_chars
+        self.on_notice = on_notice
+        self._sessions: "OrderedDict[str, _Session]" = OrderedDict()
+        self._stopping = threading.Event()
+        self._sweeper: Optional[threading.Thread] = None
+
+    def _spawn(self) -> _Worker:
+        return _Worker(self._context, self.initializer, self.memory_bytes)
+
+    def start(self) -> None:
+        """Starts the workers ahead of the first snippet."""
+        with self._lock:
+            self._closed = False
+            while len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+            if self._sweeper is None:
+                self._stopping.clear()
+                self._sweeper = threading.Thread(
+                    target=self._sweep_idle_sessions, name="interpreter-session-sweeper", daemon=True
+                )
+                self._sweeper.start()
+
+    def stop(self) -> None:
+        """Stops the idle workers and sessions, busy ones are stopped when their snippet returns."""
+        self._stopping.set()
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+            self._sweeper = None
+        for worker in idle:
+            worker.close()
+        for session in sessions:
+            self._close_session(session)
+
+    def _checkout(self) -> _Worker:
+        with self._lock:
+            while self._idle:
+                worker = self._idle.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.kill()
+        return self._spawn()
+
+    def _checkin(self, worker: _Worker) -> None:
+        with self._lock:
+            keep = not self._closed and worker.runs < self.max_runs and worker.process.is_alive()
+            if keep:
+                self._idle.append(worker)
+        if not keep:
+            worker.close()
+            self._replace()
+
+    def _replace(self) -> None:
+        """Starts a worker in place of a retired one, so the next snippet finds a warm one."""
+        with self._lock:
+            if not self._closed and len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+
+    def _call(
+        self,
+        worker: _Worker,
+        job: Tuple[str, Any],
+        stdout: Optional[TextIO] = None,
+        owner: Optional[str] = None,
+    ) -> Tuple[Any, Optional[Dict[str, Any]]]:
+        """
+        Sends a job to a worker and waits for the reply, killing the worker if none comes in time.
+
+        Output the worker sends meanwhile is written to stdout as it arrives, notices and
+        requests are passed to on_notice with owner.
+        """
+        deadline = time.monotonic() + self.timeout_seconds
+        try:
+            worker.conn.send(job)
+            while True:
+                if not worker.conn.poll(max(0.0, deadline - time.monotonic())):
+                    worker.kill()
+                    return None, {
+                        "error": "Execution timeout",
+                        "details": f"Code execution exceeded {self.timeout_seconds:g} second timeout, "
+                        "the interpreter process was stopped",
+                    }
+                kind, message = worker.conn.recv()
+                if kind == "done":
+                    return message, None
+                if kind in ("notice", "request"):
+                    reply = self._handle_notice(message, owner)
+                    if kind == "request":
+                        worker.conn.send(reply)
+                elif stdout is not None:
+                    stdout.write(message)
+        except (EOFError, OSError):
+            return None, self._exit_error(worker.kill())
+
+    def _handle_notice(self, payload: Any, owner: Optional[str]) -> Tuple[bool, Any]:
+        """Runs on_notice for a worker's payload, returning (ok, result or error message)."""
+        if self.on_notice is None:
+            return False, "The interpreter pool has no notice handler"
+        try:
+            return True, self.on_notice(payload, owner)
+        except Exception as e:
+            logging.exception("Interpreter notice handler failed")
+            return False, f"{type(e).__name__}: {e}"
+
+    def _run_result(self, reply: Tuple[int, Optional[Dict[str, Any]]], stdout: TextIO) -> InterpreterResult:
+        omitted, error = reply
+        if error:
+            return None, error
+        if omitted:
+            stdout.write(
+                f"\n[{omitted} more characters of output were dropped, "
+                f"a snippet may print at most {self.max_output_chars}]\n"
+            )
+        return stdout.getvalue(), None
+
+    def run(
+        self,
+        code: str,
+        session_id: Optional[str] = None,
+        stdout: Optional[TextIO] = None,
+        owner: Optional[str] = None,
+    ) -> InterpreterResult:
+        """
+        Runs a snippet in a worker process.
+
+        Args:
+            code: The Python source to execute
+            session_id: Run in this session's namespace, e.g. a conversation id. Without
+                one the snippet starts from an empty namespace.
+            stdout: Receives the snippet's output in chunks while it runs, e.g. to stream
+                it to the user. Its getvalue() is the output returned. Defaults to a StringIO.
+            owner: Who the snippet runs for, e.g. a user id, passed to on_notice with the
+                snippet's `notify_server` and `call_server` payloads
+
+        Returns:
+            tuple: (output, error) where output is the snippet's stdout if successful,
+                   or None and error details if it failed or was stopped
+        """
+        if stdout is None:
+            stdout = io.StringIO()
+        if session_id is not None:
+            return self._run_in_session(code, session_id, stdout, owner)
+
+        if not self._slots.acquire(timeout=self.timeout_seconds):
+            return None, {
+                "error": "Interpreter busy",
+                "details": f"No interpreter became free within {self.timeout_seconds:g} seconds",
+            }
+        try:
+            worker = self._checkout()
+            worker.runs += 1
+            reply, error = self._call(
+                worker, ("run", (code, self.cpu_seconds, False, self.max_output_chars)), stdout, owner
+            )
+            if error:
+                self._replace()
+                return None, error
+            self._checkin(worker)
+            return self._run_result(reply, stdout)
+        finally:
+            self._slots.release()
+
+    def _session(self, session_id: str) -> _Session:
+        """The session for session_id, created if needed, making room under max_sessions."""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session()
+            self._sessions.move_to_end(session_id)
+            session.last_used = time.monotonic()
+            excess = len(self._sessions) - self.max_sessions
+            evicted = self._evict_sessions(lambda index, other: index < excess)
+        for other in evicted:
+            self._close_session(other, locked=True)
+        return session
+
+    def _evict_sessions(self, should_evict: Callable[[int, _Session], bool]) -> List[_Session]:
+        """
+        Removes the sessions should_evict picks (oldest first) that are not running a snippet.
+
+        Called with self._lock held, the removed sessions are returned with their lock held.
+        """
+        evicted = []
+        for index, (session_id, session) in enumerate(list(self._sessions.items())):
+            if should_evict(index, session) and session.lock.acquire(blocking=False):
+                del self._sessions[session_id]
+                session.closed = True
+                evicted.append(session)
+        return evicted
+
+    def _close_session(self, session: _Session, locked: bool = False) -> None:
+        if not locked:
+            session.lock.acquire()
+        try:
+            session.closed = True
+            if session.worker is not None:
+                session.worker.close()
+                session.worker = None
+        finally:
+            session.lock.release()
+
+    def _sweep_idle_sessions(self) -> None:
+        while not self._stopping.wait(min(60, self.session_idle_seconds)):
+            cutoff = time.monotonic() - self.session_idle_seconds
+            with self._lock:
+                evicted = self._evict_sessions(lambda index, session: session.last_used < cutoff)
+            for session in evicted:
+                self._close_session(session, locked=True)
+            if evicted:
+                logging.info(f"Closed {len(evicted)} idle interpreter sessions")
+
+    def _run_in_session(
+        self, code: str, session_id: str, stdout: TextIO, owner: Optional[str]
+    ) -> InterpreterResult:
+        while True:
+            session = self._session(session_id)
+            with session.lock:
+                # Closed by an eviction while this call waited for it
+                if session.closed:
+                    continue
+                if session.worker is None:
+                    session.worker = self._checkout()
+                    self._replace()
+                reply, error = self._call(
+                    session.worker,
+                    ("run", (code, self.cpu_seconds, True, self.max_output_chars)),
+                    stdout,
+                    owner,
+                )
+                session.last_used = time.monotonic()
+                if error:
+                    session.worker = None
+                    error["details"] += ". The session's variables were cleared."
+                    return None, error
+                return self._run_result(reply, stdout)
+
+    def session_variables(
+        self, session_id: str
+    ) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """
+        Lists what a session holds.
+
+        Returns:
+            tuple: ({"variables": [...], "memory_mb": ...}, None) where each variable has its
+                   name, type and length, or None and error details
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+        if session is None:
+            return {"variables": [], "memory_mb": None}, None
+        with session.lock:
+            if session.closed or session.worker is None:
+                return {"variables": [], "memory_mb": None}, None
+            result, error = self._call(session.worker, ("variables", None))
+            if error:
+                session.worker = None
+                return None, error
+            return result, None
+
+    def close_session(self, session_id: str) -> None:
+        """Stops a session's worker, dropping its variables."""
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+        if session is not None:
+            self._close_session(session)
+
+    def _exit_error(self, exitcode: Optional[int]) -> Dict[str, Any]:
+        if exitcode == -getattr(signal, "SIGXCPU", 0):
+            return {
+                "error": "CPU time limit exceeded",
+                "details": f"Code execution used more than {self.cpu_seconds} seconds of CPU time",
+            }
+        logging.warning(f"Interpreter worker exited with code {exitcode}")
+        return {
+            "error": "Interpreter process exited",
+            "details": f"The interpreter stopped unexpectedly (exit code {exitcode}), "
+            "e.g. after running out of memory",
+        }
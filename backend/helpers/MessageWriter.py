@@ -0,0 +1,225 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from sqlalchemy import update
+from sqlalchemy.dialects.sqlite import insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ai.models import Blob, Conversation, Message, async_engine
+
+MAX_BATCH_SIZE = 256
+# How long the worker waits for more messages before committing what it has
+BATCH_LINGER_SECONDS = 0.05
+WRITE_ATTEMPTS = 3
+
+
+class _Flush:
+    """A flush waiting for every message queued before it."""
+
+    def __init__(self, conversation_id: Optional[str]) -> None:
+        self.conversation_id = conversation_id
+        self.future: "asyncio.Future[None]" = asyncio.get_running_loop().create_future()
+
+
+# A message with the blobs it references
+_Queued = Tuple[Message, Dict[str, Blob]]
+_QueueItem = Union[_Queued, _Flush]
+
+
+def _combine(items: List[_Queued]) -> Tuple[List[Message], Dict[str, Blob]]:
+    return (
+        [message for message, _ in items],
+        {digest: blob for _, blobs in items for digest, blob in blobs.items()},
+    )
+
+
+class MessageWriter:
+    """
+    Write-behind queue for chat messages.
+
+    The chat stream queues messages instead of committing them itself, and a single
+    background worker writes everything queued so far in one transaction. When that
+    transaction fails, each conversation in it is retried on its own so one bad row
+    only costs its own conversation. `flush` returns once every message queued before
+    it is committed, and raises if any message of its conversation was dropped since
+    the last flush, in this batch or an earlier one.
+    """
+
+    def __init__(
+        self, max_batch_size: int = MAX_BATCH_SIZE, linger_seconds: float = BATCH_LINGER_SECONDS
+    ) -> None:
+        self.max_batch_size = max_batch_size
+        self.linger_seconds = linger_seconds
+        self._queue: Optional["asyncio.Queue[_QueueItem]"] = None
+        self._worker: Optional["asyncio.Task[None]"] = None
+        # Conversations with dropped messages their next flush has not reported yet
+        self._dropped: Dict[str, Exception] = {}
+        self.commits = 0
+        self.written = 0
+
+    def _ensure_worker(self) -> "asyncio.Queue[_QueueItem]":
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+        return self._queue
+
+    def start(self) -> None:
+        """Starts the worker, called from the app lifespan."""
+        self._ensure_worker()
+
+    def enqueue(self, message: Message, blobs: Optional[Dict[str, Blob]] = None) -> None:
+        """Queues a message, and the blobs it references, to be written by the worker."""
+        self._ensure_worker().put_nowait((message, blobs or {}))
+
+    async def flush(self, conversation_id: Optional[str] = None) -> None:
+        """
+        Waits until every message queued so far is committed.
+
+        Args:
+            conversation_id: Raise if a message of this conversation was dropped, any
+                conversation when None
+        """
+        flush = _Flush(conversation_id)
+        self._ensure_worker().put_nowait(flush)
+        await flush.future
+
+    async def stop(self) -> None:
+        """Writes whatever is still queued and stops the worker."""
+        if self._worker is None:
+            return
+        try:
+            await self.flush()
+        except Exception:
+            logging.exception("Failed to write queued messages on shutdown")
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        logging.info(f"Message writer stopped after {self.written} messages in {self.commits} commits")
+
+    async def _next_batch(self, queue: "asyncio.Queue[_QueueItem]") -> List[_QueueItem]:
+        loop = asyncio.get_running_loop()
+        batch = [await queue.get()]
+        deadline = loop.time() + self.linger_seconds
+        while len(batch) < self.max_batch_size:
+            try:
+                batch.append(queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            remaining = deadline - loop.time()
+            # Someone is waiting on a flush, do not hold their batch back
+            if remaining <= 0 or any(isinstance(item, _Flush) for item in batch):
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, messages: List[Message], blobs: Dict[str, Blob]) -> None:
+        for attempt in range(WRITE_ATTEMPTS):
+            try:
+                async with AsyncSession(async_engine, expire_on_commit=False) as session:
+                    if blobs:
+                        # Content-addressed, a blob that already exists is identical
+                        await session.exec(
+                            insert(Blob)
+                            .values(
+                                [
+                                    {
+                                        "hash": blob.hash,
+                                        "encoding": blob.encoding,
+                                        "data": blob.data,
+                                        "size": blob.size,
+                                        "created_at": blob.created_at,
+                                    }
+                                    for blob in blobs.values()
+                                ]
+                            )
+                            .on_conflict_do_nothing(index_elements=["hash"])
+                        )
+                    session.add_all(messages)
+                    # Keeps conversation lists, ordered by updated_at, in activity order
+                    conversation_ids = {message.conversation_id for message in messages}
+                    await session.exec(
+                        update(Conversation)
+                        .where(Conversation.id.in_(conversation_ids))
+                        .values(updated_at=datetime.now())
+                    )
+                    await session.commit()
+                self.commits += 1
+                self.written += len(messages)
+                return
+            except Exception:
+                if attempt + 1 >= WRITE_ATTEMPTS:
+                    raise
+                logging.warning(
+                    f"Writing {len(messages)} messages failed, retrying (attempt {attempt + 2}/{WRITE_ATTEMPTS})"
+                )
+                await asyncio.sleep(0.1 * 2**attempt)
+
+    async def _write_batch(self, items: List[_Queued]) -> None:
+        """Writes queued messages in one transaction, falling back to one per conversation."""
+        try:
+            await self._write(*_combine(items))
+            return
+        except Exception as e:
+            error = e
+        conversations: Dict[str, List[_Queued]] = {}
+        for item in items:
+            conversations.setdefault(item[0].conversation_id, []).append(item)
+        if len(conversations) == 1:
+            self._drop(items, error)
+            return
+        logging.warning(
+            f"Writing messages of {len(conversations)} conversations together failed, "
+            f"writing each on its own: {error}"
+        )
+        for group in conversations.values():
+            try:
+                await self._write(*_combine(group))
+            except Exception as e:
+                self._drop(group, e)
+
+    def _drop(self, items: List[_Queued], error: Exception) -> None:
+        conversation_ids = {message.conversation_id for message, _ in items}
+        logging.error(
+            f"Dropped {len(items)} chat messages of {', '.join(map(str, conversation_ids))} "
+            "that could not be written",
+            exc_info=error,
+        )
+        for conversation_id in conversation_ids:
+            self._dropped[conversation_id] = error
+
+    def _report(self, flush: _Flush) -> None:
+        if flush.future.done():
+            return
+        if flush.conversation_id is None:
+            error = next(iter(self._dropped.values()), None)
+            self._dropped.clear()
+        else:
+            error = self._dropped.pop(flush.conversation_id, None)
+        if error is not None:
+            flush.future.set_exception(error)
+        else:
+            flush.future.set_result(None)
+
+    async def _run(self) -> None:
+        queue = self._queue
+        while True:
+            batch = await self._next_batch(queue)
+            items = [item for item in batch if isinstance(item, tuple)]
+            if items:
+                await self._write_batch(items)
+            for item in batch:
+                if isinstance(item, _Flush):
+                    self._report(item)
+
+
+message_writer = MessageWriter()
@@ -1,11 +1,14 @@
-import threading
-import time
+import importlib.util
+import httpx
 import requests
 import json
-from typing import Tuple, Optional, Dict, Any
+from typing import Tuple, Optional, Dict, Any, Callable, List
 import logging
 import os
 from dotenv import load_dotenv
+from helpers.GraphCache import GraphCache, NOT_MODIFIED
+from helpers.GraphTokenManager import GraphTokenManager
+from helpers.GraphRateController import get_rate_controller
 
 load_dotenv()
 
@@ -13,118 +16,64 @@ tenant_id = os.getenv("TENANT_ID")
 client_id = os.getenv("APP_ID")
 client_secret = os.getenv("SECRET")
 
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
 
-_token = None
-_headers = {}
-_token_expiry = None
-_token_lock = threading.Lock()
 
+# Set GRAPH_TOKEN_CACHE_PATH (e.g. ./db/graph_token.sqlite) to share one token across workers
+_token_manager = GraphTokenManager(
+    tenant_id, client_id, client_secret, os.getenv("GRAPH_TOKEN_CACHE_PATH")
+)
 
-def refresh_token() -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
-    # print credentials
-    print("tenant_id", tenant_id)
-    print("client_id", client_id)
-    print("client_secret", client_secret)
-    """Refreshes the access token for Microsoft Graph API"""
-    global _token, _headers, _token_expiry
+# Pooled connections to Graph. Reusing them saves a TCP + TLS handshake on every call.
+_session = requests.Session()
+_async_client: Optional[httpx.AsyncClient] = None
 
-    token_url = f"https://login.microsoftonline.com/{tenant_id}/oauth2/v2.0/token"
-    token_data = {
-        "grant_type": "client_credentials",
-        "client_id": client_id,
-        "client_secret": client_secret,
-        "scope": "https://graph.microsoft.com/.default",
-    }
+# Callbacks run after every successful write (non-GET) request, with (method, url)
+_write_listeners: List[Callable[[str, str], None]] = []
 
-    try:
-        response = requests.post(token_url, data=token_data)
-        response.raise_for_status()  # Raise HTTPError for bad responses (4xx or 5xx)
-        data = response.json()
-        token = data.get("access_token")
-        expires_in = data.get("expires_in")  # Get token lifetime
-
-        if not token:
-            print(response.text)
-            logging.error("Failed to get token: " + response.text)
-            return None, {"error": "Failed to get token", "details": response.text}
-
-        # Update the global token variables
-        _token = token
-        _headers = {
-            "Authorization": f"Bearer {_token}",
-            "Content-Type": "application/json",
-        }
-        _token_expiry = time.time() + int(expires_in)
-        logging.info("Token refreshed successfully.")
 
-        return _token, None
+def add_write_listener(callback: Callable[[str, str], None]) -> None:
+    """Registers a callback that is told about every successful Graph write."""
+    _write_listeners.append(callback)
 
-    except requests.exceptions.RequestException as e:
-        logging.error(f"Request failed: {e}")
-        return None, {"error": "Failed to refresh token", "details": str(e)}
-    except Exception as e:
-        logging.exception("An unexpected error occurred during token refresh.")
-        return None, {
-            "error": "Unexpected error during token refresh",
-            "details": str(e),
-        }
-
-
-def _check_and_refresh_token() -> Optional[Dict[str, Any]]:
-    """Checks if the token is expired and refreshes it if needed."""
-    global _token, _headers, _token_expiry
 
-    if _token_expiry is None or time.time() >= _token_expiry:
-        logging.info("Token expired or about to expire. Refreshing...")
-        with _token_lock:
-            token, error = refresh_token()
-            if error:
-                return error  # Return the error encountered during refresh
+# Shared cache for Graph GETs, see GraphCache for TTLs and invalidation
+_graph_cache = GraphCache(
+    tenant_id,
+    GRAPH_BASE_URL,
+    default_ttl=int(os.getenv("GRAPH_CACHE_DEFAULT_TTL", "60")),
+)
+GRAPH_CACHE_ENABLED = os.getenv("GRAPH_CACHE_ENABLED", "true").lower() != "false"
+add_write_listener(_graph_cache.invalidate_for_write)
 
-            # Update global token variables if refresh was successful
-            if token:
-                _token = token
-                _headers["Authorization"] = f"Bearer {_token}"
-                schedule_token_refresh()
+# Retries throttled calls and adapts how many run at once, shared by every Graph call
+_graph_rate = get_rate_controller(tenant_id)
 
-    return None  # No error
 
+def prefetch_token() -> Optional[Dict[str, Any]]:
+    """Fetches the Graph token ahead of the first request, returns error details on failure."""
+    _, error = _token_manager.get_headers()
+    return error
 
-def schedule_token_refresh():
-    """Schedules the token refresh to occur before it expires."""
-    global _token_expiry
 
-    if _token_expiry:
-        # Refresh token 5 minutes before expiry
-        refresh_time = _token_expiry - time.time() - 300
-        if refresh_time > 0:
-            logging.info(f"Scheduling token refresh in {refresh_time} seconds.")
-            threading.Timer(refresh_time, _refresh_token_and_reschedule).start()
-        else:
-            logging.warning(
-                "Token is already expired or about to expire. Refreshing now."
-            )
-            _refresh_token_and_reschedule()
-    else:
-        logging.warning("Token expiry not set. Refreshing immediately.")
-        _refresh_token_and_reschedule()
+def get_graph_cache_stats() -> Dict[str, Any]:
+    """Returns the Graph cache hit/miss counters, per TTL rule and in total."""
+    return _graph_cache.stats()
 
 
-def _refresh_token_and_reschedule():
-    """Refreshes the token and reschedules the next refresh."""
-    global _token, _headers
+def invalidate_cache_for_write(method: str, url: str) -> None:
+    """Drops cached GETs a write made in another process (e.g. an interpreter worker) affects."""
+    _graph_cache.invalidate_for_write(method, url)
 
-    with _token_lock:  # Ensure thread safety
-        token, error = refresh_token()
-        if error:
-            logging.error(f"Failed to refresh token: {error}")
-            # Handle the error (e.g., stop the application or retry later)
-            return
 
-        if token:
-            _token = token
-            _headers["Authorization"] = f"Bearer {_token}"
-            schedule_token_refresh()
+def _notify_write(method: str, url: str) -> None:
+    if method.upper() == "GET" or url == GRAPH_BATCH_URL:
+        return
+    for callback in _write_listeners:
+        try:
+            callback(method, url)
+        except Exception:
+            logging.exception(f"Write listener failed for {method} {url}")
 
 
 def make_request(
@@ -137,10 +86,13 @@ def make_request(
     Makes an HTTP request using the requests library, handling token refresh
     and returning structured errors including status code and headers on failure.
 
+    Plain GETs (no custom headers) go through the shared Graph cache, so the
+    returned JSON may be shared with other callers and must not be modified.
+
     Args:
         method: HTTP method (e.g., 'GET', 'POST').
         url: The URL for the request.
-        headers: Optional dictionary of headers. Uses global _headers if None.
+        headers: Optional dictionary of headers. Uses the Graph auth headers if None.
         json_data: Optional dictionary for the JSON request body.
 
     Returns:
@@ -150,13 +102,44 @@ def make_request(
                The error_details dictionary will contain 'error', 'details',
                and potentially 'status_code', 'headers', and 'response_text'.
     """
-    global _headers
+    if GRAPH_CACHE_ENABLED and method.upper() == "GET" and headers is None:
+        return _graph_cache.fetch(
+            url,
+            lambda etag: _graph_rate.run(
+                "GET", lambda: _make_request_uncached("GET", url, if_none_match=etag)
+            ),
+        )
+    return _graph_rate.run(
+        method, lambda: _make_request_uncached(method, url, headers, json_data)
+    )
+
+
+def _make_request_uncached(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    json_data: Optional[Dict[str, Any]] = None,
+    if_none_match: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Sends the request for `make_request` without consulting the cache.
+
+    Args:
+        method: HTTP method (e.g., 'GET', 'POST').
+        url: The URL for the request.
+        headers: Optional dictionary of headers. Uses the Graph auth headers if None.
+        json_data: Optional dictionary for the JSON request body.
+        if_none_match: ETag to revalidate against, a 304 returns (NOT_MODIFIED, None).
+
+    Returns:
+        tuple: Same shape as `make_request`.
+    """
     response: Optional[requests.Response] = (
         None  # Keep track of response for error reporting
     )
 
-    # 1. Check and refresh token
-    token_error = _check_and_refresh_token()
+    # 1. Get a valid token, refreshing it if needed
+    auth_headers, token_error = _token_manager.get_headers()
     if token_error:
         logging.error(f"Token refresh failed prior to request: {token_error}")
         # Ensure the returned error structure is consistent
@@ -167,7 +150,7 @@ def make_request(
             return None, {"error": "Token refresh failed", "details": str(token_error)}
 
     # 2. Prepare headers
-    request_headers = _headers if headers is None else headers
+    request_headers = auth_headers if headers is None else headers
     if (
         not request_headers
     ):  # Ensure headers are actually set after potential global lookup
@@ -176,11 +159,13 @@ def make_request(
             "error": "Missing request headers",
             "status_code": 500,
         }  # Internal configuration error
+    if if_none_match:
+        request_headers = {**request_headers, "If-None-Match": if_none_match}
 
     # 3. Make the request
     try:
         logging.debug(f"Making {method} request to {url}")
-        response = requests.request(
+        response = _session.request(
             method,
             url,
             headers=request_headers,
@@ -190,8 +175,11 @@ def make_request(
 
         # Check for HTTP errors (4xx, 5xx)
         response.raise_for_status()
+        _notify_write(method, url)
 
         # Handle successful responses
+        if response.status_code == 304:
+            return NOT_MODIFIED, None
         if response.status_code == 204:
             logging.debug(f"Request successful with 204 No Content: {method} {url}")
             return (
@@ -296,3 +284,359 @@ def make_request(
                 "status_code": err_status,  # Include status if response was received before exception
             },
         )
+
+
+def _get_async_client() -> httpx.AsyncClient:
+    """Returns the shared async Graph client, creating it on first use.
+
+    HTTP/2 is used when the optional `h2` package is installed.
+    """
+    global _async_client
+
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(
+            http2=importlib.util.find_spec("h2") is not None,
+            timeout=30,
+            limits=httpx.Limits(
+                max_connections=100, max_keepalive_connections=20, keepalive_expiry=30
+            ),
+        )
+    return _async_client
+
+
+async def close_async_client() -> None:
+    """Closes the shared async Graph client, call this on application shutdown."""
+    global _async_client
+
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def make_request_async(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    json_data: Optional[Dict[str, Any]] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """
+    Async version of `make_request` using a pooled `httpx.AsyncClient`.
+
+    Plain GETs go through the same shared Graph cache as `make_request`.
+
+    Args:
+        method: HTTP method (e.g., 'GET', 'POST').
+        url: The URL for the request.
+        headers: Optional dictionary of headers. Uses the Graph auth headers if None.
+        json_data: Optional dictionary for the JSON request body.
+
+    Returns:
+        tuple: Same shape as `make_request`, (response_json, None) on success,
+               ({}, None) for 204 No Content and (None, error_details) on failure.
+    """
+    if GRAPH_CACHE_ENABLED and method.upper() == "GET" and headers is None:
+        return await _graph_cache.fetch_async(
+            url,
+            lambda etag: _graph_rate.run_async(
+                "GET", lambda: _make_request_async_uncached("GET", url, if_none_match=etag)
+            ),
+        )
+    return await _graph_rate.run_async(
+        method, lambda: _make_request_async_uncached(method, url, headers, json_data)
+    )
+
+
+async def _make_request_async_uncached(
+    method: str,
+    url: str,
+    headers: Optional[Dict[str, str]] = None,
+    json_data: Optional[Dict[str, Any]] = None,
+    if_none_match: Optional[str] = None,
+) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+    """Sends the request for `make_request_async` without consulting the cache."""
+    response: Optional[httpx.Response] = None
+
+    # 1. Get a valid token, a refresh runs in a thread since it is blocking
+    auth_headers, token_error = await _token_manager.get_headers_async()
+    if token_error:
+        logging.error(f"Token refresh failed prior to request: {token_error}")
+        if isinstance(token_error, dict):
+            token_error.setdefault("error", "Token refresh failed")
+            return None, token_error
+        else:
+            return None, {"error": "Token refresh failed", "details": str(token_error)}
+
+    # 2. Prepare headers
+    request_headers = auth_headers if headers is None else headers
+    if not request_headers:
+        logging.error("Request headers are missing after token check and fallback.")
+        return None, {
+            "error": "Missing request headers",
+            "status_code": 500,
+        }
+    if if_none_match:
+        request_headers = {**request_headers, "If-None-Match": if_none_match}
+
+    # 3. Make the request
+    try:
+        logging.debug(f"Making async {method} request to {url}")
+        response = await _get_async_client().request(
+            method,
+            url,
+            headers=request_headers,
+            json=json_data,
+        )
+        if response.status_code == 304:
+            # httpx treats 304 as an error status, it means our cached copy is current
+            return NOT_MODIFIED, None
+        response.raise_for_status()
+        _notify_write(method, url)
+
+        if response.status_code == 204:
+            logging.debug(f"Request successful with 204 No Content: {method} {url}")
+            return {}, None
+
+        response_json = response.json()
+        logging.debug(
+            f"Request successful with status {response.status_code}: {method} {url}"
+        )
+        return response_json, None
+
+    # 4. Handle specific exceptions, mirroring the error dicts of `make_request`
+    except httpx.HTTPStatusError as e:
+        err_status = e.response.status_code
+        err_headers = dict(e.response.headers)
+        err_text = e.response.text
+
+        log_msg = (
+            f"HTTP Error {err_status} for {method} {url}. Response: {err_text[:500]}"
+            f"{'...' if len(err_text) > 500 else ''}"
+        )
+        if 400 <= err_status < 500:
+            logging.warning(log_msg)
+        else:
+            logging.error(log_msg)
+
+        return None, {
+            "error": f"HTTP Error: {err_status}",
+            "details": str(e),
+            "status_code": err_status,
+            "headers": err_headers,
+            "response_text": err_text,
+        }
+
+    except httpx.TimeoutException as e:
+        logging.error(f"Request timed out for {method} {url}: {e}")
+        return None, {"error": "Request Timeout", "details": str(e)}
+
+    except httpx.TransportError as e:
+        logging.error(f"Connection error for {method} {url}: {e}")
+        return None, {"error": "Connection Error", "details": str(e)}
+
+    except httpx.HTTPError as e:
+        logging.error(f"Generic HTTPError for {method} {url}: {e}")
+        return None, {
+            "error": "Request Failed",
+            "details": str(e),
+            "status_code": None,
+            "headers": {},
+            "response_text": None,
+        }
+
+    except json.JSONDecodeError as e:
+        err_status = response.status_code if response is not None else None
+        err_headers = dict(response.headers) if response is not None else {}
+        err_text = response.text if response is not None else None
+
+        logging.error(
+            f"Failed to decode JSON response for {method} {url} (Status: {err_status}): {e}"
+        )
+        return None, {
+            "error": "Failed to decode JSON response",
+            "details": str(e),
+            "status_code": err_status,
+            "headers": err_headers,
+            "response_text": err_text,
+        }
+
+    except Exception as e:
+        err_status = response.status_code if response is not None else None
+        logging.exception(
+            f"An unexpected error occurred during request for {method} {url} (Status: {err_status})"
+        )
+        return (
+            None,
+            {
+                "error": "Unexpected error during request",
+                "details": str(e),
+                "status_code": err_status,
+            },
+        )
+
+
+GRAPH_BATCH_URL = f"{GRAPH_BASE_URL}/$batch"
+GRAPH_BATCH_LIMIT = 20  # Maximum number of sub-requests Graph accepts in one $batch call
+BATCH_MAX_RETRIES = 3
+BATCH_DEFAULT_RETRY_SECONDS = 5
+_BATCH_RETRYABLE_STATUSES = (429, 503, 504)
+
+
+class _GraphBatch:
+    """
+    Bookkeeping for a list of Graph requests sent through JSON `$batch`.
+
+    Sub-requests are packed into `$batch` payloads of at most GRAPH_BATCH_LIMIT
+    items. Throttled items are re-queued, and collection responses with an
+    `@odata.nextLink` are re-queued with the next page URL until every page has
+    been collected into a single `value` list.
+    """
+
+    def __init__(self, requests_list, follow_next_links: bool):
+        self.follow_next_links = follow_next_links
+        self.pending = []
+        self.results = [(None, None)] * len(requests_list)
+        self.pages: Dict[int, list] = {}
+        self.attempts: Dict[int, int] = {}
+        self.retry_after = 0
+        for index, request in enumerate(requests_list):
+            self.pending.append((index, {**request, "url": _relative_graph_url(request["url"])}))
+
+    def next_payload(self) -> Tuple[list, Dict[str, Any]]:
+        """Takes the next chunk of pending sub-requests and builds its `$batch` body."""
+        chunk, self.pending = self.pending[:GRAPH_BATCH_LIMIT], self.pending[GRAPH_BATCH_LIMIT:]
+        self.retry_after = 0
+        sub_requests = []
+        for index, request in chunk:
+            sub_request = {
+                "id": str(index),
+                "method": request.get("method", "GET"),
+                "url": request["url"],
+            }
+            if request.get("body") is not None:
+                sub_request["body"] = request["body"]
+                sub_request["headers"] = {
+                    "Content-Type": "application/json",
+                    **request.get("headers", {}),
+                }
+            elif request.get("headers"):
+                sub_request["headers"] = request["headers"]
+            sub_requests.append(sub_request)
+        return chunk, {"requests": sub_requests}
+
+    def apply(self, chunk: list, response: Optional[Dict[str, Any]], error: Optional[Dict[str, Any]]) -> None:
+        """Records the outcome of one `$batch` call for every sub-request it carried."""
+        if error:
+            for index, _ in chunk:
+                self.results[index] = (None, error)
+            return
+
+        requests_by_index = dict(chunk)
+        for item in (response or {}).get("responses", []):
+            index = int(item["id"])
+            request = requests_by_index.pop(index, None)
+            if request is None:
+                continue
+            status = item.get("status", 500)
+            headers = item.get("headers") or {}
+            body = item.get("body")
+
+            if 200 <= status < 300:
+                body = body if isinstance(body, dict) else {}
+                _notify_write(request.get("method", "GET"), f"{GRAPH_BASE_URL}{request['url']}")
+                next_link = body.get("@odata.nextLink") if self.follow_next_links else None
+                if next_link:
+                    self.pages.setdefault(index, []).extend(body.get("value", []))
+                    self.pending.append((index, {**request, "url": _relative_graph_url(next_link)}))
+                    continue
+                if index in self.pages:
+                    body["value"] = self.pages.pop(index) + body.get("value", [])
+                self.results[index] = (body, None)
+            elif status in _BATCH_RETRYABLE_STATUSES and self.attempts.get(index, 0) < BATCH_MAX_RETRIES:
+                self.attempts[index] = self.attempts.get(index, 0) + 1
+                self.retry_after = max(self.retry_after, _parse_retry_after(headers))
+                self.pending.append((index, request))
+            else:
+                self.pages.pop(index, None)
+                response_text = json.dumps(body) if body is not None else None
+                details = body.get("error", {}).get("message") if isinstance(body, dict) else None
+                logging.warning(
+                    f"Batched {request.get('method', 'GET')} {request['url']} failed with status {status}: {details}"
+                )
+                self.results[index] = (
+                    None,
+                    {
+                        "error": f"HTTP Error: {status}",
+                        "details": details or response_text,
+                        "status_code": status,
+                        "headers": headers,
+                        "response_text": response_text,
+                    },
+                )
+
+        # Anything Graph did not answer is reported rather than silently dropped
+        for index, request in requests_by_index.items():
+            self.results[index] = (
+                None,
+                {"error": "Missing response in $batch result", "status_code": None},
+            )
+
+
+def _relative_graph_url(url: str) -> str:
+    """$batch sub-requests take URLs relative to the Graph version root."""
+    if url.startswith(GRAPH_BASE_URL):
+        url = url[len(GRAPH_BASE_URL):]
+    return url if url.startswith("/") else f"/{url}"
+
+
+def _parse_retry_after(headers: Dict[str, Any]) -> float:
+    """Reads a Retry-After header in seconds, falling back to BATCH_DEFAULT_RETRY_SECONDS."""
+    for key, value in headers.items():
+        if key.lower() == "retry-after":
+            try:
+                return max(1, int(value))
+            except (ValueError, TypeError):
+                break
+    return BATCH_DEFAULT_RETRY_SECONDS
+
+
+def make_batch_request(
+    requests_list: list, follow_next_links: bool = True
+) -> list:
+    """
+    Sends several Graph requests through JSON `$batch`, GRAPH_BATCH_LIMIT at a time.
+
+    Args:
+        requests_list: Dictionaries with 'url' (absolute or relative to /v1.0),
+            and optionally 'method' (default GET), 'body' and 'headers'.
+        follow_next_links: Follow `@odata.nextLink` pages and merge their 'value' lists.
+
+    Returns:
+        list: One (response_json, error) tuple per request, in the order given,
+              with the same error shape as `make_request`.
+    """
+    batch = _GraphBatch(requests_list, follow_next_links)
+    while batch.pending:
+        chunk, payload = batch.next_payload()
+        response, error = make_request("POST", GRAPH_BATCH_URL, json_data=payload)
+        batch.apply(chunk, response, error)
+        if batch.retry_after and batch.pending:
+            # The shared rate controller holds the next round back for Retry-After
+            logging.warning(f"Graph throttled batched requests, retrying in {batch.retry_after}s")
+            _graph_rate.record_throttle(batch.retry_after)
+    return batch.results
+
+
+async def make_batch_request_async(
+    requests_list: list, follow_next_links: bool = True
+) -> list:
+    """Async version of `make_batch_request` using `make_request_async`."""
+    batch = _GraphBatch(requests_list, follow_next_links)
+    while batch.pending:
+        chunk, payload = batch.next_payload()
+        response, error = await make_request_async("POST", GRAPH_BATCH_URL, json_data=payload)
+        batch.apply(chunk, response, error)
+        if batch.retry_after and batch.pending:
+            # The shared rate controller holds the next round back for Retry-After
+            logging.warning(f"Graph throttled batched requests, retrying in {batch.retry_after}s")
+            _graph_rate.record_throttle(batch.retry_after)
+    return batch.results
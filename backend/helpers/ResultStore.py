@@ -0,0 +1,60 @@
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+
+class StoredResult:
+    __slots__ = ("owner", "tool_name", "rows", "metadata", "expires_at")
+
+    def __init__(
+        self, owner: str, tool_name: str, rows: List[Any], metadata: Dict[str, Any], ttl: float
+    ) -> None:
+        self.owner = owner
+        self.tool_name = tool_name
+        self.rows = rows
+        self.metadata = metadata
+        self.expires_at = time.monotonic() + ttl
+
+
+class ResultStore:
+    """
+    Server-side home for large tool results, addressed by an opaque handle.
+
+    The model is given the handle and a short summary instead of the rows, and pages
+    through the rows with a read tool. Entries belong to the user whose run produced
+    them, expire after `ttl_seconds` and are evicted least recently used first.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 6 * 3600) -> None:
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, StoredResult]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def put(
+        self, owner: str, tool_name: str, rows: List[Any], metadata: Optional[Dict[str, Any]] = None
+    ) -> str:
+        """Stores rows and returns their handle."""
+        handle = f"res_{secrets.token_hex(8)}"
+        entry = StoredResult(owner, tool_name, rows, metadata or {}, self.ttl_seconds)
+        with self._lock:
+            self._entries[handle] = entry
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return handle
+
+    def get(self, handle: str, owner: Optional[str] = None) -> Optional[StoredResult]:
+        """Returns the stored result, None when unknown, expired or owned by someone else."""
+        with self._lock:
+            entry = self._entries.get(handle)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                del self._entries[handle]
+                return None
+            if owner is not None and entry.owner != owner:
+                return None
+            self._entries.move_to_end(handle)
+            return entry
@@ -3,6 +3,15 @@ from custom.providers.google_gla import GoogleGLAProvider
 from custom import Agent
 import os
 
+title_agent = Agent(
+    model=GeminiModel(
+        "gemini-2.0-flash",
+        provider=GoogleGLAProvider(api_key=os.getenv("GEMINI_API_KEY")),
+    ),
+    system_prompt="Based on the user's prompt, generate a title for the conversation. The title should be a single sentence that captures the essence of the conversation. The title should be no more than 10 words.",
+)
+
+
 async def gemini(prompt: str) -> str:
     """
     Simple function that takes a prompt and returns a Gemini response.
@@ -13,15 +22,31 @@ async def gemini(prompt: str) -> str:
     Returns:
         The text response from Gemini
     """
-    model = GeminiModel(
+    response = await title_agent.run(prompt)
+    # print(response, "\n")
+    return response.data
+
+
+summary_agent = Agent(
+    model=GeminiModel(
         "gemini-2.0-flash",
         provider=GoogleGLAProvider(api_key=os.getenv("GEMINI_API_KEY")),
-    )
+    ),
+    system_prompt="You maintain a running summary of a conversation between a user and an assistant that manages a Microsoft 365 tenant. Given the previous summary and the turns that followed it, write an updated summary. Keep every name, email, id, decision, result and open task the assistant may need later, drop chit-chat and raw listings. Answer with the summary only.",
+)
 
-    agent = Agent(
-        model=model,
-        system_prompt="Based on the user's prompt, generate a title for the conversation. The title should be a single sentence that captures the essence of the conversation. The title should be no more than 10 words.",
-    )
-    response = await agent.run(prompt)
-    # print(response, "\n")
+
+async def summarize_conversation(previous_summary: str, transcript: str) -> str:
+    """
+    Folds older conversation turns into a running summary using Gemini.
+
+    Args:
+        previous_summary: The summary so far, empty for the first compaction
+        transcript: The turns to fold in, rendered as plain text
+
+    Returns:
+        The updated summary
+    """
+    prompt = f"Previous summary:\n{previous_summary or '(none)'}\n\nTurns since then:\n{transcript}"
+    response = await summary_agent.run(prompt)
     return response.data
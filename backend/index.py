@@ -14,12 +14,22 @@ from firebase_admin import credentials
 from routes.chats_router import chats_router
 from routes.user_routes import user_router
 from contextlib import asynccontextmanager
+import asyncio
 import os
 
 from helpers.Firebase_helpers import FirebaseUser, get_current_user, role_based_access
+from helpers.RequestHelper import close_async_client, get_graph_cache_stats
+from helpers.DirectoryMirror import run_directory_sync
+from helpers.MessageWriter import message_writer
 from ai.models import (
+    async_engine,
     create_db_and_tables,
 )
+from ai.migrations import run_migrations
+from ai.message_codec import migrate_json_messages
+from ai.assistant_functions.python_interpreter import interpreter_pool
+from helpers.ArtifactStore import prune_artifacts
+from ai.mem0_local import run_memory_probe
 from dotenv import load_dotenv
 
 
@@ -40,7 +50,8 @@ if not PRISM_COMPONENTS_DIR.is_dir():
 @asynccontextmanager
 async def lifespan(app: fastapi.FastAPI):
     # Initialize database on startup
-    create_db_and_tables()
+    await create_db_and_tables()
+    await run_migrations()
 
     # Initialize Firebase Admin SDK if not already initialized
     if not firebase_admin._apps:
@@ -50,8 +61,33 @@ async def lifespan(app: fastapi.FastAPI):
             'storageBucket': os.getenv('FIREBASE_STORAGE_BUCKET')
         })
 
+    # Keep the local users/teams/channels mirror fresh in the background
+    directory_sync_task = asyncio.create_task(run_directory_sync())
+
+    # Memory connects in the background, chats run without it until it is up
+    memory_probe_task = asyncio.create_task(run_memory_probe())
+
+    # Chat messages are written in batches by a background worker
+    message_writer.start()
+
+    # Convert messages stored before the binary codec, reads handle both meanwhile
+    codec_migration_task = asyncio.create_task(migrate_json_messages())
+
+    # Interpreter snippets run in worker processes, start them warm
+    await asyncio.to_thread(interpreter_pool.start)
+
+    # Drop downloadable tool output older than ARTIFACT_TTL_SECONDS
+    await asyncio.to_thread(prune_artifacts)
+
     yield
     # Clean up resources if needed
+    directory_sync_task.cancel()
+    memory_probe_task.cancel()
+    codec_migration_task.cancel()
+    await close_async_client()
+    await message_writer.stop()
+    await asyncio.to_thread(interpreter_pool.stop)
+    await async_engine.dispose()
 
 
 app = fastapi.FastAPI(
@@ -158,6 +194,16 @@ async def get_prism_language(
 
 
 
+@app.get("/api/graph-cache-stats", dependencies=[Depends(role_based_access(["developer"]))])
+async def graph_cache_stats():
+    """
+    Hit/miss counters of the Graph GET cache, per TTL rule, for tuning the TTLs.
+    """
+    return get_graph_cache_stats()
+
+
+
+
 # Custom Swagger UI routes
 @app.get("/docs", include_in_schema=False)
 async def custom_swagger_ui_html():
@@ -1,4 +1,4 @@
-from typing import List, Union
+from typing import List, Optional, Union
 from pydantic import BaseModel
 
 from custom.messages import FinalResultEvent, FunctionToolCallEvent, FunctionToolResultEvent, PartDeltaEvent, PartStartEvent
@@ -38,6 +38,11 @@ class MessageCreate(BaseModel):
     conversation_id: str
 
 
+class CompactionSettings(BaseModel):
+    enabled: Optional[bool] = None
+    token_threshold: Optional[int] = None
+
+
 
 class Part(BaseModel):
     type: str
@@ -1,11 +1,15 @@
-from datetime import datetime
+import asyncio
 import json
-from typing import AsyncGenerator, List, Union
+import logging
+import os
+from typing import AsyncGenerator, Coroutine, Dict, List, Optional, Set, Tuple, Union
 from fastapi import APIRouter, Depends, HTTPException, Request
-from requests import Session
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from ai.Manager import MyDeps, create_agent, get_system_prompt
+from ai.Manager import MyDeps, agent, get_system_prompt
 from ai.assistant_functions.memory_functions import get_memory_no_context
+from ai.mem0_local import memory_client
 from custom.messages import (
     FunctionToolCallEvent,
     FunctionToolResultEvent,
@@ -22,22 +26,40 @@ from custom.messages import (
     TextPartDelta,
     ToolCallPart,
     ToolReturnPart,
-    UserPromptPart,
 )
 from helpers.helper_funcs import gemini
-from ai.models import get_session, User, Conversation, Message as DBMessage
-from models.general import ConversationCreate, MessageCreate
-from fastapi.responses import StreamingResponse
+from ai.message_codec import CODEC_V1, encode_message, load_model_messages, model_message_to_dict
+from ai.history import get_compacted_history
+from helpers.ArtifactStore import artifact_path
+from helpers.EventStream import ToolProgress, coalesced_stream, sse_frame
+from helpers.MessageWriter import message_writer
+from ai.models import (
+    Blob,
+    estimate_tokens,
+    async_engine,
+    get_async_session,
+    User,
+    Conversation,
+    Message as DBMessage,
+)
+from models.general import CompactionSettings, ConversationCreate, MessageCreate
+from fastapi.responses import FileResponse, StreamingResponse
 
 chats_router = APIRouter(prefix="/chats")
 
+# The agent starts without memories when the lookup takes longer than this
+MEMORY_LOOKUP_TIMEOUT = float(os.getenv("MEMORY_LOOKUP_TIMEOUT", "2.0"))
+
+# Strong references to fire-and-forget tasks, the event loop only keeps weak ones
+_background_tasks: Set[asyncio.Task] = set()
+
 
 @chats_router.post("/chat")
 async def chat(
     request: Request,
     prompt: str,
     conversation_id: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     current_user = request.state.user
     """
@@ -45,10 +67,11 @@ async def chat(
 
     """
     # Get or create conversation
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
+    title_task = None
     if not conversation:
         # Check if user exists in the database, create if not
-        user = session.get(User, current_user.uid)
+        user = await session.get(User, current_user.uid)
         if not user:
             user = User(
                 id=current_user.uid,
@@ -56,40 +79,45 @@ async def chat(
                 name=current_user.email.split("@")[0] if current_user.email else None,
             )
             session.add(user)
-            session.commit()
 
+        # The real title is generated in the background, the stream reports it when ready
         conversation = Conversation(
             id=conversation_id,
-            title=await gemini(prompt),  # Generate title using Gemini
+            title=placeholder_title(prompt),
             user_id=current_user.uid,
         )
         session.add(conversation)
-        session.commit()
-
-    # Get message history from the conversation
-    message_history = get_message_history(conversation)
-
-    ##refresh system prompt
-    memory = get_memory_no_context(request.state.user.uid, prompt)
-
-    # print("memory", memory[1])
-
-    # save memory to file
+        await session.commit()
+        title_task = start_background_task(generate_title(conversation_id, prompt))
+
+        # A new conversation has no history, only memory needs fetching
+        message_history = []
+        memory = await lookup_memory(current_user.uid, prompt)
+    else:
+        # History (compacted if it grew too long) and memory are independent, fetch both at once
+        message_history, memory = await asyncio.gather(
+            get_compacted_history(session, conversation),
+            lookup_memory(current_user.uid, prompt),
+        )
 
     if len(message_history) > 0:
-        system_prompt = message_history[0].parts[0].content
-        if system_prompt:
+        # Stored system prompts are not loaded, they are always rebuilt here
+        if isinstance(message_history[0].parts[0], SystemPromptPart):
             message_history[0].parts[0].content = get_system_prompt(
                 request.state.user, memory
             )
 
-    agent = create_agent(current_user, memory)
-
-    async def generate_chunks() -> AsyncGenerator[
+    async def run_chunks() -> AsyncGenerator[
         str, None
     ]:  # Changed return type to str since we're yielding JSON strings
+        progress = ToolProgress()
         async with agent.iter(
-            deps=MyDeps(user_object=current_user),
+            deps=MyDeps(
+                user_object=current_user,
+                memory=memory,
+                conversation_id=conversation_id,
+                progress=progress,
+            ),
             user_prompt=prompt,
             message_history=message_history,
         ) as run:
@@ -104,51 +132,70 @@ async def chat(
                     # print("model request", node.request, "\n")
 
                     async with node.stream(run.ctx) as request_stream:
-                        async for event in request_stream:
+                        # Deltas arriving close together go out as one frame
+                        async for event in coalesced_stream(request_stream):
                             if isinstance(event, PartStartEvent):
                                 if isinstance(event.part, TextPart):
-                                    yield (
-                                        "data: " + event_to_json_string(event) + "\n\n"
-                                    )
+                                    yield sse_frame(event_to_payload(event))
                                 elif isinstance(event.part, ReasoningPart):
-                                    yield (
-                                        "data: " + event_to_json_string(event) + "\n\n"
-                                    )
+                                    yield sse_frame(event_to_payload(event))
                             elif isinstance(event, PartDeltaEvent):
                                 if isinstance(event.delta, TextPartDelta):
-                                    yield (
-                                        "data: " + event_to_json_string(event) + "\n\n"
-                                    )
+                                    yield sse_frame(event_to_payload(event))
                                 elif isinstance(event.delta, ReasoningPartDelta):
-                                    yield (
-                                        "data: " + event_to_json_string(event) + "\n\n"
-                                    )
+                                    yield sse_frame(event_to_payload(event))
                     # Save the complete message
                     # print(node.request)
-                    db_message = DBMessage(
-                        content=json.dumps(model_message_to_dict(node.request)),
-                        is_user_message=False,
-                        conversation_id=conversation_id,
-                    )
+                    db_message, blobs = to_db_message(node.request, conversation_id)
                     # print("db_message", db_message)
-                    session.add(db_message)
-                    session.commit()
+                    message_writer.enqueue(db_message, blobs)
                 elif agent.is_call_tools_node(node):
                     async with node.stream(run.ctx) as handle_stream:
-                        async for event in handle_stream:
+                        # Tools such as python_interpreter report output while they run
+                        async for event in progress.merged(handle_stream):
                             # print("tool call", event)
-                            yield "data: " + event_to_json_string(event) + "\n\n"
+                            if isinstance(event, dict):
+                                yield sse_frame(event)
+                            else:
+                                yield sse_frame(event_to_payload(event))
 
                     # print(node.model_response)
-                    db_message = DBMessage(
-                        content=json.dumps(model_message_to_dict(node.model_response)),
-                        is_user_message=False,
-                        conversation_id=conversation_id,
-                    )
+                    db_message, blobs = to_db_message(node.model_response, conversation_id)
                     # print("db_message", db_message)
 
-                    session.add(db_message)
-                    session.commit()
+                    message_writer.enqueue(db_message, blobs)
+
+    def title_chunk() -> Optional[str]:
+        nonlocal title_task
+        if title_task is None or not title_task.done():
+            return None
+        title = title_task.result()
+        title_task = None
+        if title is None:
+            return None
+        return sse_frame(
+            {"type": "title", "data": {"conversation_id": conversation_id, "title": title}}
+        )
+
+    async def generate_chunks() -> AsyncGenerator[str, None]:
+        async for chunk in run_chunks():
+            yield chunk
+            title = title_chunk()
+            if title:
+                yield title
+
+        # The run is only reported finished once its messages are on disk
+        try:
+            await message_writer.flush(conversation_id)
+        except Exception:
+            yield sse_frame({"type": "error", "data": {"detail": "Failed to save messages"}})
+            return
+        # A title that is still generating is stored by its task, the client
+        # refetches the conversations when the stream ends
+        title = title_chunk()
+        if title:
+            yield title
+        yield sse_frame({"type": "done", "data": {"conversation_id": conversation_id}})
 
     return StreamingResponse(
         generate_chunks(),
@@ -162,10 +209,10 @@ async def chat(
 
 
 @chats_router.post("/conversations/", response_model=dict)
-def create_conversation(
+async def create_conversation(
     request: Request,
     conversation: ConversationCreate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     # Users can only create conversations for themselves
     current_user = request.state.user
@@ -175,7 +222,7 @@ def create_conversation(
             detail="Access denied: You can only create conversations for yourself",
         )
 
-    user = session.get(User, conversation.user_id)
+    user = await session.get(User, conversation.user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
@@ -183,19 +230,19 @@ def create_conversation(
         title=conversation.title, user_id=conversation.user_id
     )
     session.add(db_conversation)
-    session.commit()
-    session.refresh(db_conversation)
+    await session.commit()
+    await session.refresh(db_conversation)
     return {"status": "success", "conversation": db_conversation}
 
 
 @chats_router.get("/conversations/{conversation_id}", response_model=dict)
-def read_conversation(
+async def read_conversation(
     request: Request,
     conversation_id: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     current_user = request.state.user
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -210,10 +257,10 @@ def read_conversation(
 
 
 @chats_router.get("/users/{user_id}/conversations", response_model=dict)
-def read_user_conversations(
+async def read_user_conversations(
     request: Request,
     user_id: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     current_user = request.state.user
     # Users can only access their own conversations
@@ -223,20 +270,25 @@ def read_user_conversations(
             detail="Access denied: You can only view your own conversations",
         )
 
-    user = session.get(User, user_id)
+    user = await session.get(User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
-    return {"status": "success", "conversations": user.conversations}
+    conversations = await session.exec(
+        select(Conversation)
+        .where(Conversation.user_id == user_id)
+        .order_by(Conversation.updated_at.desc())
+    )
+    return {"status": "success", "conversations": conversations.all()}
 
 
 @chats_router.post("/messages/", response_model=dict)
-def create_message(
+async def create_message(
     request: Request,
     message: MessageCreate,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     current_user = request.state.user
-    conversation = session.get(Conversation, message.conversation_id)
+    conversation = await session.get(Conversation, message.conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -251,21 +303,22 @@ def create_message(
         content=message.content,
         is_user_message=message.is_user_message,
         conversation_id=message.conversation_id,
+        token_estimate=estimate_tokens(message.content),
     )
     session.add(db_message)
-    session.commit()
-    session.refresh(db_message)
+    await session.commit()
+    await session.refresh(db_message)
     return {"status": "success", "message": db_message}
 
 
 @chats_router.get("/conversations/{conversation_id}/messages", response_model=dict)
-def read_conversation_messages(
+async def read_conversation_messages(
     request: Request,
     conversation_id: str,
-    session: Session = Depends(get_session),
+    session: AsyncSession = Depends(get_async_session),
 ):
     current_user = request.state.user
-    conversation = session.get(Conversation, conversation_id)
+    conversation = await session.get(Conversation, conversation_id)
     if not conversation:
         raise HTTPException(status_code=404, detail="Conversation not found")
 
@@ -276,11 +329,74 @@ def read_conversation_messages(
             detail="Access denied: You can only view messages from your own conversations",
         )
 
-    return {"status": "success", "messages": conversation.messages}
+    messages = await get_conversation_messages(session, conversation_id)
+    return {
+        "status": "success",
+        "messages": await inline_tool_result_blobs(session, messages),
+    }
+
+
+@chats_router.patch("/conversations/{conversation_id}/compaction", response_model=dict)
+async def update_conversation_compaction(
+    request: Request,
+    conversation_id: str,
+    settings: CompactionSettings,
+    session: AsyncSession = Depends(get_async_session),
+):
+    current_user = request.state.user
+    conversation = await session.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Users can only change their own conversations
+    if conversation.user_id != current_user.uid:
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied: You can only change your own conversations",
+        )
+
+    if settings.enabled is not None:
+        conversation.compaction_enabled = settings.enabled
+    if settings.token_threshold is not None:
+        conversation.compaction_token_threshold = settings.token_threshold
+    session.add(conversation)
+    await session.commit()
+    return {"status": "success", "conversation": conversation}
+
+
+@chats_router.get("/conversations/{conversation_id}/artifacts/{artifact_id}")
+async def download_artifact(
+    request: Request,
+    conversation_id: str,
+    artifact_id: str,
+    session: AsyncSession = Depends(get_async_session),
+):
+    """Downloads a file saved during a run, e.g. interpreter output too long for the chat."""
+    current_user = request.state.user
+    conversation = await session.get(Conversation, conversation_id)
+    if not conversation:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+
+    # Users can only download artifacts from their own conversations
+    if conversation.user_id != current_user.uid:
+        raise HTTPException(
+            status_code=403,
+            detail="Access denied: You can only download files from your own conversations",
+        )
+
+    path = artifact_path(conversation_id, artifact_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Artifact not found or expired")
+    return FileResponse(path, media_type="text/plain; charset=utf-8", filename=f"{artifact_id}.txt")
 
 
 def event_to_json_string(event):
     """Convert event objects to JSON string."""
+    return json.dumps(event_to_payload(event))
+
+
+def event_to_payload(event) -> dict:
+    """The {"type", "data"} payload sent to the client for an event, see `sse_frame`."""
     event_type = "part_start"
     if isinstance(event, PartDeltaEvent):
         event_type = "part_delta"
@@ -289,8 +405,7 @@ def event_to_json_string(event):
     elif isinstance(event, FunctionToolResultEvent):
         event_type = "tool_result"
 
-    event_dict = {"type": event_type, "data": event_to_dict(event)}
-    return json.dumps(event_dict)
+    return {"type": event_type, "data": event_to_dict(event)}
 
 
 def event_from_json_string(json_str):
@@ -421,141 +536,109 @@ def event_to_dict(event):
     return vars(event)
 
 
-def model_message_to_dict(message: Union[ModelRequest, ModelResponse]) -> dict:
-    """Convert a ModelRequest or ModelResponse to a dictionary for storage"""
-
-    def part_to_dict(part):
-        if isinstance(part, ToolCallPart):
-            content = {
-                "name": part.tool_name,
-                "args": part.args,
-                "tool_call_id": part.tool_call_id,
-            }
-        elif isinstance(part, ReasoningPart):
-            content = part.reasoning
-        elif isinstance(part, UserPromptPart):
-            content = part.content
-        elif isinstance(part, TextPart):
-            content = part.content
-        elif isinstance(part, SystemPromptPart):
-            content = part.content
-        elif isinstance(part, RetryPromptPart):
-            content = part.content
-        elif isinstance(part, ToolReturnPart):
-            # print("I am here", part)
-            content = {
-                "name": part.tool_name,
-                "content": part.content,
-                "tool_call_id": part.tool_call_id,
-            }
-        return {
-            "type": part.__class__.__name__,
-            "content": content,
-            "part_kind": part.part_kind if hasattr(part, "part_kind") else "text",
-        }
-
-    if isinstance(message, ModelRequest):
-        return {
-            "type": "model_request",
-            "parts": [part_to_dict(part) for part in message.parts],
-            "kind": message.kind,
-        }
-    else:  # ModelResponse
-        return {
-            "type": "model_response",
-            "parts": [part_to_dict(part) for part in message.parts],
-            "model_name": message.model_name,
-            "timestamp": message.timestamp.isoformat() if message.timestamp else None,
-            "kind": message.kind,
-        }
-
-
-def dict_to_model_message(data: dict) -> Union[ModelRequest, ModelResponse]:
-    """Convert a dictionary back to a ModelRequest or ModelResponse"""
-    parts = []
-    for part_data in data["parts"]:
-        if part_data["type"] == "ToolCallPart":
-            # print(part_data)
-            parts.append(
-                ToolCallPart(
-                    tool_name=part_data["content"].get("name"),
-                    args=part_data["content"].get("args"),
-                    tool_call_id=part_data["content"].get("tool_call_id"),
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-        elif part_data["type"] == "ReasoningPart":
-            parts.append(
-                ReasoningPart(
-                    reasoning=part_data["content"],
-                    part_kind=part_data.get("part_kind", "reasoning"),
-                )
-            )
-        elif part_data["type"] == "UserPromptPart":
-            parts.append(
-                UserPromptPart(
-                    content=part_data["content"],
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-        elif part_data["type"] == "TextPart":
-            parts.append(
-                TextPart(
-                    content=part_data["content"],
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-        elif part_data["type"] == "SystemPromptPart":
-            parts.append(
-                SystemPromptPart(
-                    content=part_data["content"],
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-        elif part_data["type"] == "RetryPromptPart":
-            parts.append(
-                RetryPromptPart(
-                    content=part_data["content"],
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-        elif part_data["type"] == "ToolReturnPart":
-            parts.append(
-                ToolReturnPart(
-                    tool_name=part_data["content"].get("name"),
-                    content=part_data["content"].get("content"),
-                    tool_call_id=part_data["content"].get("tool_call_id"),
-                    part_kind=part_data.get("part_kind", "text"),
-                )
-            )
-    if data["type"] == "model_request":
-        return ModelRequest(parts=parts, kind="request")
-    else:  # model_response
-        return ModelResponse(
-            parts=parts,
-            model_name=data.get("model_name"),
-            timestamp=datetime.fromisoformat(data["timestamp"])
-            if data.get("timestamp")
-            else datetime.now(),
-            kind="response",
+async def get_conversation_messages(
+    session: AsyncSession, conversation_id: str
+) -> List[DBMessage]:
+    """Load a conversation's stored messages in creation order"""
+    messages = await session.exec(
+        select(DBMessage)
+        .where(DBMessage.conversation_id == conversation_id)
+        .order_by(DBMessage.created_at)
+    )
+    return list(messages.all())
+
+
+def start_background_task(coroutine: Coroutine) -> asyncio.Task:
+    """Run a coroutine in the background, independent of the request that started it"""
+    task = asyncio.create_task(coroutine)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+def placeholder_title(prompt: str) -> str:
+    """Title shown until the generated one is ready, the start of the prompt"""
+    title = " ".join(prompt.split())
+    return title if len(title) <= 60 else title[:57] + "..."
+
+
+async def generate_title(conversation_id: str, prompt: str) -> Optional[str]:
+    """Generate a conversation's title with Gemini and store it, returns None on failure"""
+    try:
+        title = await gemini(prompt)
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            conversation = await session.get(Conversation, conversation_id)
+            if conversation is None:
+                return None
+            conversation.title = title
+            session.add(conversation)
+            await session.commit()
+        return title
+    except Exception:
+        logging.exception(f"Failed to generate a title for conversation {conversation_id}")
+        return None
+
+
+async def lookup_memory(user_id: str, prompt: str) -> Tuple[str, str]:
+    """Memories relevant to the prompt, searched off the event loop and given up on after MEMORY_LOOKUP_TIMEOUT"""
+    try:
+        return await asyncio.wait_for(
+            asyncio.to_thread(get_memory_no_context, user_id, prompt),
+            timeout=MEMORY_LOOKUP_TIMEOUT,
         )
+    except asyncio.TimeoutError:
+        logging.warning(f"Memory lookup took longer than {MEMORY_LOOKUP_TIMEOUT}s, continuing without it")
+        # A backend this slow counts towards marking memory unavailable
+        memory_client.record_failure(f"lookup took longer than {MEMORY_LOOKUP_TIMEOUT}s")
+        return "Memory lookup timed out.", ""
+
+
+def to_db_message(
+    message: Union[ModelRequest, ModelResponse], conversation_id: str
+) -> Tuple[DBMessage, Dict[str, Blob]]:
+    """Serialize a model message for storage, returning it with the blobs it references"""
+    blobs: Dict[str, Blob] = {}
+    payload, size = encode_message(message, blobs)
+    return (
+        DBMessage(
+            content="",
+            codec=CODEC_V1,
+            payload=payload,
+            is_user_message=False,
+            conversation_id=conversation_id,
+            # Estimated on the full content, the model sees blobs inlined
+            token_estimate=size // 4 + 1 + sum(blob.size for blob in blobs.values()) // 4,
+        ),
+        blobs,
+    )
 
 
-def get_message_history(conversation: Conversation) -> List[ModelMessage]:
-    """Convert stored conversation messages into a list of ModelMessages for the model"""
-    message_history = []
-
-    # Sort messages by creation time to maintain order
-    sorted_messages = sorted(conversation.messages, key=lambda m: m.created_at)
-
-    for message in sorted_messages:
-        try:
-            # Parse the JSON string stored in message content
-            message_data = json.loads(message.content)
-            model_message = dict_to_model_message(message_data)
-            message_history.append(model_message)
-        except (json.JSONDecodeError, KeyError) as e:
-            print(f"Error processing message {message.id}: {str(e)}")
-            continue
-
-    return message_history
+async def inline_tool_result_blobs(
+    session: AsyncSession, messages: List[DBMessage]
+) -> List[dict]:
+    """Stored messages as dicts for the client, in the legacy JSON shape with tool result blobs inlined"""
+    # Only rows that are binary or reference blobs need decoding, plain text rows pass through
+    decode = [
+        message
+        for message in messages
+        if message.codec == CODEC_V1 or '"$blob"' in message.content
+    ]
+    # The client shows messages as stored, system prompts included
+    decoded = await load_model_messages(
+        session,
+        [(message.id, message.codec, message.content, message.payload) for message in decode],
+        include_system_prompt=True,
+    )
+    contents = {
+        message.id: json.dumps(model_message_to_dict(model_message))
+        for message, model_message in zip(decode, decoded)
+        if model_message is not None
+    }
+
+    result = []
+    for message in messages:
+        message_dict = message.model_dump(exclude={"payload"})
+        if message.id in contents:
+            message_dict["content"] = contents[message.id]
+        result.append(message_dict)
+    return result
@@ -1,3 +1,4 @@
+import asyncio
 from fastapi import APIRouter, HTTPException, Request, Depends, UploadFile, File
 from firebase_admin import auth, storage
 from helpers.Firebase_helpers import Token
@@ -20,10 +21,10 @@ async def login_for_access_token(credentials: UserCredentials):
     """
     try:
         # Sign in with Firebase Auth
-        user = auth.get_user_by_email(credentials.email)
+        user = await asyncio.to_thread(auth.get_user_by_email, credentials.email)
 
         # Create a custom token
-        custom_token = auth.create_custom_token(user.uid)
+        custom_token = await asyncio.to_thread(auth.create_custom_token, user.uid)
 
         # In a real application, you would exchange this for an ID token
         # Here we're using it directly for simplicity in Swagger UI testing
@@ -49,12 +50,12 @@ async def login_oauth(form_data: OAuth2PasswordRequestForm = Depends()):
     """
     try:
         # Sign in with Firebase Auth
-        user = auth.get_user_by_email(
-            form_data.username
+        user = await asyncio.to_thread(
+            auth.get_user_by_email, form_data.username
         )  # Using username field for email
 
         # Create a custom token
-        custom_token = auth.create_custom_token(user.uid)
+        custom_token = await asyncio.to_thread(auth.create_custom_token, user.uid)
 
         return {
             "access_token": custom_token.decode("utf-8")
@@ -122,7 +123,8 @@ async def upload_profile_picture(
         
         # Upload file
         try:
-            blob.upload_from_string(
+            await asyncio.to_thread(
+                blob.upload_from_string,
                 file_content,
                 content_type=file.content_type
             )
@@ -135,7 +137,7 @@ async def upload_profile_picture(
 
         
         # Make the file publicly accessible
-        blob.make_public()
+        await asyncio.to_thread(blob.make_public)
 
         print("made it here 3")
         
@@ -143,7 +145,8 @@ async def upload_profile_picture(
         public_url = blob.public_url
         
         # Update user's profile picture URL in Firebase Auth
-        auth.update_user(
+        await asyncio.to_thread(
+            auth.update_user,
             current_user.uid,
             photo_url=public_url
         )
@@ -0,0 +1,4 @@
+import os
+
+# helpers.helper_funcs builds its Gemini agents on import, tests never call them
+os.environ.setdefault("GEMINI_API_KEY", "test")
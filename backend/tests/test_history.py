@@ -0,0 +1,238 @@
+import asyncio
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from ai import history
+from ai.history import (
+    get_compacted_history,
+    get_message_history,
+    trim_to_complete_turns,
+    with_system_prompt,
+)
+from ai.message_codec import CODEC_V1, encode_message
+from ai.models import Blob, Conversation, Message
+from custom.messages import (
+    ModelMessage,
+    ModelRequest,
+    ModelResponse,
+    SystemPromptPart,
+    TextPart,
+    ToolCallPart,
+    ToolReturnPart,
+    UserPromptPart,
+)
+
+CONVERSATION_ID = "conversation"
+
+
+def user(prompt: str, system: str = "") -> ModelRequest:
+    parts = [SystemPromptPart(content=system)] if system else []
+    return ModelRequest(parts=[*parts, UserPromptPart(content=prompt)])
+
+
+def answer(text: str) -> ModelResponse:
+    return ModelResponse(parts=[TextPart(content=text)])
+
+
+def call(tool_call_id: str) -> ModelResponse:
+    return ModelResponse(parts=[ToolCallPart(tool_name="search", args={}, tool_call_id=tool_call_id)])
+
+
+def result(tool_call_id: str, content: str = "found") -> ModelRequest:
+    return ModelRequest(
+        parts=[ToolReturnPart(tool_name="search", content=content, tool_call_id=tool_call_id)]
+    )
+
+
+def texts(messages: List[ModelMessage]) -> List[str]:
+    """The prompt, answer or tool call id each message carries, to compare windows by"""
+    rendered = []
+    for message in messages:
+        for part in message.parts:
+            if isinstance(part, (UserPromptPart, TextPart)):
+                rendered.append(part.content)
+            elif isinstance(part, (ToolCallPart, ToolReturnPart)):
+                rendered.append(f"{type(part).__name__}:{part.tool_call_id}")
+    return rendered
+
+
+def in_database(messages: List[ModelMessage], token_estimates: List[int], load: Callable) -> Any:
+    """Stores the messages in a fresh database and returns what load(session) returns"""
+
+    async def run() -> Any:
+        engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+        async with engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            for message, token_estimate in zip(messages, token_estimates):
+                blobs: Dict[str, Blob] = {}
+                payload, _ = encode_message(message, blobs)
+                session.add_all(blobs.values())
+                session.add(
+                    Message(
+                        codec=CODEC_V1,
+                        payload=payload,
+                        is_user_message=False,
+                        conversation_id=CONVERSATION_ID,
+                        token_estimate=token_estimate,
+                    )
+                )
+                # One commit per message keeps ids in conversation order
+                await session.commit()
+            result = await load(session)
+        await engine.dispose()
+        return result
+
+    return asyncio.run(run())
+
+
+def load_history(messages: List[ModelMessage], token_estimates: List[int], **kwargs) -> List[ModelMessage]:
+    return in_database(
+        messages,
+        token_estimates,
+        lambda session: get_message_history(session, CONVERSATION_ID, **kwargs),
+    )
+
+
+CONVERSATION = [
+    user("first question", system="You are helpful"),
+    answer("first answer"),
+    user("second question"),
+    call("a"),
+    result("a"),
+    answer("second answer"),
+    user("third question"),
+    answer("third answer"),
+]
+
+
+def test_trim_starts_at_user_turn():
+    messages = [result("a"), answer("old answer"), user("question"), answer("answer")]
+    assert texts(trim_to_complete_turns(messages)) == ["question", "answer"]
+
+
+def test_trim_drops_trailing_call_without_return():
+    messages = [user("question"), call("a")]
+    assert texts(trim_to_complete_turns(messages)) == ["question"]
+
+
+def test_trim_without_user_turn_skips_orphaned_returns():
+    messages = [result("a"), answer("answer")]
+    assert texts(trim_to_complete_turns(messages)) == ["answer"]
+
+
+def test_with_system_prompt_merges_into_opening_request():
+    merged = with_system_prompt(
+        user("stale question", system="You are helpful"), [user("question"), answer("answer")]
+    )
+    assert len(merged) == 2
+    assert isinstance(merged[0].parts[0], SystemPromptPart)
+    assert texts(merged) == ["question", "answer"]
+
+
+def test_with_system_prompt_without_system_part():
+    messages = [user("question")]
+    assert with_system_prompt(user("stale question"), messages) == messages
+
+
+def test_whole_conversation_fits():
+    history = load_history(CONVERSATION, [10] * len(CONVERSATION))
+    assert texts(history) == texts(CONVERSATION)
+    assert isinstance(history[0].parts[0], SystemPromptPart)
+
+
+def test_budget_keeps_newest_turns_and_system_prompt_only():
+    history = load_history(CONVERSATION, [10] * len(CONVERSATION), token_budget=60)
+    assert texts(history) == [
+        "second question",
+        "ToolCallPart:a",
+        "ToolReturnPart:a",
+        "second answer",
+        "third question",
+        "third answer",
+    ]
+    # The stale first prompt is gone, its system prompt leads the first request
+    assert isinstance(history[0], ModelRequest)
+    assert isinstance(history[0].parts[0], SystemPromptPart)
+    assert not any(
+        isinstance(earlier, ModelRequest) and isinstance(later, ModelRequest)
+        for earlier, later in zip(history, history[1:])
+    )
+
+
+def test_budget_cutting_a_turn_starts_at_next_turn():
+    history = load_history(CONVERSATION, [10] * len(CONVERSATION), token_budget=40)
+    assert texts(history) == ["third question", "third answer"]
+
+
+def test_max_messages():
+    history = load_history(CONVERSATION, [10] * len(CONVERSATION), max_messages=2)
+    assert texts(history) == ["third question", "third answer"]
+
+
+def test_newest_turn_over_budget_is_still_sent():
+    messages = [
+        user("first question", system="You are helpful"),
+        answer("first answer"),
+        user("big question"),
+        call("a"),
+        result("a", content="x" * 20000),
+        answer("big answer"),
+    ]
+    history = load_history(messages, [10, 10, 10, 10, 5000, 10], token_budget=100)
+    assert texts(history) == ["big question", "ToolCallPart:a", "ToolReturnPart:a", "big answer"]
+    assert isinstance(history[0].parts[0], SystemPromptPart)
+    # The oversized tool result is stubbed
+    assert history[2].parts[0].content.startswith("[Elided search result")
+
+
+def test_newest_message_over_budget_in_first_turn():
+    messages = [user("question", system="You are helpful"), answer("y" * 20000)]
+    history = load_history(messages, [10, 5000], token_budget=100)
+    assert texts(history) == ["question", "y" * 20000]
+    assert [type(part) for part in history[0].parts] == [SystemPromptPart, UserPromptPart]
+
+
+def test_after_id_leaves_out_summarized_messages():
+    history = load_history(CONVERSATION, [10] * len(CONVERSATION), after_id=6)
+    assert texts(history) == ["third question", "third answer"]
+    assert isinstance(history[0].parts[0], SystemPromptPart)
+
+
+def test_empty_conversation():
+    assert load_history([], []) == []
+
+
+def test_compaction_keeps_the_opening_question(monkeypatch):
+    transcripts = []
+
+    async def summarize(previous_summary: str, transcript: str) -> str:
+        transcripts.append(transcript)
+        return f"Summary of: {transcript}"
+
+    monkeypatch.setattr(history, "summarize_conversation", summarize)
+    monkeypatch.setattr(history, "COMPACTION_KEEP_TOKENS", 20)
+    conversation = Conversation(
+        id=CONVERSATION_ID, title="Test", user_id="user", compaction_token_threshold=50
+    )
+
+    async def compact(session: AsyncSession) -> List[ModelMessage]:
+        session.add(conversation)
+        await session.commit()
+        return await get_compacted_history(session, conversation)
+
+    compacted = in_database(CONVERSATION, [10] * len(CONVERSATION), compact)
+    # The opening question is summarized, its system prompt is not
+    assert len(transcripts) == 1
+    assert "User: first question" in transcripts[0]
+    assert "You are helpful" not in transcripts[0]
+
+    assert texts(compacted) == ["third question", "third answer"]
+    system_prompt, summary = compacted[0].parts[:2]
+    assert isinstance(system_prompt, SystemPromptPart)
+    assert system_prompt.content == "You are helpful"
+    assert "first question" in summary.content
@@ -0,0 +1,94 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+import helpers.MessageWriter as message_writer_module
+from ai.models import Message
+from helpers.MessageWriter import MessageWriter
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+
+    async def create() -> None:
+        async with engine.begin() as connection:
+            await connection.run_sync(SQLModel.metadata.create_all)
+
+    asyncio.run(create())
+    monkeypatch.setattr(message_writer_module, "async_engine", engine)
+    # Failures are expected, skip the backoff between attempts
+    monkeypatch.setattr(message_writer_module, "WRITE_ATTEMPTS", 1)
+    return engine
+
+
+async def stored(engine, conversation_id: str) -> list:
+    async with AsyncSession(engine) as session:
+        rows = await session.exec(
+            select(Message.content).where(Message.conversation_id == conversation_id)
+        )
+        return list(rows.all())
+
+
+def message(conversation_id: str, content: str, message_id=None) -> Message:
+    return Message(id=message_id, content=content, conversation_id=conversation_id)
+
+
+def test_flush_after_successful_writes(engine):
+    async def run() -> None:
+        writer = MessageWriter()
+        writer.enqueue(message("a", "one"))
+        writer.enqueue(message("a", "two"))
+        await writer.flush("a")
+        assert await stored(engine, "a") == ["one", "two"]
+        await writer.stop()
+
+    asyncio.run(run())
+
+
+def test_failed_earlier_batch_makes_later_flush_raise(engine):
+    async def run() -> None:
+        writer = MessageWriter()
+        writer.enqueue(message("a", "existing", message_id=1))
+        await writer.flush("a")
+
+        # Same primary key, this batch cannot be written
+        writer.enqueue(message("b", "duplicate", message_id=1))
+        # A flush of another conversation ends the batch without reporting the failure
+        await writer.flush("a")
+
+        writer.enqueue(message("b", "later"))
+        with pytest.raises(Exception):
+            await writer.flush("b")
+        assert await stored(engine, "b") == ["later"]
+
+        # Reported once, the conversation's next flush succeeds again
+        await writer.flush("b")
+        await writer.stop()
+
+    asyncio.run(run())
+
+
+def test_bad_row_only_drops_its_own_conversation(engine):
+    async def run() -> None:
+        writer = MessageWriter()
+        writer.enqueue(message("a", "existing", message_id=1))
+        await writer.flush("a")
+
+        # Both land in one batch, the group commit fails on b's row
+        writer.enqueue(message("c", "kept"))
+        writer.enqueue(message("b", "duplicate", message_id=1))
+        flushes = await asyncio.gather(
+            writer.flush("c"), writer.flush("b"), return_exceptions=True
+        )
+        assert flushes[0] is None
+        assert isinstance(flushes[1], Exception)
+        assert await stored(engine, "c") == ["kept"]
+        assert await stored(engine, "b") == []
+        await writer.stop()
+
+    asyncio.run(run())
@@ -13,6 +13,15 @@ export interface Message {
     role: string;
     content: (TextContent | ImageContent)[] | String | {name: string};
     reasoning?: string;
+    // Streamed output of a running tool, and the file holding all of it when it was too long
+    output?: string;
+    artifact?: Artifact;
+  }
+
+export interface Artifact {
+    id: string;
+    url: string;
+    size: number;
   }
 
 
@@ -4,7 +4,7 @@ import WaveIcon from "./WaveIcon";
 import Prism from "prismjs";
 import "./index.css";
 // import 'prismjs/components/prism-python'
-import { Message } from "../models/models";
+import { Artifact, Message } from "../models/models";
 import MicrophoneVisualizer from "../../components/MicrophoneVisualizer";
 import { useSidebar } from "@/components/ui/sidebar";
 import { useChatContext } from "@/layout";
@@ -350,6 +350,27 @@ function ChatWindow() {
               } else if (data.type === "tool_result") {
                 newToolResultMessage.content = data.data.tool_result;
                 updatedMessages.push(newToolResultMessage);
+              } else if (data.type === "tool_progress") {
+                // Output of a tool while it runs, e.g. python_interpreter prints
+                const toolCall = [...updatedMessages]
+                  .reverse()
+                  .find(
+                    (m) =>
+                      m.role === "tool_call" &&
+                      (m.content as { tool_call_id?: string }).tool_call_id ===
+                        data.data.tool_call_id
+                  );
+                if (toolCall) {
+                  if (data.data.output) {
+                    toolCall.output = (toolCall.output || "") + data.data.output;
+                  }
+                  if (data.data.artifact) {
+                    toolCall.artifact = data.data.artifact;
+                  }
+                }
+              } else if (data.type === "title") {
+                // The generated title of a new conversation is ready
+                fetchConversations();
               }
               // console.log("newMessages", updatedMessages);
               setMessages([...updatedMessages]); // Trigger re-render with the updated array
@@ -438,6 +459,21 @@ function ChatWindow() {
     setGettingResponse(false);
   };
 
+  const downloadArtifact = async (artifact: Artifact) => {
+    const { authFetch } = await import("@/lib/utils");
+    const response = await authFetch(`${HOST}${artifact.url}`);
+    if (!response.ok) {
+      console.error(`Artifact download failed: ${response.status}`);
+      return;
+    }
+    const href = URL.createObjectURL(await response.blob());
+    const link = document.createElement("a");
+    link.href = href;
+    link.download = `${artifact.id}.txt`;
+    link.click();
+    URL.revokeObjectURL(href);
+  };
+
   useEffect(() => {
     // height of last message must content he + 80% of parent height calculate then set as pixels
     const lastMessage = document.getElementById("last-message");
@@ -518,16 +554,37 @@ function ChatWindow() {
                     )}
                   </div>
                 </div>
+              ) : message.role === "tool_call" && message.artifact ? (
+                <div
+                  key={index}
+                  className="md:max-w-[900px] w-full flex justify-start"
+                >
+                  <button
+                    className="ml-5 pl-4 text-sm text-gray-500 underline"
+                    onClick={() => downloadArtifact(message.artifact as Artifact)}
+                  >
+                    Download full output (
+                    {Math.ceil((message.artifact as Artifact).size / 1024)} KB)
+                  </button>
+                </div>
               ) : null
             )}
             {messages.length > 0 &&
               messages[messages.length - 1].role === "tool_call" && (
                 <div className="md:max-w-[900px] w-full flex justify-start min-h-full">
-                  <span className="wave-text ml-5 pl-4">
-                    {((
-                      messages[messages.length - 1].content as { name: string }
-                    ).name as string) || "processing..."}
-                  </span>
+                  <div className="flex flex-col w-full">
+                    <span className="wave-text ml-5 pl-4">
+                      {((
+                        messages[messages.length - 1].content as { name: string }
+                      ).name as string) || "processing..."}
+                    </span>
+                    {messages[messages.length - 1].output && (
+                      <pre className="ml-5 mt-2 max-h-64 overflow-y-auto whitespace-pre-wrap rounded-lg bg-gray-100 dark:bg-gray-800 p-3 text-xs text-gray-700 dark:text-gray-300">
+                        {/* The end of the output, long runs keep printing */}
+                        {(messages[messages.length - 1].output as string).slice(-8000)}
+                      </pre>
+                    )}
+                  </div>
                 </div>
               )}
             {messages.length > 0 &&